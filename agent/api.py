@@ -1,8 +1,11 @@
-from typing import Annotated, Dict, Any, Optional
+import asyncio
+from typing import Annotated, Dict, Any, List, Literal, Optional, Union
 
-from fastapi import APIRouter, Depends, Security, HTTPException, status
+from fastapi import APIRouter, Depends, Query, Request, Security, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, StrictBool, StrictInt
 from loguru import logger
 
 from agent.config import settings
@@ -10,14 +13,48 @@ from agent.config import settings
 from agent.services.db_inspector import db_inspector
 from agent.services.query_executor import query_executor
 from agent.services.data_profiler import data_profiler # <-- НОВЫЙ
-from agent.schemas import EnrichedExecutionResult, TableProfile # <-- ОБНОВИТЬ
+from agent.services.cache_query import cache_query_engine
+from agent.services.cache_sql import cache_sql_engine
+from agent.services.sandbox_scheduler import sandbox_scheduler
+from agent.services.session_manager import session_manager
+from agent.services.query_log import slow_query_log
+from agent.services.batch_executor import batch_executor
+from agent.services.pipeline_runner import pipeline_runner
+from agent.services.job_manager import job_manager, JobQueueFullError
+from agent.services.data_cache import agent_cache
+from agent.services.result_json import dumps, encode_pipeline_result, encode_result
+from agent.services.cache_transfer import (
+    cache_transfer, ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE
+)
+from agent.schemas import (  # <-- ОБНОВИТЬ
+    EnrichedExecutionResult, TableProfile, CacheQueryRequest, SessionExecutionResult, ApproximateOptions,
+    PipelineRequest, PipelineResult, PartitionSpec,
+)
 
 router = APIRouter()
 
 # --- Pydantic Схемы ---
+# Значение параметра SQL-запроса: скаляр JSON или список скаляров (для `= ANY(:ids)`).
+# Даты передаются строками, PostgreSQL приводит их к типу столбца.
+SQLParamScalar = Union[StrictBool, StrictInt, float, str, None]
+SQLParamValue = Union[SQLParamScalar, List[SQLParamScalar]]
+
 class ExecuteCodeRequest(BaseModel):
     language: str = Field(..., description="Язык программирования ('python' или 'sql').")
     code: str = Field(..., description="Код для выполнения.")
+    materialize_only: bool = Field(False, description="Только для SQL: выгрузить результат в кеш через COPY и вернуть cache_key и метаданные без строк.")
+    timeout_seconds: Optional[float] = Field(None, gt=0, description="Только для SQL: дедлайн запроса в секундах (не больше SQL_STATEMENT_TIMEOUT_SECONDS).")
+    explain: Optional[Literal["plan", "analyze"]] = Field(None, description="Только для SQL: вернуть дерево плана в metadata.explain ('analyze' повторно выполняет запрос с EXPLAIN ANALYZE).")
+    params: Optional[Dict[str, SQLParamValue]] = Field(None, description="Только для SQL: значения для плейсхолдеров `:name` в запросе.")
+    summary_only: bool = Field(False, description="Только для SQL: посчитать статистику столбцов агрегатным запросом в базе и вернуть несколько строк-примеров вместо результата.")
+    approximate: Optional[ApproximateOptions] = Field(None, description="Только для SQL: выполнить запрос по выборке (TABLESAMPLE) самой большой таблицы.")
+    watermark_column: Optional[str] = Field(None, description="Только для SQL: зарегистрировать результат в кеше для инкрементального обновления по монотонно растущему столбцу.")
+    resource_class: Optional[str] = Field(None, description="Только для Python: класс ресурсов песочницы из SANDBOX_RESOURCE_CLASSES (по умолчанию - наименьший).")
+
+class BatchExecuteRequest(BaseModel):
+    statements: List[ExecuteCodeRequest] = Field(..., min_length=1, description="Независимые запросы пакета.")
+    concurrency: Optional[int] = Field(None, ge=1, description="Сколько запросов выполнять одновременно (не больше SQL_BATCH_CONCURRENCY).")
+    stream: bool = Field(False, description="Отдавать результаты в формате NDJSON по мере завершения запросов.")
 
 class ExecuteOnDataRequest(BaseModel):
     code: str = Field(..., description="Python-код для выполнения.")
@@ -26,6 +63,45 @@ class ExecuteOnDataRequest(BaseModel):
     # с которым будет работать pandas.
     cache_keys: Optional[Dict[str, str]] = Field(None, description="Словарь, где ключ - имя переменной, а значение - ключ кеша для загрузки DataFrame.")
     input_data: Dict[str, Any] = Field({}, description="Словарь с входными данными в формате JSON (orient='split').")
+    partition_by: Optional[PartitionSpec] = Field(None, description="Разбить один вход на части и выполнить код над ними параллельно в нескольких песочницах.")
+    resource_class: Optional[str] = Field(None, description="Класс ресурсов песочницы из SANDBOX_RESOURCE_CLASSES. По умолчанию выбирается по размеру входных данных.")
+    memoize: bool = Field(True, description="Вернуть сохраненный результат, если этот код уже выполнялся над теми же входами. Код с get_db_connection не мемоизируется.")
+
+class ExecuteJobRequest(BaseModel):
+    kind: Literal["execute"]
+    request: ExecuteCodeRequest
+
+class ExecuteOnDataJobRequest(BaseModel):
+    kind: Literal["execute_on_data"]
+    request: ExecuteOnDataRequest
+
+class ProfileJobRequest(BaseModel):
+    kind: Literal["profile"]
+    table_name: str = Field(..., description="Таблица для профилирования.")
+
+JobRequest = Annotated[
+    Union[ExecuteJobRequest, ExecuteOnDataJobRequest, ProfileJobRequest], Field(discriminator="kind")
+]
+
+class CreateSessionRequest(BaseModel):
+    idle_timeout_seconds: Optional[int] = Field(None, gt=0, description="Через сколько секунд простоя сессия будет закрыта.")
+
+class SessionExecuteRequest(BaseModel):
+    code: str = Field(..., description="Python-код шага. Переменные прошлых шагов доступны по именам.")
+    cache_keys: Optional[Dict[str, str]] = Field(None, description="Данные из кеша, которые нужно добавить в словарь `input_data`.")
+    persist: List[str] = Field([], description="Имена DataFrame-переменных, которые нужно сохранить в кеш после шага.")
+
+class CachePolicyRequest(BaseModel):
+    ttl_seconds: Optional[float] = Field(None, gt=0, description="Время жизни записи в секундах от последнего обращения.")
+    priority: Optional[int] = Field(None, description="Приоритет при вытеснении по размеру: записи с меньшим приоритетом удаляются первыми.")
+
+class CachePinRequest(BaseModel):
+    holder: str = Field("api", min_length=1, description="Кто закрепляет запись. Закрепления разных держателей независимы.")
+    ttl_seconds: Optional[float] = Field(None, gt=0, description="Через сколько секунд закрепление снимается само. Без значения - бессрочно.")
+
+class CacheSQLRequest(BaseModel):
+    sql: str = Field(..., description="Read-only SQL, ссылающийся на результаты из кеша через cache('<key>').")
+    save_result: bool = Field(True, description="Сохранить результат в кеш под новым ключом.")
 
 
 # --- Зависимость для проверки секретного токена ---
@@ -61,6 +137,49 @@ async def verify_token(token: Annotated[str, Security(auth_scheme)]):
             detail="Неверный или недействительный токен."
         )
 
+def _raise_on_error(result: Dict[str, Any]) -> None:
+    """
+    Преобразует ответ сервиса со статусом 'error' в HTTPException
+    с подходящим HTTP-кодом.
+    """
+    if result.get("status") != "error":
+        return
+    error_details = result.get("error", {})
+    error_type = error_details.get("type")
+
+    if error_type == "PERMISSION_ERROR":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_details)
+    elif error_type == "UNSUPPORTED_MEDIA_TYPE":
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=error_details)
+    elif error_type == "PAYLOAD_TOO_LARGE":
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=error_details)
+    elif error_type in ("CACHE_MISS_ERROR", "SESSION_NOT_FOUND", "JOB_NOT_FOUND"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=error_details)
+    elif error_type == "SESSION_LIMIT_ERROR":
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=error_details)
+    elif error_type == "QUEUE_FULL_ERROR":
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=error_details,
+            headers={"Retry-After": str(error_details.get("retry_after", 1))}
+        )
+    elif error_type == "QUEUE_TIMEOUT_ERROR":
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=error_details,
+            headers={"Retry-After": str(error_details.get("retry_after", 1))}
+        )
+    else: # Для TIMEOUT_ERROR, EXECUTION_ERROR, SERIALIZATION_ERROR и др.
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_details)
+
+def _json_response(content: bytes) -> Response:
+    """
+    Готовый JSON-ответ. FastAPI отдает его как есть: результат с данными не
+    проверяется повторно по модели из аннотации и не сериализуется заново
+    (см. result_json.encode_result).
+    """
+    return Response(content=content, media_type="application/json")
+
 # --- Эндпоинты API Агента ---
 
 @router.get("/health", summary="Проверка работоспособности агента", tags=["Agent"])
@@ -70,6 +189,27 @@ async def health_check():
     """
     return {"status": "ok", "db_dialect": settings.DB_DIALECT}
 
+@router.get("/stats/sandbox", summary="Метрики очереди песочниц", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def get_sandbox_stats() -> Dict[str, Any]:
+    """
+    Возвращает состояние планировщика песочниц: занятые слоты на хосте,
+    глубину очереди и время ожидания в текущем воркере, число отказов.
+    """
+    return sandbox_scheduler.metrics()
+
+@router.get("/stats/queries", summary="Статистика медленных SQL-запросов", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def get_query_stats(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: Literal["total_time_ms", "count", "p95_ms"] = "total_time_ms",
+    since: Optional[float] = Query(None, description="Учитывать только запросы после этого момента (unix time)."),
+) -> List[Dict[str, Any]]:
+    """
+    Возвращает медленные SQL-запросы, сгруппированные по отпечатку (запрос без
+    литералов): число выполнений, p50/p95 и суммарное время, строки, размер
+    результата и последнюю оценку плана. Отпечатки с наибольшей нагрузкой идут первыми.
+    """
+    return await asyncio.to_thread(slow_query_log.aggregates, limit, order_by, since)
+
 @router.get("/schema", summary="Получить схему базы данных", dependencies=[Depends(verify_token)], tags=["Agent"])
 async def get_database_schema() -> Dict[str, Any]:
     """
@@ -105,29 +245,65 @@ async def get_table_profile(table_name: str):
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка при профилировании таблицы: {e}")
 
 @router.post("/execute", summary="Выполнить код", dependencies=[Depends(verify_token)], tags=["Agent"])
-async def execute_query(payload: ExecuteCodeRequest) -> EnrichedExecutionResult:
+async def execute_query(payload: ExecuteCodeRequest, request: Request) -> EnrichedExecutionResult:
     """
     Выполняет SQL-запрос или Python-код.
-    Защищено токеном.
+    Защищено токеном. Если клиент отключился, SQL-запрос отменяется на сервере БД.
     """
-    result = await query_executor.run(language=payload.language, code=payload.code)
-    
-    if result.get("status") == "error":
-        error_details = result.get("error", {})
-        error_type = error_details.get("type")
+    result = await query_executor.run(
+        language=payload.language,
+        code=payload.code,
+        materialize_only=payload.materialize_only,
+        timeout_seconds=payload.timeout_seconds,
+        is_disconnected=request.is_disconnected,
+        explain=payload.explain,
+        params=payload.params,
+        summary_only=payload.summary_only,
+        approximate=payload.approximate,
+        watermark_column=payload.watermark_column,
+        resource_class=payload.resource_class,
+    )
+    _raise_on_error(result)
+    if result.get("status") == "accepted":
+        # Дорогой запрос перенесен в фоновое задание (SQL_COST_POLICY=job)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(result))
+    return _json_response(encode_result(result))
 
-        if error_type == "PERMISSION_ERROR":
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=error_details
-            )
-        else:
-             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=error_details
-            )
-            
-    return result
+@router.post("/execute/batch", summary="Выполнить пакет запросов", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def execute_batch(payload: BatchExecuteRequest, request: Request):
+    """
+    Выполняет несколько независимых запросов за один HTTP-вызов, не больше
+    `concurrency` одновременно. Ошибка одного запроса не прерывает остальные.
+    Каждый результат содержит `index` запроса в пакете. С `stream: true`
+    результаты отдаются построчно (NDJSON) в порядке завершения.
+    """
+    if len(payload.statements) > settings.SQL_BATCH_MAX_STATEMENTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"type": "QUERY_ERROR", "message": f"В пакете больше {settings.SQL_BATCH_MAX_STATEMENTS} запросов."},
+        )
+    concurrency = min(payload.concurrency or settings.SQL_BATCH_CONCURRENCY, settings.SQL_BATCH_CONCURRENCY)
+    calls = [
+        lambda statement=statement: query_executor.run(**dict(statement), is_disconnected=request.is_disconnected)
+        for statement in payload.statements
+    ]
+    if payload.stream:
+        async def ndjson_lines():
+            async for result in batch_executor.iter_results(calls, concurrency):
+                yield dumps(result) + b"\n"
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+    return _json_response(dumps({"status": "success", "results": await batch_executor.run(calls, concurrency)}))
+
+@router.post("/pipelines", summary="Выполнить конвейер шагов", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def run_pipeline(payload: PipelineRequest, request: Request) -> PipelineResult:
+    """
+    Выполняет DAG из SQL- и Python-шагов за один вызов: шаг запускается, как
+    только готовы его входы, промежуточные результаты остаются в памяти агента.
+    Кешируются и возвращаются только шаги из `outputs`.
+    """
+    result = await pipeline_runner.run(payload, is_disconnected=request.is_disconnected)
+    _raise_on_error(result)
+    return _json_response(encode_pipeline_result(result))
 
 @router.post(
     "/execute-on-data", 
@@ -143,20 +319,252 @@ async def execute_on_data(payload: ExecuteOnDataRequest) -> EnrichedExecutionRes
     - **input_data**: Словарь, где каждый ключ - это имя DataFrame, а значение - 
       его JSON-представление (`orient='split'`). Внутри кода эти данные будут 
       доступны через словарь `input_data`.
+    - **partition_by**: вход разбивается на части, код выполняется над ними
+      параллельно, результаты склеиваются (или передаются в `combine_code`).
     """
     result = await query_executor.run_python_on_data(
         python_code=payload.code,
         input_data=payload.input_data,
-        cache_keys=payload.cache_keys  # <-- ДОБАВЛЕНА ЭТА СТРОКА
+        cache_keys=payload.cache_keys,  # <-- ДОБАВЛЕНА ЭТА СТРОКА
+        partition_by=payload.partition_by,
+        resource_class=payload.resource_class,
+        memoize=payload.memoize,
     )
-    
-    if result.get("status") == "error":
-        error_details = result.get("error", {})
-        error_type = error_details.get("type")
-
-        if error_type == "PERMISSION_ERROR":
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=error_details)
-        else: # Для TIMEOUT_ERROR, EXECUTION_ERROR, SERIALIZATION_ERROR и др.
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_details)
-            
+    _raise_on_error(result)
+    return _json_response(encode_result(result))
+
+@router.put("/cache", summary="Загрузить данные в кеш", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def upload_to_cache(
+    request: Request,
+    ttl_seconds: Optional[float] = Query(None, gt=0, description="Время жизни записи в секундах от последнего обращения."),
+    priority: Optional[int] = Query(None, description="Приоритет записи при вытеснении по размеру."),
+) -> Dict[str, Any]:
+    """
+    Сохраняет тело запроса в кеш и возвращает `cache_key`. Тело - Arrow IPC
+    stream (`Content-Type: application/vnd.apache.arrow.stream`) или parquet
+    (`application/vnd.apache.parquet`); оно потоково пишется на диск, не
+    собираясь в памяти целиком.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    result = await cache_transfer.upload(request.stream(), media_type, ttl_seconds=ttl_seconds, priority=priority)
+    _raise_on_error(result)
     return result
+
+@router.get("/cache", summary="Список записей кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def list_cache_entries() -> List[Dict[str, Any]]:
+    """
+    Возвращает записи кеша (сначала недавно использованные): размер, время
+    последнего обращения, TTL и момент истечения, приоритет и закрепления.
+    """
+    return await asyncio.to_thread(agent_cache.entries)
+
+@router.get("/cache/stats", summary="Статистика кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def get_cache_stats() -> Dict[str, Any]:
+    """
+    Возвращает размер кеша и число записей (общие для хоста), а также
+    попадания, промахи и вытеснения по TTL и по размеру в текущем воркере.
+    """
+    return await asyncio.to_thread(agent_cache.stats)
+
+@router.get("/cache/{cache_key}", summary="Скачать данные из кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def download_from_cache(cache_key: str, format: Literal["parquet", "arrow"] = "parquet"):
+    """
+    Отдает запись кеша: parquet-файл как есть (`format=parquet`) или поток
+    Arrow IPC (`format=arrow`), который читается из файла по частям.
+    """
+    try:
+        if format == "parquet":
+            path = await asyncio.to_thread(cache_transfer.parquet_path, cache_key)
+            return FileResponse(path, media_type=PARQUET_MEDIA_TYPE, filename=f"{cache_key}.parquet")
+        _, chunks = await asyncio.to_thread(cache_transfer.arrow_stream, cache_key)
+    except FileNotFoundError:
+        _raise_on_error({"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден."}})
+    return StreamingResponse(chunks, media_type=ARROW_STREAM_MEDIA_TYPE)
+
+@router.delete("/cache/{cache_key}", summary="Удалить запись кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def delete_cache_entry(cache_key: str) -> Dict[str, Any]:
+    """Удаляет запись кеша вместе с ее метаданными, даже если она закреплена."""
+    try:
+        deleted = await asyncio.to_thread(agent_cache.delete, cache_key)
+    except FileNotFoundError:
+        deleted = False
+    if not deleted:
+        _raise_on_error({"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден."}})
+    return {"status": "success", "cache_key": cache_key}
+
+@router.patch("/cache/{cache_key}", summary="Изменить TTL и приоритет записи кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def update_cache_policy(cache_key: str, payload: CachePolicyRequest) -> Dict[str, Any]:
+    """Задает записи свой TTL (от последнего обращения) и/или приоритет вытеснения."""
+    try:
+        policy = await asyncio.to_thread(agent_cache.set_policy, cache_key, payload.ttl_seconds, payload.priority)
+    except FileNotFoundError:
+        _raise_on_error({"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден."}})
+    return {"status": "success", "cache_key": cache_key, "policy": policy}
+
+@router.post("/cache/{cache_key}/pin", summary="Закрепить запись кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def pin_cache_entry(cache_key: str, payload: CachePinRequest) -> Dict[str, Any]:
+    """
+    Закрепляет запись за держателем: пока закрепление действует, запись не
+    удаляется ни по TTL, ни при вытеснении по размеру.
+    """
+    try:
+        policy = await asyncio.to_thread(agent_cache.pin, cache_key, payload.holder, payload.ttl_seconds)
+    except FileNotFoundError:
+        _raise_on_error({"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден."}})
+    return {"status": "success", "cache_key": cache_key, "policy": policy}
+
+@router.delete("/cache/{cache_key}/pin", summary="Снять закрепление записи кеша", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def unpin_cache_entry(cache_key: str, holder: str = Query("api", min_length=1)) -> Dict[str, Any]:
+    """Снимает закрепление держателя `holder`; закрепления других держателей остаются."""
+    try:
+        unpinned = await asyncio.to_thread(agent_cache.unpin, cache_key, holder)
+    except FileNotFoundError:
+        _raise_on_error({"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден."}})
+    return {"status": "success", "cache_key": cache_key, "unpinned": unpinned}
+
+@router.post(
+    "/cache/{cache_key}/query",
+    summary="Отфильтровать, спроецировать или агрегировать закешированный результат",
+    dependencies=[Depends(verify_token)],
+    tags=["Agent"],
+)
+async def query_cached_result(cache_key: str, payload: CacheQueryRequest) -> EnrichedExecutionResult:
+    """
+    Выполняет декларативный запрос к закешированному результату прямо в агенте,
+    без запуска песочницы: выбор столбцов, фильтры, group-by с агрегатами,
+    сортировка и limit.
+
+    - **save_result**: если `true`, результат сохраняется в кеш, и его ключ
+      возвращается в поле `cache_key`.
+    """
+    result = await cache_query_engine.query(cache_key, payload)
+    _raise_on_error(result)
+    return _json_response(encode_result(result))
+
+@router.post(
+    "/cache/{cache_key}/refresh",
+    summary="Дописать в закешированный SQL-результат новые строки",
+    dependencies=[Depends(verify_token)],
+    tags=["Agent"],
+)
+async def refresh_cached_result(cache_key: str, request: Request) -> EnrichedExecutionResult:
+    """
+    Обновляет запись кеша, зарегистрированную через `watermark_column`:
+    из базы запрашиваются только строки со значением столбца больше
+    сохраненного, они дописываются в запись, статистика дополняется, а
+    версия записи увеличивается. Возвращает метаданные без строк.
+    """
+    result = await query_executor.refresh_cached_sql(cache_key, is_disconnected=request.is_disconnected)
+    _raise_on_error(result)
+    return _json_response(encode_result(result))
+
+@router.post(
+    "/cache/sql",
+    summary="Выполнить SQL над закешированными результатами",
+    dependencies=[Depends(verify_token)],
+    tags=["Agent"],
+)
+async def run_sql_on_cache(payload: CacheSQLRequest) -> EnrichedExecutionResult:
+    """
+    Выполняет read-only SQL над результатами предыдущих шагов прямо в агенте,
+    например `SELECT * FROM cache('k1') JOIN cache('k2') USING (id)`.
+    Запрос проходит ту же проверку безопасности, что и SQL к базе данных.
+    """
+    result = await cache_sql_engine.run(payload.sql, save_result=payload.save_result)
+    _raise_on_error(result)
+    return _json_response(encode_result(result))
+
+@router.post("/sessions", summary="Создать сессию песочницы", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def create_session(payload: CreateSessionRequest) -> Dict[str, Any]:
+    """
+    Запускает долгоживущую песочницу, которая хранит переменные Python между шагами.
+    Сессия закрывается через `DELETE /sessions/{id}` или после простоя.
+    """
+    result = await session_manager.create(idle_timeout_seconds=payload.idle_timeout_seconds)
+    _raise_on_error(result)
+    return result
+
+@router.post(
+    "/sessions/{session_id}/execute",
+    summary="Выполнить шаг в сессии",
+    dependencies=[Depends(verify_token)],
+    tags=["Agent"],
+)
+async def execute_in_session(session_id: str, payload: SessionExecuteRequest) -> SessionExecutionResult:
+    """
+    Выполняет Python-код в ядре сессии. DataFrame'ы остаются в памяти песочницы
+    между шагами; если шаг создает `result_df`, он возвращается в ответе.
+
+    - **persist**: переменные, которые нужно сохранить в кеш агента (ключи
+      возвращаются в поле `persisted`).
+    """
+    result = await session_manager.execute(
+        session_id, code=payload.code, cache_keys=payload.cache_keys, persist=payload.persist
+    )
+    _raise_on_error(result)
+    return _json_response(encode_result(result, SessionExecutionResult))
+
+@router.delete("/sessions/{session_id}", summary="Закрыть сессию", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def delete_session(session_id: str) -> Dict[str, Any]:
+    """Останавливает контейнер сессии и освобождает ее ресурсы."""
+    result = await session_manager.delete(session_id)
+    _raise_on_error(result)
+    return result
+
+async def _run_profile_job(table_name: str) -> Dict[str, Any]:
+    try:
+        profile = await data_profiler.profile_table(table_name)
+    except ValueError as e:  # Если таблица не найдена
+        return {"status": "error", "error": {"type": "NOT_FOUND", "message": str(e)}}
+    return {"status": "success", **jsonable_encoder(profile)}
+
+@router.post(
+    "/jobs",
+    summary="Запустить фоновое задание",
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(verify_token)],
+    tags=["Agent"],
+)
+async def create_job(payload: JobRequest) -> Dict[str, Any]:
+    """
+    Запускает долгое выполнение (`execute`, `execute_on_data`) или профиль
+    таблицы (`profile`) в фоне и сразу возвращает `job_id`. Статус и результат -
+    `GET /jobs/{job_id}`; строки результата остаются в кеше под `cache_key`.
+    """
+    if isinstance(payload, ExecuteJobRequest):
+        runner = lambda: query_executor.run(**dict(payload.request), background=True)
+    elif isinstance(payload, ExecuteOnDataJobRequest):
+        runner = lambda: query_executor.run_python_on_data(
+            python_code=payload.request.code,
+            input_data=payload.request.input_data,
+            cache_keys=payload.request.cache_keys,
+            background=True,
+            partition_by=payload.request.partition_by,
+            resource_class=payload.request.resource_class,
+            memoize=payload.request.memoize,
+        )
+    else:
+        runner = lambda: _run_profile_job(payload.table_name)
+    try:
+        return await job_manager.submit(payload.kind, runner)
+    except JobQueueFullError as e:
+        _raise_on_error({"status": "error", "error": {"type": "QUEUE_FULL_ERROR", "message": "Слишком много фоновых заданий в очереди.", "retry_after": e.retry_after}})
+
+@router.get("/jobs/{job_id}", summary="Статус и результат фонового задания", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def get_job(job_id: str) -> Dict[str, Any]:
+    """Возвращает статус задания (queued, running, succeeded, failed, cancelled) и результат или ошибку."""
+    job = await asyncio.to_thread(job_manager.get, job_id)
+    if job is None:
+        _raise_on_error({"status": "error", "error": {"type": "JOB_NOT_FOUND", "message": f"Задание '{job_id}' не найдено."}})
+    return _json_response(dumps(job))
+
+@router.delete("/jobs/{job_id}", summary="Отменить фоновое задание", dependencies=[Depends(verify_token)], tags=["Agent"])
+async def cancel_job(job_id: str) -> Dict[str, Any]:
+    """
+    Отменяет задание: SQL-запрос отменяется на сервере БД, контейнер песочницы
+    останавливается. Задание другого воркера агента отменяется в течение секунды.
+    """
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        _raise_on_error({"status": "error", "error": {"type": "JOB_NOT_FOUND", "message": f"Задание '{job_id}' не найдено."}})
+    return job
@@ -1,13 +1,20 @@
-from typing import Optional
+from typing import Dict, Literal, Optional
 from urllib.parse import quote_plus
 
-from pydantic import computed_field
+from pydantic import BaseModel, Field, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
+class SandboxResourceClass(BaseModel):
+    """Ресурсы песочницы одного класса."""
+    memory_mb: int = Field(..., gt=0)
+    cpus: float = Field(..., gt=0)
+    timeout_seconds: float = Field(..., gt=0)
+
+
 class AgentSettings(BaseSettings):
     """
     Настройки для Data Execution Agent.
@@ -42,6 +49,111 @@ class AgentSettings(BaseSettings):
     AGENT_HOST: str = "0.0.0.0"
     AGENT_PORT: int = 8001
 
+    # --- Секция 5: Локальная обработка закешированных данных ---
+    # Лимит памяти и число потоков встроенного SQL-движка (DuckDB),
+    # который выполняет запросы вида SELECT ... FROM cache('<key>').
+    CACHE_SQL_MEMORY_LIMIT_MB: int = 512
+    CACHE_SQL_THREADS: int = 2
+    # Максимальный размер тела PUT /cache (Arrow IPC stream или parquet).
+    CACHE_UPLOAD_MAX_MB: int = 2048
+    # Время жизни записи кеша в часах (от последнего обращения), если у записи нет своего TTL.
+    CACHE_TTL_HOURS: float = 12
+    # Максимальный размер каталога кеша; при превышении записи вытесняются
+    # (сначала с меньшим приоритетом, затем давно не использованные) до CACHE_CLEANUP_TARGET_MB,
+    # чтобы не чистить по одному файлу. Закрепленные записи не вытесняются.
+    CACHE_MAX_SIZE_MB: int = 512
+    CACHE_CLEANUP_TARGET_MB: int = 400
+
+    # --- Секция 6: Планировщик песочниц ---
+    # Максимум одновременно запущенных песочниц на хосте (общий для всех воркеров).
+    # Если не указано, вычисляется из количества CPU и объема памяти хоста.
+    SANDBOX_MAX_CONCURRENCY: Optional[int] = None
+    # Сколько запросов может ждать слот в одном воркере, прежде чем агент начнет отвечать 429.
+    SANDBOX_QUEUE_LIMIT: int = 32
+    # Сколько секунд запрос может ждать слот в очереди.
+    SANDBOX_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    # Каталог с lock-файлами слотов. Должен быть общим для всех воркеров агента.
+    SANDBOX_LOCK_DIR: str = "/tmp/causabi-sandbox-slots"
+    # Максимум частей при параллельном выполнении Python-кода (`partition_by` в /execute-on-data).
+    SANDBOX_MAX_PARTITIONS: int = 16
+    # Классы ресурсов песочницы (JSON в переменной окружения). Класс выбирается по
+    # размеру входных данных или явно полем `resource_class` запроса. Один слот
+    # планировщика - 0.5 CPU и 256 МБ; класс крупнее занимает несколько слотов.
+    SANDBOX_RESOURCE_CLASSES: Dict[str, SandboxResourceClass] = {
+        "small": SandboxResourceClass(memory_mb=256, cpus=0.5, timeout_seconds=100),
+        "medium": SandboxResourceClass(memory_mb=1024, cpus=1, timeout_seconds=300),
+        "large": SandboxResourceClass(memory_mb=4096, cpus=2, timeout_seconds=900),
+    }
+    # Во сколько раз память песочницы должна превышать размер входных DataFrame'ов
+    # (JSON-сериализация и разбор в песочнице создают несколько копий данных).
+    SANDBOX_INPUT_MEMORY_FACTOR: float = 5.0
+
+    # --- Секция 7: Сессии песочницы (переменные сохраняются между шагами) ---
+    SESSION_MAX_COUNT: int = 8
+    SESSION_MEM_LIMIT: str = "1g"
+    SESSION_CPU_QUOTA: int = 100000  # 1 CPU при cpu_period=100000
+    # Сессия без запросов дольше этого времени удаляется вместе с контейнером.
+    SESSION_IDLE_TIMEOUT_SECONDS: int = 900
+
+    # --- Секция 8: Выполнение SQL в агенте ---
+    # Сколько памяти может занять результат одного SQL-запроса в воркере.
+    # Сверх бюджета строки пишутся на диск в кеш, а в ответе остается только начало результата.
+    SQL_RESULT_MEMORY_BUDGET_MB: int = 64
+    # Сколько строк читается из курсора за один fetchmany.
+    SQL_FETCH_CHUNK_ROWS: int = 10_000
+    # Максимальное время выполнения SQL-запроса (statement_timeout). Запрос может
+    # задать меньший дедлайн; по его истечении или при отключении клиента запрос
+    # отменяется на сервере БД.
+    SQL_STATEMENT_TIMEOUT_SECONDS: float = 60.0
+    # После скольких выполнений одного текста запроса в соединении psycopg
+    # готовит его на сервере (prepared statement). Важно для запросов с `params`.
+    SQL_PREPARE_THRESHOLD: int = 2
+    # Проверка стоимости запроса по EXPLAIN перед выполнением:
+    # off - не проверять, warn - выполнить и предупредить, reject - отклонить,
+    # limit - выполнить с автоматическим LIMIT SQL_AUTO_LIMIT_ROWS,
+    # job - выполнить как фоновое задание и вернуть его id (см. POST /jobs).
+    SQL_COST_POLICY: Literal["off", "warn", "reject", "limit", "job"] = "warn"
+    # Пороги оценки планировщика, сверх которых срабатывает политика.
+    SQL_MAX_PLAN_COST: float = 10_000_000.0
+    SQL_MAX_PLAN_ROWS: int = 5_000_000
+    SQL_AUTO_LIMIT_ROWS: int = 10_000
+    # Последовательное сканирование таблицы больше этого числа строк отмечается в `explain`.
+    SQL_SEQ_SCAN_WARN_ROWS: int = 100_000
+    # Сколько строк-примеров возвращать в режиме summary_only.
+    SQL_SUMMARY_SAMPLE_ROWS: int = 5
+    # Приближенные запросы (`approximate`): TABLESAMPLE применяется к таблицам не меньше
+    # этого числа строк. SYSTEM читает случайные страницы (быстро), BERNOULLI - случайные
+    # строки (точнее, но читает всю таблицу).
+    SQL_APPROX_MIN_TABLE_ROWS: int = 1_000_000
+    SQL_APPROX_SAMPLE_METHOD: Literal["SYSTEM", "BERNOULLI"] = "SYSTEM"
+    # Пакетное выполнение (POST /execute/batch): максимум запросов в пакете и
+    # сколько из них выполняется одновременно.
+    SQL_BATCH_MAX_STATEMENTS: int = 50
+    SQL_BATCH_CONCURRENCY: int = 4
+    # Запросы дольше порога записываются в журнал медленных запросов (GET /stats/queries).
+    SQL_SLOW_QUERY_THRESHOLD_MS: float = 1000.0
+    # Сколько последних записей хранить в журнале.
+    SQL_QUERY_LOG_MAX_ENTRIES: int = 100_000
+
+    # --- Секция 9: Конвейеры (POST /pipelines) ---
+    # Максимум шагов в одном конвейере.
+    PIPELINE_MAX_STEPS: int = 20
+
+    # --- Секция 10: Фоновые задания (POST /jobs) ---
+    # Сколько заданий один воркер выполняет одновременно; остальные ждут в статусе queued.
+    JOBS_MAX_CONCURRENCY: int = 2
+    # Сколько незавершенных заданий может быть у одного воркера, прежде чем агент начнет отвечать 429.
+    JOBS_QUEUE_LIMIT: int = 64
+    # Сколько секунд хранить состояние и результат завершенного задания.
+    JOBS_RESULT_TTL_SECONDS: int = 86_400
+    # Файл SQLite с состоянием заданий, общий для всех воркеров. По умолчанию - jobs.sqlite в AGENT_STATE_DIR.
+    JOBS_DB_PATH: Optional[str] = None
+
+    # --- Секция 11: Служебное состояние агента ---
+    # Каталог для записей сессий, базы фоновых заданий и журнала запросов.
+    # Должен быть общим для всех воркеров агента; создается при первом обращении.
+    AGENT_STATE_DIR: str = "./.agent_state"
+
     @computed_field
     @property
     def DATABASE_URL(self) -> str:
@@ -6,6 +6,8 @@ from fastapi.responses import JSONResponse
 
 from agent.config import settings
 from agent.api import router as api_router
+from agent.services.docker_async import async_docker
+from agent.services.session_manager import session_manager
 
 # Настройка логирования для Агента
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - AGENT - %(levelname)s - %(message)s')
@@ -79,6 +81,8 @@ async def startup_event():
     
     # Запускаем регистрацию в фоне, чтобы не блокировать старт сервера
     asyncio.create_task(register_agent())
+    # Фоновая очистка простаивающих сессий песочницы
+    asyncio.create_task(session_manager.run_reaper())
 
 
 @app.on_event("shutdown")
@@ -86,6 +90,7 @@ async def shutdown_event():
     """
     Выполняется при остановке агента.
     """
+    await async_docker.close()
     logger.info("Data Execution Agent остановлен.")
 
 @app.exception_handler(Exception)
@@ -3,33 +3,224 @@ import os
 import sys
 import io
 import json
+import socket
+import struct
+import traceback
+import tempfile
+from decimal import Decimal
+from typing import Optional
 import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 from sqlalchemy import create_engine
 import time
 import numpy as np
 
+from sql_safety_check import is_sql_safe
+
+# Один движок (и одно соединение в пуле) на всю жизнь песочницы
+_ENGINE = None
+_COPY_CONNECTION = None
+
+# OID типов PostgreSQL -> типы Arrow для разбора потока COPY.
+# Остальные типы (text, json, uuid, ...) читаются как строки.
+PG_TYPE_OIDS_TO_ARROW = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz="UTC"),
+}
+PG_NUMERIC_OID = 1700
+# Больше цифр decimal128 не вмещает
+ARROW_DECIMAL_MAX_PRECISION = 38
+COPY_NULL_MARKER = "\\N"
+COPY_READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+def _get_engine():
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = create_engine(os.environ["DATABASE_URL"], pool_size=1, max_overflow=0, pool_pre_ping=True)
+    return _ENGINE
+
 def get_db_connection():
     db_url = os.getenv("DATABASE_URL")
     if not db_url:
         return None
     try:
-        engine = create_engine(db_url)
-        return engine.connect()
+        return _get_engine().connect()
     except Exception as e:
         print(f"Error creating database connection: {e}", file=sys.stderr)
         return None
 
+def _get_copy_connection():
+    """Отдельное read-only соединение psycopg2 для COPY, переиспользуемое между вызовами."""
+    global _COPY_CONNECTION
+    if _COPY_CONNECTION is None or _COPY_CONNECTION.closed:
+        _COPY_CONNECTION = psycopg2.connect(os.environ["DATABASE_URL"])
+        _COPY_CONNECTION.set_session(readonly=True, autocommit=True)
+        with _COPY_CONNECTION.cursor() as cur:
+            cur.execute("SET TIME ZONE 'UTC'")
+    return _COPY_CONNECTION
+
+def copy_column_type(column) -> pa.DataType:
+    """
+    Тип Arrow для столбца из `cursor.description`. numeric(p, s) читается как
+    decimal128(p, s) без потери точности; numeric без ограничений (или
+    точнее 38 цифр) - как строка, потому что float64 теряет знаки, а
+    decimal128 может не вместить значение.
+    """
+    if column.type_code == PG_NUMERIC_OID:
+        if column.precision and column.precision <= ARROW_DECIMAL_MAX_PRECISION:
+            return pa.decimal128(column.precision, column.scale or 0)
+        return pa.string()
+    return PG_TYPE_OIDS_TO_ARROW.get(column.type_code, pa.string())
+
+def copy_convert_options(column_types: dict) -> pa_csv.ConvertOptions:
+    """
+    Правила разбора CSV из COPY. NULL в нем - только незакавыченный маркер:
+    закавыченные "\\N" и "" - это строки, как и при чтении через курсор.
+    """
+    return pa_csv.ConvertOptions(
+        column_types=column_types,
+        null_values=[COPY_NULL_MARKER],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=["t"],
+        false_values=["f"],
+    )
+
+def read_table_fast(sql: str, chunksize: Optional[int] = None):
+    """
+    Быстро читает результат SELECT-запроса через `COPY (query) TO STDOUT`.
+
+    Поток COPY пишется во временный файл на диске, а затем разбирается
+    колоночным CSV-парсером Arrow, поэтому строки не превращаются в Python-объекты,
+    а память ограничена размером одного блока. Столбцы numeric(p, s) приходят
+    как Decimal, numeric без ограничений - как строки (см. `copy_column_type`).
+
+    :param sql: Read-only запрос (проверяется теми же правилами, что и SQL агента).
+    :param chunksize: Если задан, возвращает итератор DataFrame'ов примерно по
+                      `chunksize` строк вместо одного DataFrame.
+    """
+    is_safe, error_message = is_sql_safe(sql, "postgresql")
+    if not is_safe:
+        raise PermissionError(error_message)
+    query = sql.strip().rstrip(";")
+
+    conn = _get_copy_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM ({query}) AS _q LIMIT 0")
+        columns = [d.name for d in cur.description]
+        column_types = {d.name: copy_column_type(d) for d in cur.description}
+
+    spool = tempfile.TemporaryFile()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, NULL '{COPY_NULL_MARKER}')", spool)
+    spool.seek(0)
+
+    read_options = pa_csv.ReadOptions(column_names=columns, block_size=COPY_READ_BLOCK_SIZE)
+    convert_options = copy_convert_options(column_types)
+
+    if chunksize is None:
+        with spool:
+            return pa_csv.read_csv(spool, read_options=read_options, convert_options=convert_options).to_pandas()
+
+    def iterate_chunks():
+        with spool:
+            reader = pa_csv.open_csv(spool, read_options=read_options, convert_options=convert_options)
+            batches, rows = [], 0
+            for batch in reader:
+                batches.append(batch)
+                rows += batch.num_rows
+                while rows >= chunksize:
+                    table = pa.Table.from_batches(batches)
+                    yield table.slice(0, chunksize).to_pandas()
+                    rest = table.slice(chunksize)
+                    batches, rows = rest.to_batches(), rest.num_rows
+            if rows:
+                yield pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+    return iterate_chunks()
+
+def convert_numpy(obj):
+    """Конвертирует numpy типы (и Decimal из столбцов numeric) в стандартные типы Python для JSON."""
+    if isinstance(obj, Decimal):
+        return str(obj)  # Без потери точности, как Decimal в ответах агента
+    if obj is pd.NA or obj is pd.NaT:
+        return None  # Пропуски в nullable-столбцах (Int64, boolean, string), например в статистике
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return obj
+
+def build_enriched_result(result_df: pd.DataFrame, start_time: float, include_rows: bool = True) -> dict:
+    """
+    Формирует обогащенный ответ (метаданные, схема, статистика, строки) для result_df.
+    Без `include_rows` строки не выводятся (result_df передается агенту parquet-файлом).
+    """
+    exec_time_ms = (time.monotonic() - start_time) * 1000
+
+    # 1. Рассчитываем метаданные колонок
+    column_metadata_list = []
+    for col_name in result_df.columns:
+        col_series = result_df[col_name]
+        col_type = str(col_series.dtype)
+        stats = None
+
+        if pd.api.types.is_numeric_dtype(col_series.dtype):
+            desc = col_series.describe()
+            stats = {
+                "min": desc.get('min'), "max": desc.get('max'), "mean": desc.get('mean'),
+                "std_dev": desc.get('std'), "unique_count": int(col_series.nunique())
+            }
+        elif pd.api.types.is_datetime64_any_dtype(col_series.dtype):
+            stats = {
+                "min": str(col_series.min()) if pd.notna(col_series.min()) else None,
+                "max": str(col_series.max()) if pd.notna(col_series.max()) else None,
+                "unique_count": int(col_series.nunique())
+            }
+        else:
+            stats = {"unique_count": int(col_series.nunique())}
+
+        column_metadata_list.append({"name": col_name, "type": col_type, "stats": stats})
+
+    # 2. Формируем финальный JSON
+    return {
+        "status": "success",
+        "metadata": {
+            "execution_time_ms": exec_time_ms, # Это время внутри контейнера
+            "row_count": len(result_df),
+            "result_schema": column_metadata_list
+        },
+        "data": {
+            "columns": result_df.columns.tolist(),
+            "rows": result_df.where(pd.notna(result_df), None).values.tolist() if include_rows else []
+        }
+    }
+
 def main():
     start_time = time.monotonic()
     
     code_to_execute = os.getenv("PYTHON_CODE_TO_EXECUTE")
     input_data_json = os.getenv("INPUT_DATA_JSON")
+    # Входы parquet-файлами <имя>.parquet и путь для result_df (вместо строк в stdout)
+    input_parquet_dir = os.getenv("INPUT_PARQUET_DIR")
+    result_parquet_path = os.getenv("RESULT_PARQUET_PATH")
 
     if not code_to_execute:
         print("Ошибка: PYTHON_CODE_TO_EXECUTE не установлена.", file=sys.stderr)
         sys.exit(1)
 
-    execution_globals = {"get_db_connection": get_db_connection, "pd": pd}
+    execution_globals = {"get_db_connection": get_db_connection, "read_table_fast": read_table_fast, "pd": pd}
     execution_locals = {}
 
     if input_data_json:
@@ -44,6 +235,11 @@ def main():
         except Exception as e:
             print(f"Критическая ошибка десериализации входных данных: {e}", file=sys.stderr)
             sys.exit(1)
+    if input_parquet_dir:
+        input_dfs = execution_locals.setdefault("input_data", {})
+        if os.path.isdir(input_parquet_dir):
+            for file_name in os.listdir(input_parquet_dir):
+                input_dfs[os.path.splitext(file_name)[0]] = pd.read_parquet(os.path.join(input_parquet_dir, file_name))
     
     try:
         exec(code_to_execute, execution_globals, execution_locals)
@@ -57,62 +253,134 @@ def main():
             print(f"Ошибка: Переменная 'result_df' имеет тип {type(result_df)}, а не pandas.DataFrame.", file=sys.stderr)
             sys.exit(1)
 
-        # --- НОВАЯ ЛОГИКА: ФОРМИРОВАНИЕ ОБОГАЩЕННОГО ОТВЕТА ---
-        exec_time_ms = (time.monotonic() - start_time) * 1000
-
-        # 1. Рассчитываем метаданные колонок
-        column_metadata_list = []
-        for col_name in result_df.columns:
-            col_series = result_df[col_name]
-            col_type = str(col_series.dtype)
-            stats = None
-
-            if pd.api.types.is_numeric_dtype(col_series.dtype):
-                desc = col_series.describe()
-                stats = {
-                    "min": desc.get('min'), "max": desc.get('max'), "mean": desc.get('mean'),
-                    "std_dev": desc.get('std'), "unique_count": int(col_series.nunique())
-                }
-            elif pd.api.types.is_datetime64_any_dtype(col_series.dtype):
-                stats = {
-                    "min": str(col_series.min()) if pd.notna(col_series.min()) else None,
-                    "max": str(col_series.max()) if pd.notna(col_series.max()) else None,
-                    "unique_count": int(col_series.nunique())
-                }
-            else:
-                stats = {"unique_count": int(col_series.nunique())}
-            
-            column_metadata_list.append({"name": col_name, "type": col_type, "stats": stats})
-
-        # 2. Формируем финальный JSON
-        enriched_result = {
-            "status": "success",
-            "metadata": {
-                "execution_time_ms": exec_time_ms, # Это время внутри контейнера
-                "row_count": len(result_df),
-                "result_schema": column_metadata_list
-            },
-            "data": {
-                "columns": result_df.columns.tolist(),
-                "rows": result_df.where(pd.notna(result_df), None).values.tolist()
-            }
-        }
-        
-        # Функция для конвертации numpy типов в стандартные типы Python для JSON
-        def convert_numpy(obj):
-            if isinstance(obj, np.integer):
-                return int(obj)
-            elif isinstance(obj, np.floating):
-                return float(obj)
-            elif isinstance(obj, np.ndarray):
-                return obj.tolist()
-            return obj
-
+        if result_parquet_path:
+            result_df.to_parquet(result_parquet_path, index=False)
+        enriched_result = build_enriched_result(result_df, start_time, include_rows=not result_parquet_path)
         print(json.dumps(enriched_result, default=convert_numpy))
 
     except Exception as e:
         print(f"Ошибка выполнения кода: {e}", file=sys.stderr)
         sys.exit(1)
 
+# --- Режим сессии: долгоживущее ядро и клиент для docker exec ---
+
+KERNEL_SOCKET_PATH = "/tmp/kernel.sock"
+KERNEL_CONNECT_TIMEOUT_SECONDS = 15
+MESSAGE_HEADER = struct.Struct(">I")
+
+def send_message(conn: socket.socket, message: dict):
+    payload = json.dumps(message, default=convert_numpy).encode("utf-8")
+    conn.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+def receive_message(conn: socket.socket) -> dict:
+    def read_exactly(size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = conn.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError("Соединение с ядром сессии закрыто.")
+            buffer += chunk
+        return bytes(buffer)
+
+    (size,) = MESSAGE_HEADER.unpack(read_exactly(MESSAGE_HEADER.size))
+    return json.loads(read_exactly(size))
+
+def handle_kernel_request(namespace: dict, request: dict) -> dict:
+    """Выполняет один запрос к ядру сессии: шаг кода или сохранение переменной."""
+    start_time = time.monotonic()
+    action = request.get("action")
+
+    if action == "execute":
+        for var_name, path in request.get("inputs", {}).items():
+            namespace["input_data"][var_name] = pd.read_parquet(path)
+            os.remove(path)
+        # result_df возвращается только если его создал именно этот шаг
+        namespace.pop("result_df", None)
+        exec(request["code"], namespace)
+
+        result_df = namespace.get("result_df")
+        if result_df is not None and not isinstance(result_df, pd.DataFrame):
+            return {"status": "error", "message": f"Переменная 'result_df' имеет тип {type(result_df)}, а не pandas.DataFrame."}
+        response = build_enriched_result(result_df if result_df is not None else pd.DataFrame(), start_time)
+        response["variables"] = {
+            name: f"DataFrame({value.shape[0]}x{value.shape[1]})"
+            for name, value in namespace.items()
+            if isinstance(value, pd.DataFrame) and not name.startswith("_")
+        }
+        return response
+
+    if action == "persist":
+        var_name = request["variable"]
+        value = namespace.get(var_name)
+        if not isinstance(value, pd.DataFrame):
+            return {"status": "error", "message": f"Переменная '{var_name}' не найдена или не является pandas.DataFrame."}
+        os.makedirs(os.path.dirname(request["path"]), exist_ok=True)
+        value.to_parquet(request["path"], index=False)
+        return {"status": "success", "row_count": len(value)}
+
+    return {"status": "error", "message": f"Неизвестное действие: {action}"}
+
+def serve_kernel():
+    """
+    Запускает ядро сессии: хранит переменные Python между шагами и выполняет
+    запросы, приходящие через unix-сокет от `run_sandbox.py client`.
+    Запросы обрабатываются строго по одному.
+    """
+    namespace = {"get_db_connection": get_db_connection, "read_table_fast": read_table_fast, "pd": pd, "input_data": {}}
+    if os.path.exists(KERNEL_SOCKET_PATH):
+        os.remove(KERNEL_SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(KERNEL_SOCKET_PATH)
+    server.listen(1)
+    print("Ядро сессии запущено.", file=sys.stderr)
+
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                request = receive_message(conn)
+                try:
+                    response = handle_kernel_request(namespace, request)
+                except Exception:
+                    response = {"status": "error", "message": f"Ошибка выполнения кода: {traceback.format_exc(limit=5)}"}
+                send_message(conn, response)
+            except Exception as e:
+                print(f"Ошибка обработки запроса к ядру: {e}", file=sys.stderr)
+
+def run_client():
+    """
+    Передает запрос из KERNEL_REQUEST_JSON ядру сессии и печатает ответ:
+    успешный - в stdout (JSON), ошибку - в stderr с кодом выхода 1.
+    """
+    request = json.loads(os.environ["KERNEL_REQUEST_JSON"])
+    deadline = time.monotonic() + KERNEL_CONNECT_TIMEOUT_SECONDS
+    while True:
+        try:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.connect(KERNEL_SOCKET_PATH)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            conn.close()
+            # Ядро могло еще не успеть запуститься после создания сессии
+            if time.monotonic() > deadline:
+                print("Ошибка: ядро сессии не отвечает.", file=sys.stderr)
+                sys.exit(1)
+            time.sleep(0.1)
+
+    with conn:
+        send_message(conn, request)
+        response = receive_message(conn)
+
+    if response.get("status") != "success":
+        print(response.get("message", "Неизвестная ошибка ядра сессии."), file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response))
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    mode = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if mode == "kernel":
+        serve_kernel()
+    elif mode == "client":
+        run_client()
+    else:
+        main()
\ No newline at end of file
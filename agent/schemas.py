@@ -1,6 +1,6 @@
 # agent/schemas.py
-from typing import List, Dict, Any, Optional, Union
-from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional, Union
+from pydantic import BaseModel, Field, model_validator
 import datetime
 
 class ColumnStats(BaseModel):
@@ -10,6 +10,7 @@ class ColumnStats(BaseModel):
     mean: Optional[float] = Field(None, description="Среднее арифметическое (для числовых данных).")
     std_dev: Optional[float] = Field(None, description="Стандартное отклонение (для числовых данных).")
     unique_count: Optional[int] = Field(None, description="Количество уникальных значений.")
+    null_count: Optional[int] = Field(None, description="Количество пустых значений (NULL/NaN).")
 
 class HistogramBin(BaseModel):
     """Описывает один "столбец" гистограммы."""
@@ -42,11 +43,88 @@ class ColumnMetadata(BaseModel):
     type: str = Field(..., description="Тип данных столбца (pandas dtype).")
     stats: Optional[ColumnStats] = Field(None, description="Рассчитанная статистика, если применимо.")
 
+class PlanSummary(BaseModel):
+    """Оценка плана запроса (EXPLAIN) и решение, принятое по ней перед выполнением."""
+    total_cost: float = Field(..., description="Оценка стоимости всего плана в единицах планировщика PostgreSQL.")
+    plan_rows: int = Field(..., description="Оценка числа строк результата.")
+    node_type: str = Field(..., description="Тип корневого узла плана.")
+    exceeded: bool = Field(False, description="True, если оценка превышает настроенные пороги.")
+    action: Literal["none", "warned", "limited", "rejected", "deferred"] = Field("none", description="Что агент сделал с запросом по этой оценке.")
+    message: Optional[str] = Field(None, description="Пояснение для переписывания запроса.")
+
+class PlanNode(BaseModel):
+    """Узел плана запроса. Строки и время - на один проход (loop), как в EXPLAIN PostgreSQL."""
+    node_type: str
+    relation_name: Optional[str] = None
+    index_name: Optional[str] = None
+    filter: Optional[str] = Field(None, description="Условие фильтрации узла.")
+    total_cost: float = Field(..., description="Оценка стоимости узла (вместе с дочерними).")
+    estimated_rows: int = Field(..., description="Оценка числа строк планировщиком.")
+    actual_rows: Optional[float] = Field(None, description="Фактическое число строк (только для analyze).")
+    actual_time_ms: Optional[float] = Field(None, description="Фактическое время узла (только для analyze).")
+    loops: Optional[int] = Field(None, description="Сколько раз выполнялся узел (только для analyze).")
+    rows_removed_by_filter: Optional[int] = None
+    shared_hit_blocks: Optional[int] = Field(None, description="Блоков прочитано из shared buffers (только для analyze).")
+    shared_read_blocks: Optional[int] = Field(None, description="Блоков прочитано с диска (только для analyze).")
+    children: List["PlanNode"] = Field(default_factory=list)
+
+class QueryPlan(BaseModel):
+    """Дерево плана запроса, запрошенное через параметр `explain`."""
+    mode: Literal["plan", "analyze"]
+    planning_time_ms: Optional[float] = None
+    execution_time_ms: Optional[float] = None
+    root: PlanNode
+    warnings: List[str] = Field(default_factory=list, description="Подсказки по плану, например последовательные сканирования больших таблиц.")
+
+class ApproximateOptions(BaseModel):
+    """Размер выборки для приближенного SQL-запроса: доля самой большой таблицы или число строк из нее."""
+    fraction: Optional[float] = Field(None, gt=0, le=1, description="Доля строк таблицы, например 0.01.")
+    rows: Optional[int] = Field(None, gt=0, description="Примерное число строк, которое нужно прочитать из таблицы.")
+
+    @model_validator(mode="after")
+    def _exactly_one(self) -> "ApproximateOptions":
+        if (self.fraction is None) == (self.rows is None):
+            raise ValueError("Укажите ровно одно из полей: 'fraction' или 'rows'.")
+        return self
+
+class SamplingInfo(BaseModel):
+    """Параметры выборки, по которой посчитан приближенный результат."""
+    relation: Optional[str] = Field(None, description="Таблица, прочитанная через TABLESAMPLE (None, если подходящей таблицы нет).")
+    method: Literal["SYSTEM", "BERNOULLI"] = Field(..., description="Метод TABLESAMPLE.")
+    percent: float = Field(..., description="Процент строк таблицы в выборке (100 - запрос выполнен точно).")
+    estimated_table_rows: Optional[int] = Field(None, description="Оценка числа строк таблицы по статистике PostgreSQL.")
+    scale_factor: float = Field(..., description="Множитель, на который умножены COUNT/SUM.")
+    scaled_aggregates: int = Field(0, description="Сколько агрегатов COUNT/SUM масштабировано.")
+    message: Optional[str] = None
+
+class IncrementalInfo(BaseModel):
+    """Регистрация закешированного SQL-результата для инкрементального обновления."""
+    watermark_column: str = Field(..., description="Монотонно растущий столбец (id, created_at), по которому выбираются новые строки.")
+    watermark: Any = Field(None, description="Наибольшее значение столбца в записи кеша.")
+    version: int = Field(..., description="Версия записи: увеличивается при каждом обновлении, добавившем строки.")
+    rows_appended: int = Field(0, description="Сколько строк добавило последнее обновление.")
+
+class PartitionSpec(BaseModel):
+    """Параллельное выполнение Python-кода по частям одного входа (`/execute-on-data`)."""
+    input: str = Field(..., description="Переменная `input_data`, которую нужно разбить на части. Остальные входы передаются каждой части целиком.")
+    columns: Optional[List[str]] = Field(None, min_length=1, description="Ключевые столбцы: строки с одинаковым ключом попадают в одну часть. Без них вход делится на диапазоны строк.")
+    partitions: Optional[int] = Field(None, ge=1, description="Число частей (по умолчанию - число слотов песочниц, не больше SANDBOX_MAX_PARTITIONS).")
+    combine_code: Optional[str] = Field(None, description="Python-код, который получает склеенные результаты частей в `input_data['partials']` и создает итоговый `result_df`. Без него результаты частей просто склеиваются.")
+
 class ExecutionMetadata(BaseModel):
     """Метаданные о выполнении запроса."""
     execution_time_ms: float = Field(..., description="Время выполнения запроса в миллисекундах.")
     row_count: int = Field(..., description="Количество строк в результате.")
     result_schema: List[ColumnMetadata] = Field(..., description="Схема (колонки и их типы) результата.")
+    truncated: bool = Field(False, description="True, если в data.rows вернулась только часть строк; полный результат доступен по cache_key.")
+    summary_only: bool = Field(False, description="True, если статистика посчитана агрегатным запросом в базе, а data.rows содержит только строки-примеры (результат не кешируется).")
+    plan: Optional[PlanSummary] = Field(None, description="Оценка плана SQL-запроса, если проверка стоимости включена.")
+    explain: Optional[QueryPlan] = Field(None, description="Дерево плана SQL-запроса, если он запрошен параметром `explain`.")
+    approximate: Optional[SamplingInfo] = Field(None, description="Параметры выборки, если запрошен приближенный результат (`approximate`).")
+    incremental: Optional[IncrementalInfo] = Field(None, description="Версия и водяной знак записи кеша, зарегистрированной для инкрементального обновления.")
+    partitions: Optional[int] = Field(None, description="На сколько частей был разбит вход при параллельном выполнении (`partition_by`).")
+    resource_class: Optional[str] = Field(None, description="Класс ресурсов песочницы, в которой выполнялся Python-код.")
+    memoized: bool = Field(False, description="True, если ответ взят из мемоизации: тот же код уже выполнялся над теми же входами.")
 
 class ExecutionData(BaseModel):
     """Непосредственно данные результата."""
@@ -61,3 +139,69 @@ class EnrichedExecutionResult(BaseModel):
     metadata: ExecutionMetadata
     data: ExecutionData
     cache_key: Optional[str] = Field(None, description="Ключ для доступа к результату в кеше, если он был сохранен.")
+
+class SessionExecutionResult(EnrichedExecutionResult):
+    """
+    Ответ шага сессии. `data` содержит `result_df`, если шаг его создал.
+    """
+    session_id: str
+    variables: Dict[str, str] = Field({}, description="DataFrame'ы, живущие в сессии, и их размеры.")
+    persisted: Dict[str, str] = Field({}, description="Сохраненные в кеш переменные: имя -> ключ кеша.")
+
+
+class PipelineStep(BaseModel):
+    """Шаг конвейера: SQL-запрос к базе или Python-код над результатами других шагов."""
+    id: str = Field(..., description="Имя шага, уникальное в конвейере.")
+    language: Literal["sql", "python"]
+    code: str
+    inputs: Dict[str, str] = Field({}, description="Только для Python: имя переменной в `input_data` -> id шага, чей результат в нее передается.")
+    params: Optional[Dict[str, Any]] = Field(None, description="Только для SQL: значения для плейсхолдеров `:name`.")
+
+class PipelineRequest(BaseModel):
+    """Конвейер шагов (DAG). Независимые ветви выполняются параллельно."""
+    steps: List[PipelineStep] = Field(..., min_length=1)
+    outputs: List[str] = Field(..., min_length=1, description="Шаги, результаты которых нужно закешировать и вернуть.")
+
+class PipelineStepStatus(BaseModel):
+    """Сводка по выполненному шагу конвейера."""
+    row_count: int
+    execution_time_ms: float
+
+class PipelineResult(BaseModel):
+    """Ответ эндпоинта /pipelines: результаты выходных шагов и сводка по всем шагам."""
+    status: str = "success"
+    execution_time_ms: float
+    outputs: Dict[str, EnrichedExecutionResult] = Field(..., description="Результаты выходных шагов с ключами кеша.")
+    steps: Dict[str, PipelineStepStatus]
+
+
+class CacheFilter(BaseModel):
+    """Условие фильтрации строк закешированного результата."""
+    column: str = Field(..., description="Имя столбца.")
+    op: Literal["==", "!=", "<", "<=", ">", ">=", "in", "not_in", "is_null", "not_null"] = Field(..., description="Оператор сравнения.")
+    value: Any = Field(None, description="Значение для сравнения (список для 'in'/'not_in', не используется для проверок на NULL).")
+
+class CacheAggregation(BaseModel):
+    """Агрегатная функция над столбцом закешированного результата."""
+    column: str = Field(..., description="Имя агрегируемого столбца.")
+    func: Literal["sum", "mean", "min", "max", "count", "count_distinct"] = Field(..., description="Агрегатная функция.")
+    alias: Optional[str] = Field(None, description="Имя столбца в результате. По умолчанию '<column>_<func>'.")
+
+class CacheSort(BaseModel):
+    """Сортировка результата."""
+    column: str
+    descending: bool = False
+
+class CacheQueryRequest(BaseModel):
+    """
+    Декларативный запрос к закешированному результату для эндпоинта /cache/{key}/query.
+    Порядок применения: filters -> group_by/aggregations -> columns -> order_by -> limit.
+    """
+    columns: Optional[List[str]] = Field(None, description="Список столбцов результата. По умолчанию - все.")
+    filters: List[CacheFilter] = Field([], description="Условия фильтрации, объединяемые через AND.")
+    group_by: List[str] = Field([], description="Столбцы группировки.")
+    aggregations: List[CacheAggregation] = Field([], description="Агрегаты. Без group_by считаются по всей таблице.")
+    order_by: List[CacheSort] = Field([], description="Сортировка результата.")
+    limit: Optional[int] = Field(None, ge=0, description="Максимальное количество строк результата.")
+    save_result: bool = Field(False, description="Сохранить результат в кеш как новую запись.")
+
@@ -0,0 +1,49 @@
+# agent/services/batch_executor.py
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+from loguru import logger
+
+StatementCall = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class BatchExecutor:
+    """
+    Выполняет пакет независимых запросов конкурентно, не больше `concurrency`
+    одновременно. Ошибка одного запроса возвращается в его результате и не
+    прерывает остальные. Каждый результат помечается индексом запроса в пакете.
+    """
+
+    async def iter_results(self, calls: List[StatementCall], concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Отдает результаты по мере завершения запросов (не в порядке пакета).
+        Если потребитель перестал читать (клиент отключился), незавершенные
+        запросы отменяются.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(index: int, call: StatementCall) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    result = await call()
+                except Exception as e:
+                    logger.error(f"Запрос {index} пакета завершился исключением: {e}")
+                    result = {"status": "error", "error": {"type": "UNEXPECTED_ERROR", "message": str(e).strip()}}
+            return {"index": index, **result}
+
+        tasks = [asyncio.create_task(run_one(index, call)) for index, call in enumerate(calls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, calls: List[StatementCall], concurrency: int) -> List[Dict[str, Any]]:
+        """Выполняет пакет и возвращает результаты в порядке запросов."""
+        results = [result async for result in self.iter_results(calls, concurrency)]
+        return sorted(results, key=lambda result: result["index"])
+
+# Создаем синглтон
+batch_executor = BatchExecutor()
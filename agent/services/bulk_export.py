@@ -0,0 +1,186 @@
+# agent/services/bulk_export.py
+import io
+import math
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import pandas as pd
+import psycopg
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql.psycopg import PGDialect_psycopg
+
+from agent.config import settings
+from agent.services.data_cache import agent_cache
+from agent.services.result_builder import ResultStatsAccumulator
+from agent.services.query_planner import strip_trailing_semicolon
+from agent.services.query_cancel import QueryCancelScope
+
+# Типы PostgreSQL (OID), которые разбираются напрямую в типы Arrow.
+# Остальные столбцы читаются как строки - так же, как в read_table_fast песочницы.
+PG_TYPE_OIDS_TO_ARROW = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz="UTC"),
+}
+PG_NUMERIC_OID = 1700
+# Больше цифр decimal128 не вмещает
+ARROW_DECIMAL_MAX_PRECISION = 38
+COPY_NULL_MARKER = "\\N"
+# Размер блока CSV, из которого получается один Arrow-батч (и одна row group в parquet)
+COPY_READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def column_arrow_type(column: Sequence[Any]) -> pa.DataType:
+    """
+    Тип Arrow для столбца из `cursor.description` (как `copy_column_type` в
+    песочнице). numeric(p, s) читается как decimal128(p, s) без потери
+    точности; numeric без ограничений (или точнее 38 цифр) - как строка,
+    потому что float64 теряет знаки, а decimal128 может не вместить значение.
+    """
+    type_code = column[1]
+    if type_code == PG_NUMERIC_OID:
+        # DB-API: (name, type_code, display_size, internal_size, precision, scale, null_ok)
+        precision, scale = (column[4], column[5]) if len(column) > 5 else (None, None)
+        if precision and precision <= ARROW_DECIMAL_MAX_PRECISION:
+            return pa.decimal128(precision, scale or 0)
+        return pa.string()
+    return PG_TYPE_OIDS_TO_ARROW.get(type_code, pa.string())
+
+
+def arrow_schema_from_description(description: Sequence[Any]) -> pa.Schema:
+    """Строит схему Arrow по описанию курсора DB-API (имя столбца, OID типа, точность numeric)."""
+    return pa.schema([(column[0], column_arrow_type(column)) for column in description])
+
+
+def copy_convert_options(schema: pa.Schema) -> pa_csv.ConvertOptions:
+    """
+    Правила разбора CSV из COPY. NULL в нем - только незакавыченный маркер:
+    закавыченные "\\N" и "" - это строки, как и при чтении через курсор.
+    """
+    return pa_csv.ConvertOptions(
+        column_types={field.name: field.type for field in schema},
+        null_values=[COPY_NULL_MARKER],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=["t"],
+        false_values=["f"],
+    )
+
+
+def frame_to_arrow(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """
+    Приводит порцию строк из курсора к заданной схеме Arrow, чтобы все порции
+    одного результата писались в parquet с одинаковыми типами. Decimal
+    остаются decimal128 (или строками, см. `column_arrow_type`), значения
+    без прямого соответствия (UUID, JSON, ...) приводятся к строке.
+    """
+    arrays = []
+    for field in schema:
+        series = df[field.name]
+        if pa.types.is_string(field.type):
+            values = [
+                None if v is None or (isinstance(v, float) and math.isnan(v)) else str(v)
+                for v in series
+            ]
+            arrays.append(pa.array(values, type=pa.string()))
+            continue
+        arrays.append(pa.Array.from_pandas(series, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class _CopyStream(io.RawIOBase):
+    """Файлоподобная обертка над потоком COPY TO STDOUT для pyarrow.csv."""
+
+    def __init__(self, copy: "psycopg.Copy"):
+        self._copy = copy
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not self._buffer:
+            chunk = self._copy.read()
+            if not chunk:
+                return 0
+            self._buffer = memoryview(bytes(chunk))
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class BulkExporter:
+    """
+    Выгружает результат SELECT прямо в кеш агента через COPY ... TO STDOUT.
+
+    Поток CSV разбирается pyarrow по блокам в record batches, которые сразу
+    дописываются в parquet-файл кеша отдельными row groups. Строки не
+    превращаются в объекты Python и не собираются в pandas, поэтому большие
+    выгрузки упираются в пропускную способность БД и сети, а память агента
+    ограничена размером одного блока.
+    """
+
+    def __init__(self):
+        self.db_url = str(settings.DATABASE_URL).replace("+psycopg", "")
+
+    def export(
+        self, sql_code: str, timeout: float, scope: QueryCancelScope, params: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, ResultStatsAccumulator]:
+        """
+        Выполняет запрос и пишет результат в кеш. Вызывается из потока
+        (через `run_cancellable`), так как использует синхронное соединение.
+
+        :param timeout: statement_timeout выгрузки в секундах.
+        :param scope: Через него запрос можно отменить на сервере из event loop.
+        :param params: Значения для `:name` в запросе. COPY не принимает
+            параметры, поэтому они подставляются на клиенте средствами psycopg.
+
+        :return: Ключ кеша и статистика по выгруженным данным.
+        """
+        query = strip_trailing_semicolon(sql_code)
+        with psycopg.connect(self.db_url) as conn:
+            conn.read_only = True
+            scope.bind(conn)
+            if params:
+                compiled = text(query).compile(dialect=PGDialect_psycopg())
+                query = psycopg.ClientCursor(conn).mogrify(str(compiled), compiled.construct_params(params))
+            with conn.cursor() as cur:
+                cur.execute("SET TIME ZONE 'UTC'")
+                cur.execute(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+                # Типы столбцов берем из описания результата, не выполняя сам запрос
+                cur.execute(f"SELECT * FROM ({query}\n) AS _export LIMIT 0")
+                columns = [d.name for d in cur.description]
+                schema = arrow_schema_from_description(cur.description)
+
+                stats = ResultStatsAccumulator(schema)
+                read_options = pa_csv.ReadOptions(column_names=columns, block_size=COPY_READ_BLOCK_SIZE)
+                convert_options = copy_convert_options(schema)
+
+                with cur.copy(f"COPY ({query}\n) TO STDOUT WITH (FORMAT csv, NULL '{COPY_NULL_MARKER}')") as copy:
+                    stream = io.BufferedReader(_CopyStream(copy), buffer_size=COPY_READ_BLOCK_SIZE)
+                    with agent_cache.writer(schema) as entry:
+                        try:
+                            reader = pa_csv.open_csv(stream, read_options=read_options, convert_options=convert_options)
+                        except pa.ArrowInvalid as e:
+                            # Пустой результат: в потоке нет ни одной строки CSV
+                            if "Empty CSV file" not in str(e):
+                                raise
+                            reader = []
+                        for batch in reader:
+                            entry.write(batch)
+                            stats.update(batch)
+
+        logger.info(f"COPY-выгрузка завершена: {stats.row_count} строк, ключ {entry.cache_key}")
+        return entry.cache_key, stats
+
+# Создаем синглтон
+bulk_exporter = BulkExporter()
@@ -0,0 +1,163 @@
+# agent/services/cache_query.py
+import asyncio
+import time
+from typing import Dict, Any, List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from loguru import logger
+
+from agent.schemas import CacheQueryRequest, CacheFilter
+from agent.services.data_cache import agent_cache
+from agent.services.query_log import slow_query_log
+from agent.services.result_builder import build_enriched_response_from_df
+
+# Соответствие агрегатов запроса именам функций pyarrow (Table.group_by().aggregate()).
+AGGREGATE_FUNCTIONS = {
+    "sum": "sum",
+    "mean": "mean",
+    "min": "min",
+    "max": "max",
+    "count": "count",
+    "count_distinct": "count_distinct",
+}
+
+
+class CacheQueryEngine:
+    """
+    Выполняет декларативные запросы (проекция, фильтры, группировка, сортировка, limit)
+    над закешированными результатами прямо в процессе агента, без песочницы.
+
+    Файл кеша читается через pyarrow.dataset: фильтры передаются сканеру как выражение,
+    поэтому row group'ы, отсекаемые по статистике parquet (min/max), не читаются с диска.
+    """
+
+    def _build_filter(self, filters: List[CacheFilter], schema: pa.Schema) -> ds.Expression:
+        """Собирает выражение pyarrow из списка условий (через AND)."""
+        expression = None
+        for f in filters:
+            if f.column not in schema.names:
+                raise ValueError(f"Столбец '{f.column}' отсутствует в результате.")
+            field = ds.field(f.column)
+            field_type = schema.field(f.column).type
+
+            if f.op == "is_null":
+                condition = field.is_null()
+            elif f.op == "not_null":
+                condition = field.is_valid()
+            elif f.op in ("in", "not_in"):
+                if not isinstance(f.value, list):
+                    raise ValueError(f"Оператор '{f.op}' ожидает список значений для столбца '{f.column}'.")
+                values = pa.array([self._cast_value(v, field_type) for v in f.value], type=field_type)
+                condition = field.isin(values)
+                if f.op == "not_in":
+                    condition = ~condition
+            else:
+                value = self._cast_value(f.value, field_type)
+                condition = {
+                    "==": field == value,
+                    "!=": field != value,
+                    "<": field < value,
+                    "<=": field <= value,
+                    ">": field > value,
+                    ">=": field >= value,
+                }[f.op]
+
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    @staticmethod
+    def _cast_value(value: Any, field_type: pa.DataType) -> pa.Scalar:
+        """
+        Приводит значение из JSON к типу столбца, чтобы, например, строку
+        '2024-01-01' можно было сравнить со столбцом-датой.
+        """
+        if value is None:
+            return pa.scalar(None, type=field_type)
+        try:
+            return pa.scalar(value).cast(field_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            raise ValueError(f"Значение {value!r} нельзя привести к типу столбца ({field_type}).")
+
+    def _execute(self, cache_key: str, request: CacheQueryRequest) -> pa.Table:
+        dataset = ds.dataset(agent_cache.path_for(cache_key), format="parquet")
+        schema = dataset.schema
+
+        referenced = set(request.group_by) | {a.column for a in request.aggregations}
+        if not request.aggregations:
+            referenced |= set(request.columns or [])
+        unknown = referenced - set(schema.names)
+        if unknown:
+            raise ValueError(f"Столбцы отсутствуют в результате: {', '.join(sorted(unknown))}.")
+
+        if request.aggregations:
+            scan_columns = list(dict.fromkeys(request.group_by + [a.column for a in request.aggregations]))
+        else:
+            scan_columns = request.columns or schema.names
+
+        table = dataset.to_table(
+            columns=scan_columns,
+            filter=self._build_filter(request.filters, schema) if request.filters else None,
+        )
+
+        if request.aggregations:
+            table = table.group_by(request.group_by).aggregate(
+                [(a.column, AGGREGATE_FUNCTIONS[a.func]) for a in request.aggregations]
+            )
+            # pyarrow называет агрегаты '<column>_<func>', переименовываем в alias
+            output_names = [a.alias or f"{a.column}_{a.func}" for a in request.aggregations]
+            table = table.select(
+                request.group_by + [f"{a.column}_{AGGREGATE_FUNCTIONS[a.func]}" for a in request.aggregations]
+            ).rename_columns(request.group_by + output_names)
+            if request.columns:
+                unknown = set(request.columns) - set(table.column_names)
+                if unknown:
+                    raise ValueError(f"Столбцы отсутствуют в результате агрегации: {', '.join(sorted(unknown))}.")
+                table = table.select(request.columns)
+
+        if request.order_by:
+            unknown = {s.column for s in request.order_by} - set(table.column_names)
+            if unknown:
+                raise ValueError(f"Нельзя отсортировать по отсутствующим столбцам: {', '.join(sorted(unknown))}.")
+            table = table.take(pc.sort_indices(
+                table,
+                sort_keys=[(s.column, "descending" if s.descending else "ascending") for s in request.order_by],
+            ))
+
+        if request.limit is not None:
+            table = table.slice(0, request.limit)
+        return table
+
+    async def query(self, cache_key: str, request: CacheQueryRequest) -> Dict[str, Any]:
+        """
+        Выполняет запрос к записи кеша и возвращает обогащенный результат.
+        При `save_result=True` результат сохраняется в кеш под новым ключом.
+        """
+        start_time = time.monotonic()
+        try:
+            table = await asyncio.to_thread(self._execute, cache_key, request)
+        except FileNotFoundError:
+            return {"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден. Возможно, кеш агента был очищен или время жизни истекло."}}
+        except ValueError as e:
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": str(e)}}
+        except (pa.ArrowException, KeyError) as e:
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": f"Не удалось выполнить запрос к кешу: {e}"}}
+
+        df = table.to_pandas()
+        exec_time_ms = (time.monotonic() - start_time) * 1000
+        logger.info(f"Запрос к кешу '{cache_key}' выполнен за {exec_time_ms:.2f} ms. Строк: {len(df)}")
+
+        enriched_response = build_enriched_response_from_df(df, exec_time_ms)
+        # Запрос обслужен кешем без обращения к базе; в журнале его форма - JSON запроса
+        query_text = "cache query: " + request.model_dump_json(exclude={"save_result"})
+        await asyncio.to_thread(slow_query_log.record, query_text, exec_time_ms, enriched_response, True)
+        if request.save_result:
+            try:
+                enriched_response["cache_key"] = agent_cache.save(df)
+            except Exception as e:
+                logger.error(f"Не удалось закешировать результат запроса к кешу: {e}")
+        return enriched_response
+
+# Создаем синглтон
+cache_query_engine = CacheQueryEngine()
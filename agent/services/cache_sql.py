@@ -0,0 +1,95 @@
+# agent/services/cache_sql.py
+import asyncio
+import re
+import time
+from typing import Dict, Any
+
+import duckdb
+import pyarrow.dataset as ds
+from loguru import logger
+
+from agent.config import settings
+from agent.services.sql_safety_check import is_sql_safe
+from agent.services.data_cache import agent_cache
+from agent.services.query_log import slow_query_log
+from agent.services.result_builder import build_enriched_response_from_df
+
+# Ссылка на закешированный результат внутри запроса: cache('<key>')
+CACHE_REFERENCE_PATTERN = re.compile(r"\bcache\s*\(\s*'([^']*)'\s*\)", re.IGNORECASE)
+
+
+class CacheSQLEngine:
+    """
+    Read-only SQL над закешированными результатами, например
+    `SELECT ... FROM cache('k1') JOIN cache('k2') USING (id)`.
+
+    Запрос выполняется во встроенном колоночном движке DuckDB в процессе агента.
+    Записи кеша регистрируются как Arrow-датасеты, после чего доступ DuckDB
+    к файловой системе отключается, а конфигурация (включая лимит памяти) блокируется.
+    """
+
+    def _execute(self, sql: str, tables: Dict[str, str]):
+        connection = duckdb.connect(
+            ":memory:",
+            config={
+                "memory_limit": f"{settings.CACHE_SQL_MEMORY_LIMIT_MB}MB",
+                "threads": settings.CACHE_SQL_THREADS,
+            },
+        )
+        try:
+            for table_name, path in tables.items():
+                connection.register(table_name, ds.dataset(path, format="parquet"))
+            connection.execute("SET enable_external_access = false")
+            connection.execute("SET lock_configuration = true")
+            return connection.execute(sql).df()
+        finally:
+            connection.close()
+
+    async def run(self, sql: str, save_result: bool = True) -> Dict[str, Any]:
+        """
+        Проверяет запрос теми же правилами, что и SQL к БД клиента, подставляет
+        вместо cache('<key>') зарегистрированные таблицы и выполняет его.
+        """
+        is_safe, error_message = is_sql_safe(sql, "duckdb")
+        if not is_safe:
+            return {"status": "error", "error": {"type": "PERMISSION_ERROR", "message": error_message}}
+
+        tables: Dict[str, str] = {}
+        table_names: Dict[str, str] = {}
+        for cache_key in CACHE_REFERENCE_PATTERN.findall(sql):
+            if cache_key in table_names:
+                continue
+            try:
+                path = agent_cache.path_for(cache_key)
+            except FileNotFoundError:
+                return {"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден. Возможно, кеш агента был очищен или время жизни истекло."}}
+            table_name = f"__cache_{len(table_names)}"
+            table_names[cache_key] = table_name
+            tables[table_name] = str(path)
+
+        if not tables:
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": "Запрос не ссылается ни на один результат из кеша. Используйте cache('<key>') в FROM/JOIN."}}
+
+        rewritten_sql = CACHE_REFERENCE_PATTERN.sub(lambda m: table_names[m.group(1)], sql)
+
+        start_time = time.monotonic()
+        try:
+            df = await asyncio.to_thread(self._execute, rewritten_sql, tables)
+        except duckdb.OutOfMemoryException as e:
+            return {"status": "error", "error": {"type": "MEMORY_LIMIT_ERROR", "message": f"Запрос превысил лимит памяти ({settings.CACHE_SQL_MEMORY_LIMIT_MB} MB): {e}"}}
+        except duckdb.Error as e:
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": str(e).strip()}}
+        exec_time_ms = (time.monotonic() - start_time) * 1000
+        logger.info(f"SQL над кешем выполнен за {exec_time_ms:.2f} ms. Строк: {len(df)}")
+
+        enriched_response = build_enriched_response_from_df(df, exec_time_ms)
+        await asyncio.to_thread(slow_query_log.record, sql, exec_time_ms, enriched_response, True)
+        if save_result:
+            try:
+                enriched_response["cache_key"] = agent_cache.save(df)
+            except Exception as e:
+                logger.error(f"Не удалось закешировать результат SQL над кешем: {e}")
+        return enriched_response
+
+# Создаем синглтон
+cache_sql_engine = CacheSQLEngine()
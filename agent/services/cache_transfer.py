@@ -0,0 +1,135 @@
+# agent/services/cache_transfer.py
+import asyncio
+import io
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from agent.config import settings
+from agent.services import data_cache
+from agent.services.data_cache import agent_cache
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+PARQUET_MEDIA_TYPES = (PARQUET_MEDIA_TYPE, "application/x-parquet", "application/octet-stream")
+# Сколько строк parquet читается за раз при отдаче записи в формате Arrow
+DOWNLOAD_BATCH_ROWS = 64 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файлоподобный приемник для pyarrow: накапливает записанные байты до следующего `take`."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class CacheTransfer:
+    """
+    Бинарная загрузка данных в кеш и выгрузка из него, минуя JSON: тело
+    запроса (Arrow IPC stream или parquet) потоково пишется на диск, а запись
+    кеша отдается как есть (parquet) или потоком Arrow IPC по row groups.
+    """
+
+    async def upload(
+        self,
+        chunks: AsyncIterator[bytes],
+        media_type: str,
+        ttl_seconds: Optional[float] = None,
+        priority: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Сохраняет тело запроса в новую запись кеша.
+
+        :param chunks: Тело запроса по частям (например, `request.stream()`).
+        :param media_type: Content-Type тела без параметров.
+        :param ttl_seconds: Свой TTL записи (см. AgentDataCache.set_policy).
+        :param priority: Приоритет записи при вытеснении по размеру.
+        """
+        is_arrow = media_type == ARROW_STREAM_MEDIA_TYPE
+        if not is_arrow and media_type not in PARQUET_MEDIA_TYPES:
+            return {"status": "error", "error": {"type": "UNSUPPORTED_MEDIA_TYPE", "message": f"Ожидается {ARROW_STREAM_MEDIA_TYPE} или {PARQUET_MEDIA_TYPE}, получен '{media_type}'."}}
+
+        limit_bytes = settings.CACHE_UPLOAD_MAX_MB * 1024**2
+        tmp_path = data_cache.CACHE_DIR / f"upload-{uuid.uuid4()}.tmp"
+        size = 0
+        try:
+            with open(tmp_path, "wb") as spool:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > limit_bytes:
+                        return {"status": "error", "error": {"type": "PAYLOAD_TOO_LARGE", "message": f"Тело запроса больше {settings.CACHE_UPLOAD_MAX_MB} МБ."}}
+                    spool.write(chunk)
+            try:
+                if is_arrow:
+                    cache_key = await asyncio.to_thread(self._import_arrow_stream, tmp_path, ttl_seconds, priority)
+                else:
+                    cache_key = await asyncio.to_thread(agent_cache.import_parquet, tmp_path, ttl_seconds, priority)
+            except (pa.ArrowException, OSError) as e:
+                return {"status": "error", "error": {"type": "DESERIALIZATION_ERROR", "message": f"Не удалось прочитать тело запроса: {e}"}}
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        metadata = pq.read_metadata(agent_cache.existing_path(cache_key))
+        logger.info(f"Загружено в кеш {size} байт ({metadata.num_rows} строк). Ключ: {cache_key}")
+        return {
+            "status": "success",
+            "cache_key": cache_key,
+            "row_count": metadata.num_rows,
+            "columns": [{"name": field.name, "type": str(field.type)} for field in metadata.schema.to_arrow_schema()],
+            "size_bytes": size,
+        }
+
+    @staticmethod
+    def _import_arrow_stream(path: Path, ttl_seconds: Optional[float] = None, priority: Optional[int] = None) -> str:
+        """Перекладывает Arrow IPC stream в parquet-запись кеша пакет за пакетом."""
+        with pa.OSFile(str(path), "rb") as source:
+            reader = pa.ipc.open_stream(source)
+            with agent_cache.writer(reader.schema, ttl_seconds=ttl_seconds, priority=priority) as writer:
+                for batch in reader:
+                    writer.write(batch)
+                return writer.cache_key
+
+    @staticmethod
+    def parquet_path(cache_key: str) -> Path:
+        """Путь к parquet-файлу записи для отдачи как есть. :raises FileNotFoundError: Записи нет."""
+        return agent_cache.path_for(cache_key)
+
+    def arrow_stream(self, cache_key: str) -> Tuple[pa.Schema, Iterator[bytes]]:
+        """
+        Открывает запись кеша и возвращает ее схему и генератор Arrow IPC
+        stream. Файл читается по DOWNLOAD_BATCH_ROWS строк, в памяти держится
+        только текущий пакет.
+
+        :raises FileNotFoundError: Записи нет (проверяется до начала ответа).
+        """
+        parquet_file = pq.ParquetFile(agent_cache.path_for(cache_key))
+        schema = parquet_file.schema_arrow
+
+        def chunks() -> Iterator[bytes]:
+            sink = _ChunkSink()
+            with pa.ipc.new_stream(sink, schema) as writer:
+                for batch in parquet_file.iter_batches(batch_size=DOWNLOAD_BATCH_ROWS):
+                    writer.write_batch(batch)
+                    yield sink.take()
+            yield sink.take()
+
+        return schema, chunks()
+
+# Создаем синглтон
+cache_transfer = CacheTransfer()
@@ -1,98 +1,400 @@
 # agent/services/data_cache.py
+import fcntl
+import json
+import re
+import time
 import uuid
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from loguru import logger
 import os
-from datetime import datetime, timedelta
+import shutil
+from datetime import datetime
+
+from agent.config import settings
 
 CACHE_DIR = Path("./.data_cache")
 CACHE_DIR.mkdir(exist_ok=True)
-# --- НОВЫЕ КОНСТАНТЫ ---
-CACHE_TTL_HOURS = 12  # Время жизни файла в часах
-CACHE_MAX_SIZE_MB = 512  # Максимальный размер папки кеша в МБ
-CACHE_CLEANUP_TARGET_MB = 400 # До какого размера чистить (чтобы не чистить по 1 файлу)
-# ----------------------
+# Держатель закрепления по умолчанию (закрепления через API)
+DEFAULT_PIN_HOLDER = "api"
+# Файл блокировки политик хранения, общий для всех воркеров (не удаляется)
+POLICY_LOCK_NAME = ".policy.lock"
+# Ключи кеша приходят из URL, поэтому допускаем только формат uuid4,
+# чтобы ключ нельзя было использовать для выхода за пределы CACHE_DIR.
+CACHE_KEY_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+class CacheEntryWriter:
+    """Пишет запись кеша по частям: каждый вызов `write` добавляет row group(ы) в parquet-файл."""
+
+    def __init__(self, cache_key: str, writer: pq.ParquetWriter):
+        self.cache_key = cache_key
+        self._writer = writer
+        self.rows_written = 0
+
+    def write(self, batch: Union[pa.RecordBatch, pa.Table]) -> None:
+        if isinstance(batch, pa.RecordBatch):
+            batch = pa.Table.from_batches([batch])
+        self._writer.write_table(batch)
+        self.rows_written += batch.num_rows
+
 
 class AgentDataCache:
-    """Дисковый кеш для DataFrame'ов с TTL и ограничением по размеру."""
+    """
+    Дисковый кеш для DataFrame'ов с TTL и ограничением по размеру.
+
+    У записи могут быть свой TTL и приоритет (при вытеснении по размеру
+    первыми удаляются записи с меньшим приоритетом) и закрепления: закрепленная
+    запись не удаляется ни по TTL, ни по размеру, пока не снято последнее
+    закрепление или не истек его срок. Закрепление принадлежит держателю
+    (например, сессии), поэтому несколько держателей не мешают друг другу.
+    """
 
     def __init__(self):
-        self._ttl = timedelta(hours=CACHE_TTL_HOURS)
-        self._max_size_bytes = CACHE_MAX_SIZE_MB * 1024 * 1024
-        self._cleanup_target_bytes = CACHE_CLEANUP_TARGET_MB * 1024 * 1024
+        # Счетчики текущего воркера
+        self._hits = 0
+        self._misses = 0
+        self._evictions = {"ttl": 0, "size": 0}
+        self._evicted_bytes = 0
 
-    def _cleanup(self):
-        """Запускает очистку кеша: сначала по TTL, потом по размеру (LRU)."""
-        logger.info("Запуск очистки кеша...")
-        now = datetime.now()
-        files_with_meta = []
-        current_size = 0
+    @staticmethod
+    def _default_ttl_seconds() -> float:
+        return settings.CACHE_TTL_HOURS * 3600
+
+    @staticmethod
+    def _is_pinned(policy: Dict[str, Any], now: float) -> bool:
+        return any(expires_at is None or expires_at > now for expires_at in policy["pins"].values())
 
-        # Собираем метаданные файлов
+    def _scan(self) -> List[Dict[str, Any]]:
+        """Записи кеша с размерами, временем доступа и политикой хранения."""
+        entries = []
         for entry in CACHE_DIR.iterdir():
             if entry.is_file() and entry.suffix == '.parquet':
                 try:
                     stat = entry.stat()
-                    files_with_meta.append({
-                        "path": entry,
-                        "size": stat.st_size,
-                        "atime": stat.st_atime, # Время последнего доступа
-                        "mtime": stat.st_mtime  # Время последней модификации
-                    })
-                    current_size += stat.st_size
                 except FileNotFoundError:
                     continue # Файл мог быть удален другим процессом
+                entries.append({
+                    "path": entry,
+                    "size": stat.st_size,
+                    "atime": stat.st_atime, # Время последнего доступа
+                    "mtime": stat.st_mtime,  # Время последней модификации (обновляется при каждом обращении)
+                    "policy": self._read_policy(entry.stem),
+                })
+        return entries
+
+    def _evict(self, entry: Dict[str, Any], reason: str) -> bool:
+        with self._policy_lock():
+            # Запись могли закрепить после сканирования
+            if self._is_pinned(self._read_policy(entry["path"].stem), time.time()):
+                return False
+            try:
+                os.remove(entry["path"])
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл кеша {entry['path']}: {e}")
+                return False
+            self._remove_sidecars(entry["path"].stem)
+        self._evictions[reason] += 1
+        self._evicted_bytes += entry["size"]
+        return True
+
+    def _cleanup(self):
+        """Запускает очистку кеша: сначала по TTL, потом по размеру (LRU с учетом приоритета)."""
+        logger.info("Запуск очистки кеша...")
+        now = time.time()
+        files_with_meta = self._scan()
+        current_size = sum(f["size"] for f in files_with_meta)
 
-        # 1. Очистка по TTL
+        # 1. Очистка по TTL (отсчитывается от последнего обращения к записи)
         expired_files = [
             f for f in files_with_meta
-            if now - datetime.fromtimestamp(f["mtime"]) > self._ttl
+            if not self._is_pinned(f["policy"], now)
+            and now - f["mtime"] > (f["policy"]["ttl_seconds"] or self._default_ttl_seconds())
         ]
         if expired_files:
             logger.info(f"Найдено {len(expired_files)} просроченных файлов для удаления...")
             for f in expired_files:
-                try:
-                    os.remove(f["path"])
+                if self._evict(f, "ttl"):
                     current_size -= f["size"]
-                except OSError as e:
-                    logger.warning(f"Не удалось удалить просроченный файл кеша {f['path']}: {e}")
 
-        # 2. Очистка по размеру (LRU - удаляем самые старые по доступу)
-        if current_size > self._max_size_bytes:
-            logger.info(f"Размер кеша ({current_size / 1024**2:.2f} MB) превышает лимит ({CACHE_MAX_SIZE_MB} MB). Запускаю LRU-очистку.")
-            # Сортируем оставшиеся файлы по времени последнего доступа (самые старые сначала)
-            remaining_files = [f for f in files_with_meta if f not in expired_files]
-            remaining_files.sort(key=lambda x: x["atime"])
+        # 2. Очистка по размеру: сначала меньший приоритет, внутри него - самые старые по доступу
+        max_size_bytes = settings.CACHE_MAX_SIZE_MB * 1024 * 1024
+        if current_size > max_size_bytes:
+            logger.info(f"Размер кеша ({current_size / 1024**2:.2f} MB) превышает лимит ({settings.CACHE_MAX_SIZE_MB} MB). Запускаю LRU-очистку.")
+            remaining_files = [
+                f for f in files_with_meta
+                if f not in expired_files and not self._is_pinned(f["policy"], now)
+            ]
+            remaining_files.sort(key=lambda x: (x["policy"]["priority"], x["atime"]))
 
-            while current_size > self._cleanup_target_bytes and remaining_files:
+            cleanup_target_bytes = settings.CACHE_CLEANUP_TARGET_MB * 1024 * 1024
+            while current_size > cleanup_target_bytes and remaining_files:
                 file_to_delete = remaining_files.pop(0)
-                try:
-                    os.remove(file_to_delete["path"])
+                if self._evict(file_to_delete, "size"):
                     current_size -= file_to_delete["size"]
                     logger.info(f"Удален старый файл: {file_to_delete['path'].name}")
-                except OSError as e:
-                    logger.warning(f"Не удалось удалить старый файл кеша {file_to_delete['path']}: {e}")
+            if current_size > cleanup_target_bytes:
+                logger.warning(f"Закрепленные записи занимают {current_size / 1024**2:.2f} MB: кеш не удалось сократить до {settings.CACHE_CLEANUP_TARGET_MB} MB.")
+
+    def _path(self, cache_key: str) -> Path:
+        """Возвращает путь к файлу кеша, проверяя формат ключа."""
+        if not CACHE_KEY_PATTERN.match(cache_key):
+            logger.error(f"Некорректный формат ключа кеша: {cache_key!r}")
+            raise FileNotFoundError(f"Cache key {cache_key} not found.")
+        return CACHE_DIR / f"{cache_key}.parquet"
+
+    @staticmethod
+    def _meta_path_unchecked(cache_key: str) -> Path:
+        return CACHE_DIR / f"{cache_key}.meta.json"
+
+    @staticmethod
+    def _policy_path_unchecked(cache_key: str) -> Path:
+        return CACHE_DIR / f"{cache_key}.policy.json"
+
+    def _remove_sidecars(self, cache_key: str) -> None:
+        self._meta_path_unchecked(cache_key).unlink(missing_ok=True)
+        self._policy_path_unchecked(cache_key).unlink(missing_ok=True)
+
+    def _read_policy(self, cache_key: str) -> Dict[str, Any]:
+        """Политика хранения записи: свой TTL (None - общий), приоритет и закрепления (держатель -> срок или None)."""
+        policy = {"ttl_seconds": None, "priority": 0, "pins": {}}
+        try:
+            policy.update(json.loads(self._policy_path_unchecked(cache_key).read_text(encoding="utf-8")))
+        except (FileNotFoundError, ValueError):
+            pass
+        return policy
+
+    @staticmethod
+    @contextmanager
+    def _policy_lock() -> Iterator[None]:
+        """
+        Исключительная блокировка политик хранения (flock) на время
+        чтения-изменения-записи: иначе закрепления, одновременно добавленные
+        разными воркерами, затирали бы друг друга.
+        """
+        fd = os.open(CACHE_DIR / POLICY_LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _write_policy(self, cache_key: str, policy: Dict[str, Any]) -> None:
+        policy_path = self._policy_path_unchecked(cache_key)
+        tmp_path = policy_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(policy), encoding="utf-8")
+        os.replace(tmp_path, policy_path)
 
-    def save(self, df: pd.DataFrame) -> str:
-        """Сохраняет DataFrame и запускает очистку."""
+    def existing_path(self, cache_key: str) -> Path:
+        """
+        Путь к файлу существующей записи без обновления времени доступа и без
+        учета в статистике попаданий. Для служебных обращений (проверка
+        наличия, размер, схема), которые не являются чтением данных.
+
+        :raises FileNotFoundError: Записи нет.
+        """
+        file_path = self._path(cache_key)
+        if not file_path.exists():
+            raise FileNotFoundError(f"Cache key {cache_key} not found.")
+        return file_path
+
+    def set_policy(self, cache_key: str, ttl_seconds: Optional[float] = None, priority: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Задает записи свой TTL (от последнего обращения) и/или приоритет вытеснения.
+
+        :raises FileNotFoundError: Записи нет.
+        """
+        with self._policy_lock():
+            self.existing_path(cache_key)
+            policy = self._read_policy(cache_key)
+            if ttl_seconds is not None:
+                policy["ttl_seconds"] = ttl_seconds
+            if priority is not None:
+                policy["priority"] = priority
+            self._write_policy(cache_key, policy)
+        return policy
+
+    def pin(self, cache_key: str, holder: str = DEFAULT_PIN_HOLDER, ttl_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Закрепляет запись за держателем: бессрочно или на `ttl_seconds`.
+
+        :raises FileNotFoundError: Записи нет.
+        """
+        with self._policy_lock():
+            self.existing_path(cache_key)
+            policy = self._read_policy(cache_key)
+            policy["pins"][holder] = time.time() + ttl_seconds if ttl_seconds is not None else None
+            self._write_policy(cache_key, policy)
+        return policy
+
+    def unpin(self, cache_key: str, holder: str = DEFAULT_PIN_HOLDER) -> bool:
+        """Снимает закрепление держателя. Возвращает False, если его не было."""
+        self._path(cache_key)
+        with self._policy_lock():
+            policy = self._read_policy(cache_key)
+            if holder not in policy["pins"]:
+                return False
+            del policy["pins"][holder]
+            if self._path(cache_key).exists():
+                self._write_policy(cache_key, policy)
+        return True
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Записи кеша (сначала недавно использованные) с размером, временем доступа и политикой хранения."""
+        now = time.time()
+        result = []
+        for entry in sorted(self._scan(), key=lambda x: x["mtime"], reverse=True):
+            policy = entry["policy"]
+            ttl_seconds = policy["ttl_seconds"] or self._default_ttl_seconds()
+            pinned = self._is_pinned(policy, now)
+            result.append({
+                "cache_key": entry["path"].stem,
+                "size_bytes": entry["size"],
+                "last_access": datetime.fromtimestamp(entry["mtime"]).isoformat(),
+                "ttl_seconds": ttl_seconds,
+                "expires_at": None if pinned else datetime.fromtimestamp(entry["mtime"] + ttl_seconds).isoformat(),
+                "priority": policy["priority"],
+                "pinned": pinned,
+                "pinned_by": sorted(holder for holder, expires_at in policy["pins"].items() if expires_at is None or expires_at > now),
+            })
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Размер кеша (общий для хоста) и счетчики обращений и вытеснений (по текущему воркеру)."""
+        now = time.time()
+        entries = self._scan()
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(entries),
+            "pinned_entries": sum(1 for entry in entries if self._is_pinned(entry["policy"], now)),
+            "size_bytes": sum(entry["size"] for entry in entries),
+            "max_size_bytes": settings.CACHE_MAX_SIZE_MB * 1024 * 1024,
+            "worker_pid": os.getpid(),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+            "evictions": dict(self._evictions),
+            "evicted_bytes": self._evicted_bytes,
+        }
+
+    def read_meta(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Читает служебные метаданные записи (например, регистрацию для
+        инкрементального обновления). None, если их нет.
+        """
+        self._path(cache_key)  # Проверка формата ключа
+        meta_path = self._meta_path_unchecked(cache_key)
+        if not meta_path.exists():
+            return None
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+
+    def write_meta(self, cache_key: str, meta: Dict[str, Any]) -> None:
+        """Атомарно сохраняет метаданные записи рядом с ее parquet-файлом; удаляются вместе с ним."""
+        self._path(cache_key)
+        meta_path = self._meta_path_unchecked(cache_key)
+        tmp_path = meta_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp_path, meta_path)
+
+    def path_for(self, cache_key: str) -> Path:
+        """
+        Возвращает путь к parquet-файлу существующей записи кеша и обновляет
+        время доступа к нему. Нужен сервисам, которые читают файл напрямую
+        (например, через pyarrow.dataset), не загружая его целиком в pandas.
+        """
+        file_path = self._path(cache_key)
+        if not file_path.exists():
+            self._misses += 1
+            logger.error(f"Ключ кеша не найден: {cache_key}")
+            raise FileNotFoundError(f"Cache key {cache_key} not found.")
+        self._hits += 1
+        file_path.touch(exist_ok=True)
+        return file_path
+
+    def save(self, df: pd.DataFrame, ttl_seconds: Optional[float] = None, priority: Optional[int] = None) -> str:
+        """Сохраняет DataFrame (с необязательными TTL и приоритетом записи) и запускает очистку."""
         self._cleanup() # Запускаем очистку перед каждым сохранением
         cache_key = str(uuid.uuid4())
-        file_path = CACHE_DIR / f"{cache_key}.parquet"
+        file_path = self._path(cache_key)
         try:
             df.to_parquet(file_path, index=False)
+            if ttl_seconds is not None or priority is not None:
+                self.set_policy(cache_key, ttl_seconds, priority)
             logger.info(f"DataFrame сохранен в кеш. Ключ: {cache_key}")
             return cache_key
         except Exception as e:
             logger.error(f"Не удалось сохранить DataFrame в кеш: {e}")
             raise
 
+    def import_parquet(self, source: Path, ttl_seconds: Optional[float] = None, priority: Optional[int] = None) -> str:
+        """
+        Перемещает готовый parquet-файл (например, выгруженный из песочницы) в кеш
+        без чтения в pandas. Файл проверяется на корректность перед переносом.
+        """
+        self._cleanup()
+        pq.ParquetFile(source)  # Бросит исключение, если это не parquet
+        cache_key = str(uuid.uuid4())
+        file_path = self._path(cache_key)
+        shutil.move(str(source), file_path)
+        if ttl_seconds is not None or priority is not None:
+            self.set_policy(cache_key, ttl_seconds, priority)
+        logger.info(f"Parquet-файл импортирован в кеш. Ключ: {cache_key}")
+        return cache_key
+
+    @contextmanager
+    def writer(
+        self,
+        schema: pa.Schema,
+        cache_key: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        priority: Optional[int] = None,
+    ) -> Iterator[CacheEntryWriter]:
+        """
+        Открывает новую запись кеша для потоковой записи, не собирая данные в памяти.
+        Файл пишется под временным именем и появляется в кеше только после
+        успешного выхода из блока `with`; при исключении он удаляется.
+        С `cache_key` существующая запись атомарно заменяется новым содержимым
+        (ее политика хранения сохраняется).
+        """
+        self._cleanup()
+        cache_key = cache_key or str(uuid.uuid4())
+        file_path = self._path(cache_key)
+        tmp_path = CACHE_DIR / f"{cache_key}.tmp"
+        parquet_writer = pq.ParquetWriter(tmp_path, schema)
+        try:
+            yield CacheEntryWriter(cache_key, parquet_writer)
+            parquet_writer.close()
+            os.replace(tmp_path, file_path)
+            if ttl_seconds is not None or priority is not None:
+                self.set_policy(cache_key, ttl_seconds, priority)
+            logger.info(f"Данные записаны в кеш потоково. Ключ: {cache_key}")
+        except BaseException:
+            parquet_writer.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def delete(self, cache_key: str) -> bool:
+        """Удаляет запись кеша вместе с ее метаданными. Возвращает False, если записи не было."""
+        file_path = self._path(cache_key)
+        self._remove_sidecars(cache_key)
+        try:
+            file_path.unlink()
+        except FileNotFoundError:
+            return False
+        logger.info(f"Запись кеша удалена. Ключ: {cache_key}")
+        return True
+
     def load(self, cache_key: str) -> pd.DataFrame:
         """Загружает DataFrame и обновляет время доступа к файлу."""
-        file_path = CACHE_DIR / f"{cache_key}.parquet"
+        file_path = self._path(cache_key)
         if not file_path.exists():
+            self._misses += 1
             logger.error(f"Ключ кеша не найден: {cache_key}")
             raise FileNotFoundError(f"Cache key {cache_key} not found.")
+        self._hits += 1
         try:
             # Обновляем время доступа, чтобы LRU-логика работала корректно
             file_path.touch(exist_ok=True)
@@ -102,3 +404,6 @@ class AgentDataCache:
         except Exception as e:
             logger.error(f"Не удалось загрузить DataFrame из кеша: {e}")
             raise
+
+# Единственный экземпляр кеша, общий для всех сервисов агента
+agent_cache = AgentDataCache()
@@ -0,0 +1,243 @@
+# agent/services/docker_async.py
+import os
+import re
+import struct
+from pathlib import Path
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+DOCKER_API_VERSION = "v1.41"
+DEFAULT_DOCKER_HOST = "unix:///var/run/docker.sock"
+# Таймаут на обычные вызовы Docker Engine API. Ожидание завершения контейнера
+# и чтение логов выполняются без таймаута: дедлайн задает вызывающий код.
+REQUEST_TIMEOUT_SECONDS = 30.0
+
+# Заголовок кадра мультиплексированного потока логов: тип потока (1 байт),
+# 3 байта выравнивания и размер полезной нагрузки (uint32, big-endian).
+LOG_FRAME_HEADER = struct.Struct(">BxxxI")
+STDOUT_STREAM, STDERR_STREAM = 1, 2
+
+
+class DockerAPIError(Exception):
+    """Docker Engine API вернул ошибку."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Docker API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class DockerNotFoundError(DockerAPIError):
+    """Образ, контейнер или exec-сессия не найдены (HTTP 404)."""
+
+
+def parse_memory_limit(value: str) -> int:
+    """Переводит лимит памяти в формате Docker ('256m', '1.5g') в байты."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([bkmg]?)\s*", value.lower())
+    if not match:
+        raise ValueError(f"Некорректный лимит памяти: {value!r}")
+    number, unit = match.groups()
+    return int(float(number) * {"": 1, "b": 1, "k": 1024, "m": 1024**2, "g": 1024**3}[unit])
+
+
+def demultiplex_logs(chunks: List[bytes]) -> Tuple[bytes, bytes]:
+    """Разбирает мультиплексированный поток логов контейнера (без TTY) на stdout и stderr."""
+    buffer = b"".join(chunks)
+    stdout, stderr = bytearray(), bytearray()
+    offset = 0
+    while offset + LOG_FRAME_HEADER.size <= len(buffer):
+        stream_type, size = LOG_FRAME_HEADER.unpack_from(buffer, offset)
+        offset += LOG_FRAME_HEADER.size
+        payload = buffer[offset:offset + size]
+        offset += size
+        if stream_type == STDERR_STREAM:
+            stderr += payload
+        else:
+            stdout += payload
+    return bytes(stdout), bytes(stderr)
+
+
+class AsyncDockerClient:
+    """
+    Минимальный асинхронный клиент Docker Engine API поверх httpx.
+
+    В отличие от docker-py, ни один вызов не блокирует event loop, поэтому
+    медленный ответ демона задерживает только тот запрос, которому он нужен.
+    Адрес демона берется из DOCKER_HOST (unix:// или tcp://), как у docker CLI.
+    """
+
+    def __init__(self, docker_host: Optional[str] = None):
+        self.docker_host = docker_host or os.getenv("DOCKER_HOST") or DEFAULT_DOCKER_HOST
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if self.docker_host.startswith("unix://"):
+                transport = httpx.AsyncHTTPTransport(uds=self.docker_host[len("unix://"):])
+                base_url = "http://docker"
+            else:
+                transport = httpx.AsyncHTTPTransport()
+                base_url = self.docker_host.replace("tcp://", "http://", 1)
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                base_url=f"{base_url}/{DOCKER_API_VERSION}",
+                timeout=REQUEST_TIMEOUT_SECONDS,
+            )
+        return self._client
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response) -> None:
+        if response.status_code < 400:
+            return
+        try:
+            message = response.json().get("message", response.text)
+        except ValueError:
+            message = response.text
+        if response.status_code == 404:
+            raise DockerNotFoundError(response.status_code, message)
+        raise DockerAPIError(response.status_code, message)
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = await self._get_client().request(method, path, **kwargs)
+        self._raise_for_status(response)
+        return response
+
+    async def create_container(
+        self,
+        image: str,
+        environment: Dict[str, str],
+        network: str,
+        mem_limit: str,
+        cpu_period: int,
+        cpu_quota: int,
+        command: Optional[List[str]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> str:
+        """Создает контейнер (без запуска) и возвращает его id."""
+        body: Dict[str, Any] = {
+            "Image": image,
+            "Env": [f"{key}={value}" for key, value in environment.items()],
+            "Labels": labels or {},
+            "HostConfig": {
+                "NetworkMode": network,
+                "Memory": parse_memory_limit(mem_limit),
+                "CpuPeriod": cpu_period,
+                "CpuQuota": cpu_quota,
+            },
+        }
+        if command:
+            body["Cmd"] = command
+        response = await self._request("POST", "/containers/create", json=body)
+        return response.json()["Id"]
+
+    async def start_container(self, container_id: str) -> None:
+        await self._request("POST", f"/containers/{container_id}/start")
+
+    async def wait_container(self, container_id: str) -> int:
+        """Ждет завершения контейнера и возвращает код выхода."""
+        response = await self._request("POST", f"/containers/{container_id}/wait", timeout=None)
+        return response.json().get("StatusCode", -1)
+
+    async def kill_container(self, container_id: str) -> None:
+        try:
+            await self._request("POST", f"/containers/{container_id}/kill")
+        except DockerAPIError as e:
+            # 409: контейнер уже остановлен - это не ошибка для нас
+            if e.status_code != 409:
+                raise
+
+    async def remove_container(self, container_id: str) -> None:
+        await self._request("DELETE", f"/containers/{container_id}", params={"force": "true"})
+
+    async def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        response = await self._request("GET", f"/containers/{container_id}/json")
+        return response.json()
+
+    async def container_network(self, container_id: str) -> Optional[str]:
+        """Имя первой сети, к которой подключен контейнер (None, если сетей нет)."""
+        networks = (await self.inspect_container(container_id)).get("NetworkSettings", {}).get("Networks") or {}
+        return next(iter(networks), None)
+
+    async def image_id(self, image: str) -> str:
+        """Id (digest) локального образа: меняется при каждой пересборке."""
+        response = await self._request("GET", f"/images/{image}/json")
+        return response.json()["Id"]
+
+    async def logs(self, container_id: str) -> Tuple[bytes, bytes]:
+        """Потоково читает логи контейнера и возвращает (stdout, stderr)."""
+        chunks: List[bytes] = []
+        async with self._get_client().stream(
+            "GET",
+            f"/containers/{container_id}/logs",
+            params={"stdout": "true", "stderr": "true"},
+            timeout=None,
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                self._raise_for_status(response)
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+        return demultiplex_logs(chunks)
+
+    async def exec_run(self, container_id: str, command: List[str], environment: Dict[str, str]) -> Tuple[int, bytes, bytes]:
+        """
+        Выполняет команду внутри запущенного контейнера (docker exec) и
+        возвращает (код выхода, stdout, stderr).
+        """
+        response = await self._request("POST", f"/containers/{container_id}/exec", json={
+            "Cmd": command,
+            "Env": [f"{key}={value}" for key, value in environment.items()],
+            "AttachStdout": True,
+            "AttachStderr": True,
+        })
+        exec_id = response.json()["Id"]
+
+        chunks: List[bytes] = []
+        async with self._get_client().stream(
+            "POST", f"/exec/{exec_id}/start", json={"Detach": False, "Tty": False}, timeout=None
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                self._raise_for_status(response)
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+        stdout, stderr = demultiplex_logs(chunks)
+
+        inspect = await self._request("GET", f"/exec/{exec_id}/json")
+        return inspect.json().get("ExitCode", -1), stdout, stderr
+
+    async def put_archive(self, container_id: str, path: str, tar_path: Path) -> None:
+        """Распаковывает tar-архив с диска агента в каталог `path` контейнера (потоково)."""
+        async def read_chunks() -> AsyncIterator[bytes]:
+            with open(tar_path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    yield chunk
+
+        await self._request(
+            "PUT", f"/containers/{container_id}/archive",
+            params={"path": path}, content=read_chunks(),
+            headers={"Content-Type": "application/x-tar"}, timeout=None,
+        )
+
+    async def get_archive(self, container_id: str, path: str, destination: Path) -> None:
+        """Потоково скачивает файл или каталог `path` контейнера в tar-архив `destination`."""
+        async with self._get_client().stream(
+            "GET", f"/containers/{container_id}/archive", params={"path": path}, timeout=None
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                self._raise_for_status(response)
+            with open(destination, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Асинхронный клиент Docker закрыт.")
+
+# Создаем синглтон
+async_docker = AsyncDockerClient()
@@ -0,0 +1,134 @@
+# agent/services/incremental_cache.py
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from agent.config import settings
+from agent.schemas import IncrementalInfo
+from agent.services.bulk_export import arrow_schema_from_description, frame_to_arrow
+from agent.services.data_cache import agent_cache
+from agent.services.query_planner import strip_trailing_semicolon
+from agent.services.result_builder import ResultStatsAccumulator
+from agent.services.sql_summary import quote_identifier
+
+
+def _json_watermark(value: Any) -> Any:
+    return pd.Timestamp(value).isoformat() if isinstance(value, datetime) else value
+
+
+class IncrementalCache:
+    """
+    Инкрементальное обновление закешированных SQL-результатов по таблицам,
+    в которые только добавляются строки (события, логи). При регистрации
+    рядом с записью кеша сохраняются запрос, столбец-водяной знак и состояние
+    статистики. Обновление запрашивает из базы только строки со значением
+    водяного знака больше сохраненного, дописывает их в запись новыми row
+    group'ами, продолжает подсчет статистики и увеличивает версию записи.
+    """
+
+    def __init__(self):
+        # Обновления одной записи выполняются по очереди (в пределах воркера)
+        self._locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+    def register(
+        self, cache_key: str, sql_code: str, params: Dict[str, Any], watermark_column: str
+    ) -> IncrementalInfo:
+        """
+        Регистрирует запись кеша для обновления. Статистика считается один раз
+        по row group'ам parquet-файла, дальше она только дополняется.
+
+        :raises ValueError: Если столбца нет в результате или он не числовой и не дата.
+        """
+        parquet_file = pq.ParquetFile(agent_cache.existing_path(cache_key))
+        if watermark_column not in parquet_file.schema_arrow.names:
+            raise ValueError(f"Столбца '{watermark_column}' нет в результате запроса.")
+        stats = ResultStatsAccumulator(parquet_file.schema_arrow)
+        for index in range(parquet_file.num_row_groups):
+            stats.update(parquet_file.read_row_group(index))
+        watermark = stats.column_max(watermark_column)
+
+        agent_cache.write_meta(cache_key, {
+            "sql": sql_code,
+            "params": params,
+            "watermark_column": watermark_column,
+            "version": 1,
+            "refreshed_at": time.time(),
+            "stats": stats.state(),
+        })
+        logger.info(f"Запись кеша {cache_key} зарегистрирована для обновления по столбцу '{watermark_column}'")
+        return IncrementalInfo(watermark_column=watermark_column, watermark=_json_watermark(watermark), version=1)
+
+    @staticmethod
+    def delta_query(sql_code: str, watermark_column: str, watermark: Any) -> Tuple[str, Dict[str, Any]]:
+        """Запрос новых строк: исходный запрос с условием по водяному знаку (без него, если записей еще не было)."""
+        query = strip_trailing_semicolon(sql_code)
+        if watermark is None:
+            return query, {}
+        return (
+            f"SELECT * FROM (\n{query}\n) AS _delta WHERE {quote_identifier(watermark_column)} > :_watermark",
+            {"_watermark": watermark},
+        )
+
+    def refresh(self, connection: Connection, cache_key: str) -> Tuple[ResultStatsAccumulator, IncrementalInfo]:
+        """
+        Дописывает в запись строки, появившиеся после последнего обновления.
+
+        :raises LookupError: Если запись не зарегистрирована для обновления.
+        """
+        with self._locks[cache_key]:
+            meta = agent_cache.read_meta(cache_key)
+            if meta is None:
+                raise LookupError(f"Запись кеша '{cache_key}' не зарегистрирована для инкрементального обновления.")
+            parquet_file = pq.ParquetFile(agent_cache.existing_path(cache_key))
+            stats = ResultStatsAccumulator(parquet_file.schema_arrow)
+            stats.load_state(meta["stats"])
+            watermark_column = meta["watermark_column"]
+
+            sql_code, params = self.delta_query(meta["sql"], watermark_column, stats.column_max(watermark_column))
+            result_proxy = connection.execution_options(stream_results=True).execute(
+                text(sql_code), {**meta["params"], **params}
+            )
+            columns = list(result_proxy.keys())
+            rows = result_proxy.fetchmany(settings.SQL_FETCH_CHUNK_ROWS)
+            if not rows:
+                info = IncrementalInfo(
+                    watermark_column=watermark_column, watermark=_json_watermark(stats.column_max(watermark_column)),
+                    version=meta["version"],
+                )
+                return stats, info
+
+            # В пустой записи типы столбцов неизвестны (null), их дает курсор запроса
+            schema = parquet_file.schema_arrow
+            if stats.row_count == 0:
+                schema = arrow_schema_from_description(result_proxy.cursor.description)
+                stats = ResultStatsAccumulator(schema)
+            rows_before = stats.row_count
+            with agent_cache.writer(schema, cache_key=cache_key) as entry:
+                if rows_before:
+                    for index in range(parquet_file.num_row_groups):
+                        entry.write(parquet_file.read_row_group(index))
+                while rows:
+                    table = frame_to_arrow(pd.DataFrame(rows, columns=columns), schema)
+                    entry.write(table)
+                    stats.update(table)
+                    rows = result_proxy.fetchmany(settings.SQL_FETCH_CHUNK_ROWS)
+
+            meta.update(version=meta["version"] + 1, refreshed_at=time.time(), stats=stats.state())
+            agent_cache.write_meta(cache_key, meta)
+            info = IncrementalInfo(
+                watermark_column=watermark_column, watermark=_json_watermark(stats.column_max(watermark_column)),
+                version=meta["version"], rows_appended=stats.row_count - rows_before,
+            )
+            logger.info(f"Запись кеша {cache_key} обновлена до версии {info.version}: +{info.rows_appended} строк")
+            return stats, info
+
+# Создаем синглтон
+incremental_cache = IncrementalCache()
@@ -0,0 +1,243 @@
+# agent/services/job_manager.py
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from agent.config import settings
+
+# Как часто воркер проверяет, не отменили ли его задания через другой воркер
+JOB_CANCEL_POLL_SECONDS = 0.5
+
+JobRunner = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class JobQueueFullError(Exception):
+    """В воркере уже слишком много незавершенных заданий."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+def jobs_db_path() -> Path:
+    """Файл базы заданий из настроек; каталог создается при первом обращении."""
+    path = Path(settings.JOBS_DB_PATH) if settings.JOBS_DB_PATH else Path(settings.AGENT_STATE_DIR) / "jobs.sqlite"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _retained_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Результат для хранения в записи задания. Строки закешированного результата
+    не дублируются: они остаются в AgentDataCache под `cache_key`, а ответ
+    помечается как `truncated`.
+    """
+    data = result.get("data")
+    if not result.get("cache_key") or not isinstance(data, dict) or not data.get("rows"):
+        return result
+    retained = {**result, "data": {**data, "rows": []}}
+    retained["metadata"] = {**result["metadata"], "truncated": True}
+    return retained
+
+
+class JobManager:
+    """
+    Фоновые задания для долгих выполнений и профилей. Запрос клиента сразу
+    получает id задания, а выполнение идет в воркере, принявшем задание, не
+    больше JOBS_MAX_CONCURRENCY одновременно. Состояние заданий хранится в
+    SQLite, общем для всех воркеров, поэтому статус и результат отдает любой
+    воркер. Отмена через любой воркер помечает задание в базе; воркер-владелец
+    замечает отметку и отменяет задачу, а вместе с ней SQL-запрос на сервере БД
+    или контейнер песочницы. База создается при первом обращении.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path
+        self._initialized = False
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    def _initialize(self, conn: sqlite3.Connection) -> None:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker_pid INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                result_json TEXT,
+                error_json TEXT
+            )
+        """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение с базой заданий: транзакция фиксируется при выходе, соединение закрывается."""
+        conn = sqlite3.connect(self._path or jobs_db_path(), timeout=5)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                with conn:
+                    self._initialize(conn)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    async def submit(self, kind: str, runner: JobRunner) -> Dict[str, Any]:
+        """
+        Ставит задание в очередь текущего воркера. Запись в базу выполняется
+        в потоке, чтобы не блокировать цикл событий.
+
+        :raises JobQueueFullError: Незавершенных заданий в воркере уже JOBS_QUEUE_LIMIT.
+        """
+        if len(self._tasks) >= settings.JOBS_QUEUE_LIMIT:
+            raise JobQueueFullError(retry_after=5)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.JOBS_MAX_CONCURRENCY)
+
+        job_id = str(uuid.uuid4())
+        job = await asyncio.to_thread(self._insert, job_id, kind)
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, runner))
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_cancellations())
+        logger.info(f"Задание {job_id} ({kind}) поставлено в очередь")
+        return job
+
+    def _insert(self, job_id: str, kind: str) -> Dict[str, Any]:
+        """Удаляет устаревшие задания, добавляет новое и возвращает его состояние."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (now - settings.JOBS_RESULT_TTL_SECONDS,),
+            )
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, worker_pid, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, os.getpid(), now),
+            )
+        return self.get(job_id)
+
+    async def _run(self, job_id: str, runner: JobRunner) -> None:
+        try:
+            async with self._semaphore:
+                await self._update(job_id, status="running", started_at=time.time())
+                result = await runner()
+            if result.get("status") == "error":
+                await self._update(job_id, status="failed", finished_at=time.time(), error_json=json.dumps(result.get("error"), default=str))
+            else:
+                await self._update(job_id, status="succeeded", finished_at=time.time(), result_json=json.dumps(_retained_result(result), default=str))
+            logger.info(f"Задание {job_id} завершено: {result.get('status')}")
+        except asyncio.CancelledError:
+            await self._update(job_id, status="cancelled", finished_at=time.time())
+            logger.info(f"Задание {job_id} отменено")
+        except Exception as e:
+            logger.error(f"Задание {job_id} завершилось исключением: {e}")
+            error = {"type": "UNEXPECTED_ERROR", "message": str(e).strip()}
+            await self._update(job_id, status="failed", finished_at=time.time(), error_json=json.dumps(error))
+        finally:
+            self._tasks.pop(job_id, None)
+
+    async def _update(self, job_id: str, **fields: Any) -> None:
+        """Обновляет поля задания в базе (в потоке, не блокируя цикл событий)."""
+        await asyncio.to_thread(self._write_fields, job_id, fields)
+
+    def _write_fields(self, job_id: str, fields: Dict[str, Any]) -> None:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    async def _watch_cancellations(self) -> None:
+        """Отменяет локальные задания, отмеченные для отмены в базе (например, через другой воркер)."""
+        while self._tasks:
+            await asyncio.sleep(JOB_CANCEL_POLL_SECONDS)
+            job_ids = list(self._tasks)
+            if not job_ids:
+                break
+            for job_id in await asyncio.to_thread(self._cancel_requested, job_ids):
+                task = self._tasks.get(job_id)
+                if task is not None:
+                    task.cancel()
+
+    def _cancel_requested(self, job_ids: List[str]) -> List[str]:
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})", job_ids
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задания или None, если задания нет (или оно удалено по JOBS_RESULT_TTL_SECONDS)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row["status"] in ("queued", "running") and not _is_alive(row["worker_pid"]):
+                # Воркер-владелец завершился, задание уже не выполнится
+                error = {"type": "WORKER_LOST", "message": "Воркер, выполнявший задание, завершился."}
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error_json = ? WHERE id = ?",
+                    (time.time(), json.dumps(error), job_id),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        job = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "cancel_requested": bool(row["cancel_requested"]),
+        }
+        if row["result_json"]:
+            job["result"] = json.loads(row["result_json"])
+        if row["error_json"]:
+            job["error"] = json.loads(row["error_json"])
+        return job
+
+    def _request_cancel(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')", (job_id,)
+            )
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Запрашивает отмену задания. Задание текущего воркера отменяется сразу,
+        задание другого воркера - при его следующей проверке. Обращения к базе
+        выполняются в потоке, отмена локальной задачи - в цикле событий.
+        """
+        await asyncio.to_thread(self._request_cancel, job_id)
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        return await asyncio.to_thread(self.get, job_id)
+
+# Создаем синглтон
+job_manager = JobManager()
@@ -0,0 +1,30 @@
+# agent/services/partitioning.py
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def split_frame(frame: pd.DataFrame, partitions: int, columns: Optional[List[str]] = None) -> List[pd.DataFrame]:
+    """
+    Делит DataFrame на части для параллельной обработки.
+
+    Без `columns` части - соседние диапазоны строк примерно равного размера,
+    поэтому склеенные результаты частей сохраняют порядок строк. С `columns`
+    строки распределяются по хешу ключа: все строки одного ключа попадают в
+    одну часть (нужно для group-by по ключу внутри кода). Пустые части
+    отбрасываются, но хотя бы одна часть возвращается всегда.
+
+    :raises ValueError: Ключевых столбцов нет во входе.
+    """
+    partitions = max(1, min(partitions, len(frame)))
+    if not columns:
+        bounds = np.linspace(0, len(frame), partitions + 1).astype(int)
+        return [frame.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    missing = [column for column in columns if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Во входе нет ключевых столбцов: {missing}.")
+    buckets = pd.util.hash_pandas_object(frame[columns], index=False).to_numpy() % partitions
+    parts = [frame[buckets == bucket] for bucket in range(partitions)]
+    return [part for part in parts if not part.empty] or [frame]
@@ -0,0 +1,150 @@
+# agent/services/pipeline_runner.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from agent.config import settings
+from agent.schemas import PipelineRequest, PipelineStep
+from agent.services.data_cache import agent_cache
+from agent.services.query_executor import QueryExecutor, query_executor
+from agent.services.result_builder import frame_rows
+
+
+def pipeline_order(request: PipelineRequest) -> List[str]:
+    """
+    Проверяет конвейер и возвращает шаги в порядке зависимостей.
+
+    :raises ValueError: Повторяющиеся или неизвестные шаги, входы у SQL-шагов, циклы.
+    """
+    if len(request.steps) > settings.PIPELINE_MAX_STEPS:
+        raise ValueError(f"В конвейере больше {settings.PIPELINE_MAX_STEPS} шагов.")
+    steps = {step.id: step for step in request.steps}
+    if len(steps) != len(request.steps):
+        raise ValueError("Имена шагов (id) должны быть уникальными.")
+    for step in request.steps:
+        if step.language == "sql" and step.inputs:
+            raise ValueError(f"Шаг '{step.id}': SQL-шаги выполняются в базе данных и не принимают входы.")
+        unknown = set(step.inputs.values()) - steps.keys()
+        if unknown:
+            raise ValueError(f"Шаг '{step.id}' ссылается на неизвестные шаги: {sorted(unknown)}.")
+    unknown_outputs = set(request.outputs) - steps.keys()
+    if unknown_outputs:
+        raise ValueError(f"Неизвестные выходные шаги: {sorted(unknown_outputs)}.")
+
+    order, done = [], set()
+    remaining = list(request.steps)
+    while remaining:
+        ready = [step for step in remaining if set(step.inputs.values()) <= done]
+        if not ready:
+            raise ValueError(f"Шаги образуют цикл: {sorted(step.id for step in remaining)}.")
+        for step in ready:
+            order.append(step.id)
+            done.add(step.id)
+        remaining = [step for step in remaining if step.id not in done]
+    return order
+
+
+class _StepFailed(Exception):
+    def __init__(self, step_id: str, error: Dict[str, Any]):
+        super().__init__(error.get("message"))
+        self.step_id = step_id
+        self.error = error
+
+
+class PipelineRunner:
+    """
+    Выполняет конвейер SQL- и Python-шагов одним запросом к агенту. Шаг
+    запускается, как только готовы его входы, поэтому независимые ветви идут
+    параллельно. Промежуточные результаты передаются между шагами как
+    DataFrame'ы в памяти агента, без кеша и без передачи клиенту; кешируются и
+    возвращаются только шаги из `outputs`. При ошибке шага остальные шаги
+    отменяются.
+    """
+
+    def __init__(self, executor: QueryExecutor):
+        self.executor = executor
+
+    async def run(
+        self, request: PipelineRequest, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Dict[str, Any]:
+        try:
+            order = pipeline_order(request)
+        except ValueError as e:
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": str(e)}}
+
+        start_time = time.monotonic()
+        steps = {step.id: step for step in request.steps}
+        tasks: Dict[str, asyncio.Task] = {}
+        for step_id in order:
+            tasks[step_id] = asyncio.create_task(self._run_step(steps[step_id], tasks, is_disconnected))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except _StepFailed as failure:
+            logger.warning(f"Шаг конвейера '{failure.step_id}' завершился ошибкой: {failure.error.get('message')}")
+            return {"status": "error", "error": {**failure.error, "step": failure.step_id}}
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        outputs, summaries = {}, {}
+        for step_id, task in tasks.items():
+            frame, result = task.result()
+            summaries[step_id] = {
+                "row_count": result["metadata"]["row_count"],
+                "execution_time_ms": result["metadata"]["execution_time_ms"],
+            }
+            if step_id in request.outputs:
+                if frame is not None:
+                    result["cache_key"] = await asyncio.to_thread(agent_cache.save, frame)
+                if steps[step_id].language == "python":
+                    # Результат Python-шага приходит parquet-файлом, строк в ответе песочницы нет
+                    result["data"]["rows"] = frame_rows(frame)
+                outputs[step_id] = result
+            elif result.get("cache_key"):
+                # Промежуточный результат, выгруженный в кеш из-за бюджета памяти
+                await asyncio.to_thread(agent_cache.delete, result["cache_key"])
+
+        return {
+            "status": "success",
+            "execution_time_ms": (time.monotonic() - start_time) * 1000,
+            "outputs": outputs,
+            "steps": summaries,
+        }
+
+    async def _run_step(
+        self,
+        step: PipelineStep,
+        tasks: Dict[str, asyncio.Task],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+    ) -> Tuple[Optional[pd.DataFrame], Dict[str, Any]]:
+        """Ждет входы шага и выполняет его. Возвращает (DataFrame или None, ответ исполнителя)."""
+        if step.language == "sql":
+            result = await self.executor.run_sql(
+                step.code, params=step.params, keep_frame=True, is_disconnected=is_disconnected
+            )
+            if result.get("status") == "error":
+                raise _StepFailed(step.id, result["error"])
+            frame = result.pop("frame", None)
+            return frame, result
+
+        inputs = {}
+        for var_name, source_id in step.inputs.items():
+            frame, source_result = await tasks[source_id]
+            if frame is None:
+                # Результат не поместился в бюджет памяти и был выгружен в кеш
+                frame = await asyncio.to_thread(agent_cache.load, source_result["cache_key"])
+            inputs[var_name] = frame
+
+        # Входы и результат передаются parquet-файлами: типы столбцов не теряются
+        result = await self.executor.run_python_on_frames(step.code, inputs, cache_result=False, parquet_io=True)
+        if result.get("status") == "error":
+            raise _StepFailed(step.id, result["error"])
+        return result.pop("frame"), result
+
+# Создаем синглтон
+pipeline_runner = PipelineRunner(query_executor)
@@ -0,0 +1,101 @@
+# agent/services/query_cancel.py
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from loguru import logger
+
+# Как часто проверять дедлайн и отключение клиента, пока запрос выполняется в потоке
+CANCEL_POLL_INTERVAL_SECONDS = 0.2
+# SQLSTATE query_canceled: запрос отменен через cancel() или по statement_timeout
+QUERY_CANCELED_SQLSTATE = "57014"
+
+T = TypeVar("T")
+
+
+class QueryCancelledError(Exception):
+    """Запрос к БД отменен: истек дедлайн или клиент отключился."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Query cancelled: {reason}")
+        self.reason = reason  # 'timeout', 'disconnected' или 'cancelled'
+
+
+class QueryCancelScope:
+    """
+    Связывает запрос, выполняемый в отдельном потоке, с DBAPI-соединением, на
+    котором он работает. `cancel()` можно вызвать из event loop: он отправляет
+    серверу cancel-запрос (как pg_cancel_backend) именно для этого backend.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection: Any = None
+        self.reason: Optional[str] = None
+
+    def bind(self, dbapi_connection: Any) -> None:
+        """Регистрирует соединение. Вызывается в потоке запроса до его выполнения."""
+        with self._lock:
+            if self.reason is not None:
+                raise QueryCancelledError(self.reason)
+            self._connection = dbapi_connection
+
+    def cancel(self, reason: str) -> None:
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            connection = self._connection
+        if connection is not None:
+            try:
+                connection.cancel()
+            except Exception as e:
+                logger.warning(f"Не удалось отменить запрос на сервере БД: {e}")
+
+
+def is_query_canceled(error: BaseException) -> bool:
+    """Проверяет, что ошибка драйвера (или обертка SQLAlchemy над ней) означает отмену запроса."""
+    original = getattr(error, "orig", None) or error
+    code = getattr(original, "pgcode", None) or getattr(original, "sqlstate", None)
+    return code == QUERY_CANCELED_SQLSTATE
+
+
+async def run_cancellable(
+    func: Callable[[], T],
+    scope: QueryCancelScope,
+    timeout_seconds: float,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> T:
+    """
+    Выполняет блокирующий вызов БД в потоке и отменяет запрос на сервере, если
+    истек дедлайн, клиент отключился или отменили саму корутину. После отмены
+    дожидается завершения потока, чтобы соединение вернулось в пул.
+
+    :raises QueryCancelledError: Запрос был отменен (в том числе по statement_timeout).
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func))
+    deadline = time.monotonic() + timeout_seconds
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=CANCEL_POLL_INTERVAL_SECONDS)
+            if task.done() or scope.reason is not None:
+                continue
+            if time.monotonic() >= deadline:
+                scope.cancel("timeout")
+            elif is_disconnected is not None and await is_disconnected():
+                scope.cancel("disconnected")
+    except asyncio.CancelledError:
+        scope.cancel("cancelled")
+        raise
+
+    try:
+        return task.result()
+    except QueryCancelledError:
+        raise
+    except Exception as e:
+        if scope.reason is not None:
+            raise QueryCancelledError(scope.reason) from e
+        if is_query_canceled(e):
+            raise QueryCancelledError("timeout") from e
+        raise
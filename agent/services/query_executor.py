@@ -2,103 +2,74 @@
 
 import asyncio
 import json
+import socket
+import tarfile
+import tempfile
 import time
-from typing import Dict, Any, Literal, Optional
-import docker
-from docker.errors import NotFound, ContainerError
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, Awaitable, Callable, Literal, Optional, Tuple
 from loguru import logger
 import pandas as pd
-import numpy as np
-import math
+import psycopg
+import pyarrow as pa
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 
-from agent.config import settings
+from agent.config import settings, SandboxResourceClass
 from agent.services.sql_safety_check import is_sql_safe
-# Импортируем наши новые модели
-from agent.schemas import EnrichedExecutionResult, ExecutionMetadata, ExecutionData, ColumnMetadata, ColumnStats
+from agent.services.data_cache import agent_cache
+from agent.services.result_builder import (
+    build_enriched_response_from_df, build_enriched_response_from_stats, build_enriched_response_from_summary,
+    ResultStatsAccumulator, frame_rows
+)
+from agent.services.bulk_export import bulk_exporter, arrow_schema_from_description, frame_to_arrow
+from agent.services.query_planner import query_planner
+from agent.services.query_cancel import QueryCancelScope, QueryCancelledError, run_cancellable
+from agent.services.query_log import slow_query_log
+from agent.services.sql_summary import sql_summarizer
+from agent.services.query_sampler import query_sampler
+from agent.services.incremental_cache import incremental_cache
+from agent.services.job_manager import job_manager, JobQueueFullError
+from agent.services.partitioning import split_frame
+from agent.services.step_memo import step_memo, memo_key, reads_database
+from agent.schemas import ApproximateOptions, PartitionSpec, PlanSummary, QueryPlan, SamplingInfo
+from agent.services.docker_async import async_docker, DockerAPIError, DockerNotFoundError
+from agent.services.sandbox_scheduler import (
+    sandbox_scheduler, SandboxQueueFullError, SandboxQueueTimeoutError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND,
+    resource_weight, select_resource_class, next_resource_class,
+)
 
 # Docker settings
-from agent.config import settings
-from agent.services.sql_safety_check import is_sql_safe
-from agent.services.data_cache import AgentDataCache
-# Импортируем наши новые модели
-from agent.schemas import EnrichedExecutionResult, ExecutionMetadata, ExecutionData, ColumnMetadata, ColumnStats
-
-# Docker settings
-DOCKER_CLIENT = docker.from_env()
 SANDBOX_IMAGE_NAME = "causabi-python-sandbox:latest"
+# Step deadline of session sandboxes; one-shot sandboxes take theirs from the resource class
 EXECUTION_TIMEOUT_SECONDS = 100
+# Where `parquet_io` sandboxes find their inputs and write result_df
+SANDBOX_INPUT_DIR = "/tmp/inputs"
+SANDBOX_RESULT_PATH = "/tmp/result.parquet"
 
-# Cache instance
-agent_cache = AgentDataCache()
-
-SANDBOX_IMAGE_NAME = "causabi-python-sandbox:latest"
-EXECUTION_TIMEOUT_SECONDS = 100
+# The safety check depends only on the SQL text, so parameterized templates
+# sent over and over with new `params` are checked once.
+check_sql_template = lru_cache(maxsize=1024)(is_sql_safe)
 
-# --- ДОБАВЬТЕ ЭТУ ВСПОМОГАТЕЛЬНУЮ ФУНКЦИЮ ПЕРЕД _build_enriched_response_from_df ---
-def _sanitize_float(value: Any) -> Optional[float]:
-    """
-    Преобразует float-значения, несовместимые с JSON (NaN, inf, -inf), в None.
-    Возвращает обычные числа без изменений.
-    """
-    if value is None or not isinstance(value, (float, np.floating)):
-        return value
-    if not math.isfinite(value):
-        return None  # Заменяем NaN, inf, -inf на None
-    return float(value)
-# ----------------------------------------------------------------------------------
-
-
-def _build_enriched_response_from_df(df: pd.DataFrame, exec_time_ms: float) -> dict:
-    """
-    Вспомогательная функция для создания обогащенного ответа из DataFrame.
-    """
-    column_metadata_list: list[ColumnMetadata] = []
-    
-    # Эта переменная должна быть инициализирована в любом случае.
-    metadata: Optional[ExecutionMetadata] = None
-
-    for col_name in df.columns:
-        col_series = df[col_name]
-        col_type = str(col_series.dtype)
-        stats = None
-
-        if pd.api.types.is_numeric_dtype(col_series.dtype):
-            desc = col_series.describe()
-            # --- ИЗМЕНЕНИЕ: Применяем нашу "очищающую" функцию ко всем значениям ---
-            stats = ColumnStats(
-                min=_sanitize_float(desc.get('min')),
-                max=_sanitize_float(desc.get('max')),
-                mean=_sanitize_float(desc.get('mean')),
-                std_dev=_sanitize_float(desc.get('std')),
-                unique_count=col_series.nunique()
-            )
-            # ---------------------------------------------------------------------
-        elif pd.api.types.is_datetime64_any_dtype(col_series.dtype):
-             stats = ColumnStats(
-                min=str(col_series.min()) if not col_series.empty and pd.notna(col_series.min()) else None,
-                max=str(col_series.max()) if not col_series.empty and pd.notna(col_series.max()) else None,
-                unique_count=col_series.nunique()
-            )
-        else:
-             stats = ColumnStats(unique_count=col_series.nunique())
 
-        column_metadata_list.append(ColumnMetadata(name=col_name, type=col_type, stats=stats))
+def _pack_parquet_inputs(dataframes: Dict[str, pd.DataFrame], workdir: Path) -> Path:
+    """Writes the inputs as `inputs/<name>.parquet` into `workdir/inputs.tar` for put_archive into /tmp."""
+    tar_path = workdir / "inputs.tar"
+    with tarfile.open(tar_path, "w") as tar:
+        for var_name, df in dataframes.items():
+            parquet_path = workdir / f"{var_name}.parquet"
+            df.to_parquet(parquet_path, index=False)
+            tar.add(parquet_path, arcname=f"inputs/{var_name}.parquet")
+    return tar_path
 
-    metadata = ExecutionMetadata(
-        execution_time_ms=exec_time_ms,
-        row_count=len(df),
-        result_schema=column_metadata_list
-    )
 
-    data = ExecutionData(
-        columns=df.columns.tolist(),
-        rows=df.where(pd.notna(df), None).values.tolist()
-    )
-
-    result = EnrichedExecutionResult(metadata=metadata, data=data)
-    return result.model_dump()
+def _unpack_parquet_result(tar_path: Path, workdir: Path) -> pd.DataFrame:
+    """Reads result_df from the archive fetched with get_archive."""
+    with tarfile.open(tar_path) as tar:
+        member = tar.getmembers()[0]
+        tar.extract(member, workdir, filter="data")
+    return pd.read_parquet(workdir / member.name)
 
 
 class QueryExecutor:
@@ -107,69 +78,287 @@ class QueryExecutor:
     """
     def __init__(self):
         try:
-            sync_db_url = str(settings.DATABASE_URL).replace("+psycopg", "")
-            self.engine = create_engine(sync_db_url, pool_pre_ping=True)
-            self.docker_client = docker.from_env()
-            self.docker_client.ping()
-            self.docker_network = self._get_docker_network()
-            logger.info("Query Executor and Docker client initialized successfully.")
+            # psycopg 3 driver: a statement text executed `prepare_threshold` times
+            # on a pooled connection becomes a server-side prepared statement, so
+            # parameterized templates are parsed and planned once per connection.
+            self.engine = create_engine(
+                settings.DATABASE_URL,
+                pool_pre_ping=True,
+                connect_args={"prepare_threshold": settings.SQL_PREPARE_THRESHOLD},
+            )
+            logger.info("Query Executor initialized successfully.")
         except Exception as e:
             logger.error(f"Error initializing QueryExecutor: {e}", exc_info=True)
             self.engine = None
-            self.docker_client = None
             raise
+        # Detected on the first sandbox run, through the async Docker client
+        self._docker_network: Optional[str] = None
 
-    def _get_docker_network(self) -> str:
-        """Determines the Docker network for the sandbox container."""
+    async def docker_network(self) -> str:
+        """
+        Docker network for sandbox containers: DOCKER_NETWORK, or the network of
+        the agent's own container (detected once), or 'host' as a fallback.
+        """
         if settings.DOCKER_NETWORK:
             return settings.DOCKER_NETWORK
-        try:
-            container_id = __import__("socket").gethostname()
-            container = self.docker_client.containers.get(container_id)
-            network_name = list(container.attrs['NetworkSettings']['Networks'].keys())[0]
-            logger.info(f"Automatically detected Docker network: {network_name}")
-            return network_name
-        except Exception:
-            logger.warning("Could not auto-detect Docker network. Falling back to 'host'.")
-            return "host"
-
-    async def run(self, language: Literal["sql", "python"], code: str) -> Dict[str, Any]:
+        if self._docker_network is None:
+            try:
+                network_name = await async_docker.container_network(socket.gethostname())
+            except Exception:
+                network_name = None
+            if network_name:
+                logger.info(f"Automatically detected Docker network: {network_name}")
+            else:
+                logger.warning("Could not auto-detect Docker network. Falling back to 'host'.")
+            self._docker_network = network_name or "host"
+        return self._docker_network
+
+    async def run(
+        self,
+        language: Literal["sql", "python"],
+        code: str,
+        materialize_only: bool = False,
+        timeout_seconds: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        explain: Optional[Literal["plan", "analyze"]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        summary_only: bool = False,
+        approximate: Optional[ApproximateOptions] = None,
+        watermark_column: Optional[str] = None,
+        background: bool = False,
+        resource_class: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """Dispatches the execution to the correct method based on language."""
         if language == "sql":
-            return await self.run_sql(code)
+            return await self.run_sql(
+                code, materialize_only=materialize_only, timeout_seconds=timeout_seconds,
+                is_disconnected=is_disconnected, explain=explain, params=params, summary_only=summary_only,
+                approximate=approximate, watermark_column=watermark_column, background=background,
+            )
         elif language == "python":
-            return await self.run_python(code)
+            return await self.run_python(code, background=background, resource_class=resource_class)
         else:
             logger.warning(f"Attempt to execute code in unsupported language: {language}")
             return {"status": "error", "error": {"type": "UNSUPPORTED_LANGUAGE", "message": "Only 'sql' and 'python' are supported."}}
 
-    async def run_sql(self, sql_code: str) -> Dict[str, Any]:
+    async def run_sql(
+        self,
+        sql_code: str,
+        materialize_only: bool = False,
+        timeout_seconds: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        explain: Optional[Literal["plan", "analyze"]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        summary_only: bool = False,
+        approximate: Optional[ApproximateOptions] = None,
+        watermark_column: Optional[str] = None,
+        keep_frame: bool = False,
+        background: bool = False,
+    ) -> Dict[str, Any]:
         """
         Executes a SQL query, collects metadata, and returns an enriched result.
+        With `materialize_only` the result is streamed into the cache via COPY
+        and only the cache key and metadata are returned (no rows).
+        With `summary_only` the column stats are computed by one aggregate query
+        inside the database and only `SQL_SUMMARY_SAMPLE_ROWS` sample rows are
+        transferred; nothing is cached.
+
+        The query runs with `statement_timeout` set to the request deadline
+        (capped by `SQL_STATEMENT_TIMEOUT_SECONDS`). When the deadline passes or
+        `is_disconnected()` reports that the client has gone away, the query is
+        cancelled on its backend connection.
+
+        With `explain` the plan tree (`plan`) or the EXPLAIN ANALYZE tree with
+        actual rows, timings and buffers (`analyze`, re-runs the query) is added
+        to `metadata.explain`.
+
+        With `approximate` the largest table of the query is read through
+        TABLESAMPLE and COUNT/SUM are scaled back up; the sampling parameters
+        are returned in `metadata.approximate`.
+
+        With `watermark_column` the cached result is registered for incremental
+        refresh (`refresh_cached_sql`) by that monotonically increasing column.
+
+        With `keep_frame` the result DataFrame is returned under `frame` instead
+        of being cached (for in-process consumers such as pipelines; it is
+        never sent to clients). Results spilled past the memory budget are
+        still cached and have no `frame`.
+
+        `background` marks execution inside a background job. Otherwise, with
+        `SQL_COST_POLICY=job`, a query over the cost thresholds is submitted as
+        a job and `{"status": "accepted", "job": ...}` is returned at once.
+
+        `params` are bound to `:name` placeholders of `sql_code` (SQLAlchemy
+        `text()`), so the query text stays a reusable template.
+
+        Queries slower than `SQL_SLOW_QUERY_THRESHOLD_MS` (including failed and
+        timed out ones) are recorded in the slow-query log.
         """
-        is_safe, error_message = is_sql_safe(sql_code, settings.DB_DIALECT)
+        start_time = time.monotonic()
+        result = await self._run_sql(
+            sql_code, params or {}, materialize_only, timeout_seconds, is_disconnected, explain, summary_only, approximate,
+            watermark_column, keep_frame, background,
+        )
+        duration_ms = (time.monotonic() - start_time) * 1000
+        if duration_ms >= settings.SQL_SLOW_QUERY_THRESHOLD_MS:
+            await asyncio.to_thread(slow_query_log.record, sql_code, duration_ms, result)
+        return result
+
+    async def _run_sql(
+        self,
+        sql_code: str,
+        params: Dict[str, Any],
+        materialize_only: bool,
+        timeout_seconds: Optional[float],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+        explain: Optional[Literal["plan", "analyze"]],
+        summary_only: bool = False,
+        approximate: Optional[ApproximateOptions] = None,
+        watermark_column: Optional[str] = None,
+        keep_frame: bool = False,
+        background: bool = False,
+    ) -> Dict[str, Any]:
+        """Safety check, sampling rewrite, cost gate, execution and optional plan capture for `run_sql`."""
+        original_sql = sql_code
+        is_safe, error_message = check_sql_template(sql_code, settings.DB_DIALECT)
         if not is_safe:
             return {"status": "error", "error": {"type": "PERMISSION_ERROR", "message": error_message}}
+        if watermark_column and (summary_only or approximate is not None):
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": "watermark_column requires the full result: it cannot be combined with summary_only or approximate."}}
 
         if not self.engine:
              return {"status": "error", "error": {"type": "CONFIGURATION_ERROR", "message": "Database engine not initialized."}}
 
+        sampling = None
+        if approximate is not None:
+            try:
+                sql_code, sampling = await asyncio.to_thread(self._sample, sql_code, approximate)
+            except SQLAlchemyError as e:
+                return {"status": "error", "error": {"type": "DATABASE_ERROR", "message": str(e).strip()}}
+
+        plan = None
+        if settings.SQL_COST_POLICY != "off":
+            try:
+                plan = await asyncio.to_thread(self._explain, sql_code, params)
+            except SQLAlchemyError as e:
+                return {"status": "error", "error": {"type": "DATABASE_ERROR", "message": str(e).strip()}}
+            allow_limit, allow_job = query_planner.policy_permissions(
+                materialize_only, summary_only, watermark_column, keep_frame, background
+            )
+            sql_code, plan = query_planner.apply_policy(sql_code, plan, allow_limit=allow_limit, allow_job=allow_job)
+            if sql_code is None:
+                return {"status": "error", "error": {"type": "COST_LIMIT_ERROR", "message": plan.message, "plan": plan.model_dump()}}
+            if plan.action == "deferred":
+                return await self._defer_sql(
+                    plan, original_sql, materialize_only=materialize_only, timeout_seconds=timeout_seconds, explain=explain,
+                    params=params, summary_only=summary_only, approximate=approximate, watermark_column=watermark_column,
+                )
+
+        timeout = min(timeout_seconds or settings.SQL_STATEMENT_TIMEOUT_SECONDS, settings.SQL_STATEMENT_TIMEOUT_SECONDS)
+        if summary_only:
+            result = await self._summarize_sql(sql_code, params, timeout, is_disconnected)
+        elif materialize_only:
+            result = await self._materialize_sql(sql_code, params, timeout, is_disconnected)
+        else:
+            # Parameterized queries run on a regular cursor so psycopg can reuse the
+            # prepared statement, unless the plan estimates more rows than a fetch
+            # chunk; without a plan (SQL_COST_POLICY=off) params alone decide.
+            stream = not params or (plan is not None and plan.plan_rows > settings.SQL_FETCH_CHUNK_ROWS)
+            result = await self._fetch_sql(sql_code, params, timeout, is_disconnected, stream, cache_result=not keep_frame)
+        if result.get("status") == "error":
+            return result
+        if plan is not None:
+            result["metadata"]["plan"] = plan.model_dump()
+        if sampling is not None:
+            result["metadata"]["approximate"] = sampling.model_dump()
+        if watermark_column and result.get("cache_key"):
+            try:
+                incremental = await asyncio.to_thread(
+                    incremental_cache.register, result["cache_key"], sql_code, params, watermark_column
+                )
+            except ValueError as e:
+                return {"status": "error", "error": {"type": "QUERY_ERROR", "message": str(e)}}
+            result["metadata"]["incremental"] = incremental.model_dump()
+        if explain:
+            query_plan = await self._explain_tree(sql_code, params, explain == "analyze", timeout, is_disconnected)
+            if query_plan is not None:
+                result["metadata"]["explain"] = query_plan.model_dump()
+        return result
+
+    async def _defer_sql(self, plan: PlanSummary, sql_code: str, **options: Any) -> Dict[str, Any]:
+        """Submits an expensive query as a background job (`SQL_COST_POLICY=job`)."""
+        try:
+            job = await job_manager.submit("execute", lambda: self.run_sql(sql_code, background=True, **options))
+        except JobQueueFullError as e:
+            return {"status": "error", "error": {"type": "QUEUE_FULL_ERROR", "message": "Too many background jobs are queued. Retry later.", "retry_after": e.retry_after}}
+        return {"status": "accepted", "job": job, "metadata": {"plan": plan.model_dump()}}
+
+    def _sample(self, sql_code: str, approximate: ApproximateOptions) -> Tuple[str, SamplingInfo]:
+        with self.engine.connect() as connection:
+            return query_sampler.rewrite(connection, sql_code, approximate)
+
+    def _explain(self, sql_code: str, params: Dict[str, Any]) -> PlanSummary:
+        with self.engine.connect() as connection:
+            return query_planner.explain(connection, sql_code, params)
+
+    async def _explain_tree(
+        self, sql_code: str, params: Dict[str, Any], analyze: bool, timeout: float, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Optional[QueryPlan]:
+        """Collects the plan tree. Failures here never fail the query itself."""
+        scope = QueryCancelScope()
+
+        def explain_call() -> QueryPlan:
+            with self.engine.connect() as connection:
+                scope.bind(connection.connection.dbapi_connection)
+                connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+                return query_planner.explain_tree(connection, sql_code, params, analyze=analyze)
+
+        try:
+            return await run_cancellable(explain_call, scope, timeout, is_disconnected)
+        except (QueryCancelledError, SQLAlchemyError) as e:
+            logger.warning(f"Failed to collect query plan: {e}")
+            return None
+
+    @staticmethod
+    def _cancelled_error(error: QueryCancelledError, timeout: float) -> Dict[str, Any]:
+        if error.reason == "timeout":
+            return {"status": "error", "error": {"type": "TIMEOUT_ERROR", "message": f"Query was cancelled after {timeout:.1f}s (statement timeout)."}}
+        return {"status": "error", "error": {"type": "QUERY_CANCELLED", "message": f"Query was cancelled on the database server ({error.reason})."}}
+
+    async def _fetch_sql(
+        self,
+        sql_code: str,
+        params: Dict[str, Any],
+        timeout: float,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        stream: bool = True,
+        cache_result: bool = True,
+    ) -> Dict[str, Any]:
+        """Runs the query within the memory budget and caches the result (or returns it as `frame`)."""
         start_time = time.monotonic()
+        scope = QueryCancelScope()
         try:
-            def db_call() -> pd.DataFrame:
-                with self.engine.connect() as connection:
-                    result_proxy = connection.execute(text(sql_code))
-                    if not result_proxy.returns_rows:
-                        return pd.DataFrame()
-                    return pd.DataFrame(result_proxy.fetchall(), columns=result_proxy.keys())
-
-            df = await asyncio.to_thread(db_call)
+            df, spilled = await run_cancellable(
+                lambda: self._fetch_within_budget(sql_code, params, timeout, scope, stream), scope, timeout, is_disconnected
+            )
             exec_time_ms = (time.monotonic() - start_time) * 1000
 
+            if spilled is not None:
+                cache_key, stats = spilled
+                logger.warning(f"SQL result exceeded memory budget and was spilled to cache. Rows: {stats.row_count}, key: {cache_key}")
+                enriched_response = build_enriched_response_from_stats(
+                    stats, exec_time_ms, rows=frame_rows(df)
+                )
+                enriched_response["cache_key"] = cache_key
+                return enriched_response
+
             logger.info(f"SQL query executed successfully in {exec_time_ms:.2f} ms. Rows: {len(df)}")
             
             # --- КЕШИРОВАНИЕ РЕЗУЛЬТАТА ---
-            enriched_response = _build_enriched_response_from_df(df, exec_time_ms)
+            enriched_response = build_enriched_response_from_df(df, exec_time_ms)
+            if not cache_result:
+                enriched_response["frame"] = df
+                return enriched_response
             try:
                 cache_key = agent_cache.save(df)
                 enriched_response["cache_key"] = cache_key
@@ -180,25 +369,232 @@ class QueryExecutor:
 
             return enriched_response
 
+        except QueryCancelledError as e:
+            return self._cancelled_error(e, timeout)
+        except SQLAlchemyError as e:
+            return {"status": "error", "error": {"type": "DATABASE_ERROR", "message": str(e).strip()}}
+        except Exception as e:
+            return {"status": "error", "error": {"type": "UNEXPECTED_ERROR", "message": str(e).strip()}}
+
+    def _fetch_within_budget(
+        self, sql_code: str, params: Dict[str, Any], timeout: float, scope: QueryCancelScope, stream: bool = True
+    ) -> Tuple[pd.DataFrame, Optional[Tuple[str, ResultStatsAccumulator]]]:
+        """
+        Fetches rows in `SQL_FETCH_CHUNK_ROWS` chunks (from a server-side cursor
+        when `stream` is set).
+        While the chunks fit into `SQL_RESULT_MEMORY_BUDGET_MB` they are kept in
+        memory; past the budget they and all remaining rows are spilled to the
+        cache as parquet row groups, and only the in-memory head is returned.
+
+        :return: The in-memory rows and, if the result was spilled, its cache key and stats.
+        """
+        budget_bytes = settings.SQL_RESULT_MEMORY_BUDGET_MB * 1024 * 1024
+        chunk_rows = settings.SQL_FETCH_CHUNK_ROWS
+        with self.engine.connect() as connection:
+            scope.bind(connection.connection.dbapi_connection)
+            connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+            result_proxy = connection.execution_options(stream_results=stream).execute(text(sql_code), params)
+            if not result_proxy.returns_rows:
+                return pd.DataFrame(), None
+            columns = list(result_proxy.keys())
+
+            chunks, used_bytes = [], 0
+            while rows := result_proxy.fetchmany(chunk_rows):
+                chunk = pd.DataFrame(rows, columns=columns)
+                chunks.append(chunk)
+                used_bytes += int(chunk.memory_usage(deep=True).sum())
+                if used_bytes > budget_bytes:
+                    schema = arrow_schema_from_description(result_proxy.cursor.description)
+                    stats = ResultStatsAccumulator(schema)
+                    with agent_cache.writer(schema) as entry:
+                        for chunk in chunks:
+                            table = frame_to_arrow(chunk, schema)
+                            entry.write(table)
+                            stats.update(table)
+                        while rows := result_proxy.fetchmany(chunk_rows):
+                            table = frame_to_arrow(pd.DataFrame(rows, columns=columns), schema)
+                            entry.write(table)
+                            stats.update(table)
+                    return pd.concat(chunks, ignore_index=True), (entry.cache_key, stats)
+
+        if not chunks:
+            return pd.DataFrame(columns=columns), None
+        return pd.concat(chunks, ignore_index=True), None
+
+    async def _materialize_sql(
+        self, sql_code: str, params: Dict[str, Any], timeout: float, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Dict[str, Any]:
+        """Streams a SELECT into the cache with COPY and returns metadata plus the cache key."""
+        start_time = time.monotonic()
+        scope = QueryCancelScope()
+        try:
+            cache_key, stats = await run_cancellable(
+                lambda: bulk_exporter.export(sql_code, timeout, scope, params), scope, timeout, is_disconnected
+            )
+        except QueryCancelledError as e:
+            return self._cancelled_error(e, timeout)
+        except psycopg.Error as e:
+            return {"status": "error", "error": {"type": "DATABASE_ERROR", "message": str(e).strip()}}
+        except Exception as e:
+            return {"status": "error", "error": {"type": "UNEXPECTED_ERROR", "message": str(e).strip()}}
+        exec_time_ms = (time.monotonic() - start_time) * 1000
+
+        logger.info(f"SQL result materialized into cache in {exec_time_ms:.2f} ms. Rows: {stats.row_count}, key: {cache_key}")
+        enriched_response = build_enriched_response_from_stats(stats, exec_time_ms)
+        enriched_response["cache_key"] = cache_key
+        return enriched_response
+
+    async def _summarize_sql(
+        self, sql_code: str, params: Dict[str, Any], timeout: float, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Dict[str, Any]:
+        """Computes the column stats inside the database and returns them with a few sample rows."""
+        start_time = time.monotonic()
+        scope = QueryCancelScope()
+
+        def summarize_call():
+            with self.engine.connect() as connection:
+                scope.bind(connection.connection.dbapi_connection)
+                connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+                return sql_summarizer.summarize(connection, sql_code, params, settings.SQL_SUMMARY_SAMPLE_ROWS)
+
+        try:
+            sample, row_count, result_schema = await run_cancellable(summarize_call, scope, timeout, is_disconnected)
+        except QueryCancelledError as e:
+            return self._cancelled_error(e, timeout)
+        except SQLAlchemyError as e:
+            return {"status": "error", "error": {"type": "DATABASE_ERROR", "message": str(e).strip()}}
+        except Exception as e:
+            return {"status": "error", "error": {"type": "UNEXPECTED_ERROR", "message": str(e).strip()}}
+        exec_time_ms = (time.monotonic() - start_time) * 1000
+
+        logger.info(f"SQL summary computed in the database in {exec_time_ms:.2f} ms. Rows: {row_count}")
+        return build_enriched_response_from_summary(sample, row_count, result_schema, exec_time_ms)
+
+    async def refresh_cached_sql(
+        self, cache_key: str, timeout_seconds: Optional[float] = None, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Appends the rows past the watermark of a registered cache entry and
+        returns its updated metadata, stats and version (no rows).
+        """
+        if not self.engine:
+             return {"status": "error", "error": {"type": "CONFIGURATION_ERROR", "message": "Database engine not initialized."}}
+        timeout = min(timeout_seconds or settings.SQL_STATEMENT_TIMEOUT_SECONDS, settings.SQL_STATEMENT_TIMEOUT_SECONDS)
+        start_time = time.monotonic()
+        scope = QueryCancelScope()
+
+        def refresh_call():
+            with self.engine.connect() as connection:
+                scope.bind(connection.connection.dbapi_connection)
+                connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+                return incremental_cache.refresh(connection, cache_key)
+
+        try:
+            stats, incremental = await run_cancellable(refresh_call, scope, timeout, is_disconnected)
+        except FileNotFoundError:
+            return {"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": f"Ключ кеша '{cache_key}' не найден. Возможно, кеш агента был очищен или время жизни истекло."}}
+        except (LookupError, ValueError) as e:
+            return {"status": "error", "error": {"type": "QUERY_ERROR", "message": str(e)}}
+        except QueryCancelledError as e:
+            return self._cancelled_error(e, timeout)
         except SQLAlchemyError as e:
             return {"status": "error", "error": {"type": "DATABASE_ERROR", "message": str(e).strip()}}
         except Exception as e:
             return {"status": "error", "error": {"type": "UNEXPECTED_ERROR", "message": str(e).strip()}}
+        exec_time_ms = (time.monotonic() - start_time) * 1000
+
+        enriched_response = build_enriched_response_from_stats(stats, exec_time_ms)
+        enriched_response["cache_key"] = cache_key
+        enriched_response["metadata"]["incremental"] = incremental.model_dump()
+        return enriched_response
 
-    async def run_python(self, python_code: str) -> Dict[str, Any]:
-        """Prepares the environment for Python code execution that accesses the DB."""
+    async def run_python(
+        self, python_code: str, background: bool = False, resource_class: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Prepares the environment for Python code execution that accesses the DB.
+        Background jobs wait for a sandbox slot behind interactive requests.
+        Without a `resource_class` hint the smallest class is used (no inputs).
+        """
         db_url = str(settings.DATABASE_URL).replace('+psycopg', '')
         environment = {
             "PYTHON_CODE_TO_EXECUTE": python_code,
             "DATABASE_URL": db_url,
         }
-        return await self._run_python_in_sandbox(environment)
-
-    async def run_python_on_data(self, python_code: str, input_data: Dict[str, Any], cache_keys: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        priority = PRIORITY_BACKGROUND if background else PRIORITY_INTERACTIVE
+        return await self._run_python_in_sandbox(environment, priority, resource_class=resource_class)
+
+    async def run_python_on_data(
+        self,
+        python_code: str,
+        input_data: Dict[str, Any],
+        cache_keys: Optional[Dict[str, str]] = None,
+        background: bool = False,
+        partition_by: Optional[PartitionSpec] = None,
+        resource_class: Optional[str] = None,
+        memoize: bool = True,
+    ) -> Dict[str, Any]:
         """
         Выполняет Python-код. Данные для переменных берутся из кеша по `cache_keys`.
         Если ключ не найден, используются данные из `input_data` (считаются сэмплами).
+        С `partition_by` код выполняется параллельно над частями одного входа.
+
+        С `memoize` повтор того же кода над теми же входами в том же образе
+        песочницы возвращает сохраненный ответ и `cache_key` без запуска
+        контейнера (`metadata.memoized`). Код, который сам читает базу
+        (`get_db_connection`), не мемоизируется.
+        """
+        memo = None
+        if memoize and not reads_database(python_code):
+            memo = await self._memo_key(python_code, input_data, cache_keys, partition_by)
+            if memo is not None:
+                start_time = time.monotonic()
+                memoized = await asyncio.to_thread(step_memo.get, memo)
+                if memoized is not None:
+                    memoized["metadata"]["memoized"] = True
+                    duration_ms = (time.monotonic() - start_time) * 1000
+                    await asyncio.to_thread(slow_query_log.record, python_code, duration_ms, memoized, True)
+                    return memoized
+
+        result = await self._run_python_on_inputs(
+            python_code, input_data, cache_keys, background, partition_by, resource_class
+        )
+        if memo is not None and result.get("status") != "error" and result.get("cache_key"):
+            await asyncio.to_thread(step_memo.put, memo, result)
+        return result
+
+    async def _memo_key(
+        self,
+        python_code: str,
+        input_data: Dict[str, Any],
+        cache_keys: Optional[Dict[str, str]],
+        partition_by: Optional[PartitionSpec],
+    ) -> Optional[str]:
         """
+        Memoization key of the step, or None when it cannot be computed (the step
+        then just runs): an input cache entry is missing or Docker is unreachable.
+        """
+        try:
+            inputs = {var_name: step_memo.input_ref(key) for var_name, key in (cache_keys or {}).items()}
+            for var_name, data_json in (input_data or {}).items():
+                inputs.setdefault(var_name, step_memo.content_ref(data_json))
+            image_id = await async_docker.image_id(SANDBOX_IMAGE_NAME)
+        except Exception as e:  # Bad cache key, Docker unreachable: the run itself reports the problem
+            logger.warning(f"Python step is not memoized: {e}")
+            return None
+        options = {"partition_by": partition_by.model_dump()} if partition_by is not None else None
+        return memo_key(python_code, inputs, image_id, options)
+
+    async def _run_python_on_inputs(
+        self,
+        python_code: str,
+        input_data: Dict[str, Any],
+        cache_keys: Optional[Dict[str, str]],
+        background: bool,
+        partition_by: Optional[PartitionSpec],
+        resource_class: Optional[str],
+    ) -> Dict[str, Any]:
+        """Loads the inputs of `run_python_on_data` and runs the code over them."""
         final_input_dataframes = {}
 
         # 1. Загрузка данных из кеша (приоритетный способ)
@@ -222,32 +618,148 @@ class QueryExecutor:
                     except Exception as e:
                         return {"status": "error", "error": {"type": "DESERIALIZATION_ERROR", "message": f"Не удалось десериализовать сэмпл данных для '{var_name}': {e}"}}
 
-        # 3. Сериализация ПОЛНЫХ данных для передачи в песочницу
+        if partition_by is not None:
+            return await self.run_python_partitioned(
+                python_code, final_input_dataframes, partition_by, background=background, resource_class=resource_class
+            )
+        return await self.run_python_on_frames(
+            python_code, final_input_dataframes, background=background, resource_class=resource_class
+        )
+
+    async def run_python_partitioned(
+        self,
+        python_code: str,
+        dataframes: Dict[str, pd.DataFrame],
+        spec: PartitionSpec,
+        background: bool = False,
+        resource_class: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Делит вход `spec.input` на части и выполняет один и тот же код над
+        каждой частью в отдельной песочнице; части идут параллельно, насколько
+        позволяют слоты планировщика. Остальные входы передаются каждой части
+        целиком. Результаты частей склеиваются или передаются в `combine_code`
+        как `input_data['partials']`. Части и их результаты передаются
+        parquet-файлами, поэтому типы столбцов (даты, целые с пропусками)
+        сохраняются при склейке. При первой ошибке части остальные сразу
+        отменяются, а в ошибке указывается номер части.
+        """
+        if spec.input not in dataframes:
+            return {"status": "error", "error": {"type": "PARTITION_ERROR", "message": f"Вход '{spec.input}' для разбиения не передан."}}
+        partitions = min(spec.partitions or sandbox_scheduler.slots, settings.SANDBOX_MAX_PARTITIONS)
         try:
-            serialized_full_data = {
-                var_name: json.loads(df.to_json(orient="split", date_format="iso", index=False))
-                for var_name, df in final_input_dataframes.items()
-            }
-            input_data_json_str = json.dumps(serialized_full_data)
-        except TypeError as e:
-            return {"status": "error", "error": {"type": "SERIALIZATION_ERROR", "message": f"Не удалось сериализовать итоговые данные для песочницы: {e}"}}
+            parts = split_frame(dataframes[spec.input], partitions, spec.columns)
+        except ValueError as e:
+            return {"status": "error", "error": {"type": "PARTITION_ERROR", "message": str(e)}}
 
+        start_time = time.monotonic()
+        tasks = [
+            asyncio.create_task(self.run_python_on_frames(
+                python_code, {**dataframes, spec.input: part}, cache_result=False, background=background,
+                resource_class=resource_class, parquet_io=True,
+            ))
+            for part in parts
+        ]
+        partials: Dict[int, pd.DataFrame] = {}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    index = tasks.index(task)
+                    if result.get("status") == "error":
+                        return {"status": "error", "error": {**result["error"], "partition": index}}
+                    partials[index] = result["frame"]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        combined = pd.concat([partials[index] for index in range(len(parts))], ignore_index=True)
+        logger.info(f"Python-код выполнен над {len(parts)} частями входа '{spec.input}'")
+
+        if spec.combine_code:
+            result = await self.run_python_on_frames(
+                spec.combine_code, {"partials": combined}, cache_result=False, background=background, parquet_io=True
+            )
+            if result.get("status") == "error":
+                return {"status": "error", "error": {**result["error"], "step": "combine"}}
+            combined = result["frame"]
+
+        result = build_enriched_response_from_df(combined, (time.monotonic() - start_time) * 1000)
+        try:
+            result["cache_key"] = await asyncio.to_thread(agent_cache.save, combined)
+        except Exception as e:
+            logger.error(f"Не удалось закешировать результат Python-шага: {e}")
+        result["metadata"]["partitions"] = len(parts)
+        return result
+
+    async def run_python_on_frames(
+        self,
+        python_code: str,
+        dataframes: Dict[str, pd.DataFrame],
+        cache_result: bool = True,
+        background: bool = False,
+        resource_class: Optional[str] = None,
+        parquet_io: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Выполняет Python-код в песочнице над уже загруженными DataFrame'ами
+        (доступны как `input_data['<имя>']`). С `cache_result=False` результат
+        не кешируется (например, промежуточный шаг конвейера). С `background=True`
+        (фоновое задание) песочница ждет слот после интерактивных запросов.
+        Класс ресурсов песочницы выбирается по размеру входов, если не задан явно.
+
+        С `parquet_io=True` входы копируются в контейнер parquet-файлами, а
+        `result_df` возвращается как DataFrame в `frame` (тоже через parquet,
+        строки в `data` не передаются), поэтому типы столбцов не теряются.
+        """
+        priority = PRIORITY_BACKGROUND if background else PRIORITY_INTERACTIVE
+        input_bytes = sum(int(df.memory_usage(deep=True).sum()) for df in dataframes.values())
         db_url = str(settings.DATABASE_URL).replace('+psycopg', '')
-        environment = {
-            "PYTHON_CODE_TO_EXECUTE": python_code,
-            "INPUT_DATA_JSON": input_data_json_str,
-            "DATABASE_URL": db_url
-        }
-        
-        # --- НОВАЯ ЛОГИКА ВЫПОЛНЕНИЯ И КЕШИРОВАНИЯ РЕЗУЛЬТАТА ---
-        result_from_sandbox = await self._run_python_in_sandbox(environment)
 
-        if result_from_sandbox.get("status") != "error":
+        if parquet_io:
+            environment = {
+                "PYTHON_CODE_TO_EXECUTE": python_code,
+                "INPUT_PARQUET_DIR": SANDBOX_INPUT_DIR,
+                "RESULT_PARQUET_PATH": SANDBOX_RESULT_PATH,
+                "DATABASE_URL": db_url,
+            }
+            with tempfile.TemporaryDirectory() as workdir:
+                try:
+                    await asyncio.to_thread(_pack_parquet_inputs, dataframes, Path(workdir))
+                except (ValueError, TypeError, pa.ArrowException) as e:
+                    return {"status": "error", "error": {"type": "SERIALIZATION_ERROR", "message": f"Не удалось сериализовать итоговые данные для песочницы: {e}"}}
+                result_from_sandbox = await self._run_python_in_sandbox(
+                    environment, priority, input_bytes, resource_class, Path(workdir)
+                )
+        else:
+            # 3. Сериализация ПОЛНЫХ данных для передачи в песочницу
+            try:
+                serialized_full_data = {
+                    var_name: json.loads(df.to_json(orient="split", date_format="iso", index=False))
+                    for var_name, df in dataframes.items()
+                }
+                input_data_json_str = json.dumps(serialized_full_data)
+            except TypeError as e:
+                return {"status": "error", "error": {"type": "SERIALIZATION_ERROR", "message": f"Не удалось сериализовать итоговые данные для песочницы: {e}"}}
+
+            environment = {
+                "PYTHON_CODE_TO_EXECUTE": python_code,
+                "INPUT_DATA_JSON": input_data_json_str,
+                "DATABASE_URL": db_url
+            }
+            # --- НОВАЯ ЛОГИКА ВЫПОЛНЕНИЯ И КЕШИРОВАНИЯ РЕЗУЛЬТАТА ---
+            result_from_sandbox = await self._run_python_in_sandbox(environment, priority, input_bytes, resource_class)
+
+        if result_from_sandbox.get("status") != "error" and cache_result:
             # После успешного выполнения кода в песочнице, его результат тоже нужно закешировать!
             try:
-                result_data = result_from_sandbox.get("data", {})
-                result_df = pd.DataFrame(data=result_data.get("rows", []), columns=result_data.get("columns", []))
-                
+                result_df = result_from_sandbox.get("frame")
+                if result_df is None:
+                    result_data = result_from_sandbox.get("data", {})
+                    result_df = pd.DataFrame(data=result_data.get("rows", []), columns=result_data.get("columns", []))
+
                 new_cache_key = agent_cache.save(result_df)
                 result_from_sandbox["cache_key"] = new_cache_key # Добавляем новый ключ в ответ
             except Exception as e:
@@ -256,21 +768,67 @@ class QueryExecutor:
         
         return result_from_sandbox
 
-    async def _run_python_in_sandbox(self, environment: Dict[str, Any]) -> Dict[str, Any]:
-        """Executes Python code in Docker, gets enriched result, adds total exec time."""
-        container = None
+    async def _run_python_in_sandbox(
+        self,
+        environment: Dict[str, Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        input_bytes: int = 0,
+        resource_class: Optional[str] = None,
+        workdir: Optional[Path] = None,
+    ) -> Dict[str, Any]:
+        """
+        Picks the resource class (the `resource_class` hint or the smallest one
+        that fits `input_bytes`), waits for as many scheduler slots as the class
+        weighs, then runs the code. `workdir` holds the parquet files exchanged
+        with a `parquet_io` sandbox.
+        Saturated or timed-out queues are reported with a `retry_after` hint.
+        """
+        try:
+            class_name, resources = select_resource_class(input_bytes, resource_class, sandbox_scheduler.slots)
+        except ValueError as e:
+            return {"status": "error", "error": {"type": "RESOURCE_CLASS_ERROR", "message": str(e)}}
+        try:
+            async with sandbox_scheduler.slot(priority=priority, weight=resource_weight(resources)):
+                return await self._run_container(environment, class_name, resources, workdir)
+        except SandboxQueueFullError as e:
+            return {"status": "error", "error": {"type": "QUEUE_FULL_ERROR", "message": "Too many sandbox executions are queued. Retry later.", "retry_after": e.retry_after}}
+        except SandboxQueueTimeoutError as e:
+            return {"status": "error", "error": {"type": "QUEUE_TIMEOUT_ERROR", "message": f"No sandbox slot became free within {e.waited_seconds:.1f}s.", "retry_after": e.retry_after}}
+
+    async def _run_container(
+        self, environment: Dict[str, Any], class_name: str, resources: SandboxResourceClass, workdir: Optional[Path] = None
+    ) -> Dict[str, Any]:
+        """
+        Executes Python code in Docker, gets enriched result, adds total exec time.
+        With `workdir`, `inputs.tar` from it is unpacked into the container before
+        the start and result_df is read back from RESULT_PARQUET_PATH into `frame`.
+        All Docker calls are asynchronous; on deadline the container is killed.
+        A container killed by the kernel OOM killer is reported as `OOM_ERROR`
+        with the next larger resource class to retry in.
+        """
+        container_id = None
         start_time = time.monotonic()
         try:
-            container = self.docker_client.containers.run(
-                SANDBOX_IMAGE_NAME, detach=True, environment=environment,
-                network=self.docker_network, mem_limit="256m", cpu_period=100000, cpu_quota=50000
+            container_id = await async_docker.create_container(
+                SANDBOX_IMAGE_NAME, environment=environment, network=await self.docker_network(),
+                mem_limit=f"{resources.memory_mb}m", cpu_period=100000, cpu_quota=int(resources.cpus * 100000)
             )
-            result = await asyncio.to_thread(container.wait, timeout=EXECUTION_TIMEOUT_SECONDS)
+            if workdir is not None and (workdir / "inputs.tar").exists():
+                await async_docker.put_archive(container_id, "/tmp", workdir / "inputs.tar")
+            await async_docker.start_container(container_id)
+            try:
+                exit_code = await asyncio.wait_for(
+                    async_docker.wait_container(container_id), timeout=resources.timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                await async_docker.kill_container(container_id)
+                exec_time_ms = (time.monotonic() - start_time) * 1000
+                return {"status": "error", "error": {"type": "TIMEOUT_ERROR", "message": f"Execution took longer than {exec_time_ms/1000:.1f}s (limit: {resources.timeout_seconds:g}s, resource class '{class_name}')."}}
             exec_time_ms = (time.monotonic() - start_time) * 1000
 
-            exit_code = result.get("StatusCode", -1)
-            stdout = container.logs(stdout=True, stderr=False).decode('utf-8').strip()
-            stderr = container.logs(stdout=False, stderr=True).decode('utf-8').strip()
+            stdout_bytes, stderr_bytes = await async_docker.logs(container_id)
+            stdout = stdout_bytes.decode('utf-8').strip()
+            stderr = stderr_bytes.decode('utf-8').strip()
 
             if exit_code == 0:
                 try:
@@ -278,30 +836,37 @@ class QueryExecutor:
                     enriched_result = json.loads(stdout)
                     # Мы просто добавляем/перезаписываем время выполнения, измеренное "снаружи"
                     enriched_result['metadata']['execution_time_ms'] = exec_time_ms
+                    enriched_result['metadata']['resource_class'] = class_name
+                    if workdir is not None:
+                        tar_path = workdir / "result.tar"
+                        await async_docker.get_archive(container_id, environment["RESULT_PARQUET_PATH"], tar_path)
+                        enriched_result['frame'] = await asyncio.to_thread(_unpack_parquet_result, tar_path, workdir)
                     logger.success(f"Python code executed successfully in sandbox in {exec_time_ms:.2f} ms.")
                     return enriched_result
                 except json.JSONDecodeError:
                     return {"status": "error", "error": {"type": "SERIALIZATION_ERROR", "message": "Failed to deserialize result from sandbox."}}
             else:
+                state = (await async_docker.inspect_container(container_id)).get("State", {})
+                if state.get("OOMKilled"):
+                    return {"status": "error", "error": {
+                        "type": "OOM_ERROR",
+                        "message": f"Sandbox ran out of memory ({resources.memory_mb} MB, resource class '{class_name}').",
+                        "resource_class": class_name,
+                        "retry_with": next_resource_class(class_name, sandbox_scheduler.slots),
+                    }}
                 return {"status": "error", "error": {"type": "EXECUTION_ERROR", "message": stderr}}
-        
-        except asyncio.TimeoutError:
-            exec_time_ms = (time.monotonic() - start_time) * 1000
-            if container:
-                try: container.stop(timeout=5)
-                except: pass
-            return {"status": "error", "error": {"type": "TIMEOUT_ERROR", "message": f"Execution took longer than {exec_time_ms/1000:.1f}s (limit: {EXECUTION_TIMEOUT_SECONDS}s)."}}
-        except ContainerError as e:
-            return {"status": "error", "error": {"type": "EXECUTION_ERROR", "message": str(e)}}
-        except NotFound:
+
+        except DockerNotFoundError:
             return {"status": "error", "error": {"type": "CONFIGURATION_ERROR", "message": f"Docker image '{SANDBOX_IMAGE_NAME}' not found."}}
+        except DockerAPIError as e:
+            return {"status": "error", "error": {"type": "EXECUTION_ERROR", "message": str(e)}}
         except Exception as e:
             return {"status": "error", "error": {"type": "UNKNOWN_ERROR", "message": str(e)}}
         finally:
-            if container:
+            if container_id:
                 try:
-                    container.remove(force=True)
+                    await async_docker.remove_container(container_id)
                 except Exception as e:
-                    logger.warning(f"Failed to remove container {container.id}: {e}")
+                    logger.warning(f"Failed to remove container {container_id}: {e}")
 
 query_executor = QueryExecutor()
@@ -0,0 +1,225 @@
+# agent/services/query_log.py
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Literal, Optional
+
+from loguru import logger
+
+from agent.config import settings
+from agent.services.data_cache import agent_cache
+
+# Сколько символов исходного запроса хранить в записи
+MAX_QUERY_TEXT_LENGTH = 4000
+# Старые записи удаляются раз в столько вставок
+PRUNE_EVERY_INSERTS = 100
+
+_COMMENT_PATTERNS = (re.compile(r"/\*.*?\*/", re.DOTALL), re.compile(r"--[^\n]*"))
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?(?![\w.])", re.IGNORECASE)
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Перцентили длительности считаются в SQLite оконными функциями: значение с
+# номером min(n, floor(q * n) + 1) в отсортированной группе
+AGGREGATES_SQL = """
+    WITH filtered AS (
+        SELECT * FROM slow_queries WHERE recorded_at >= :since
+    ),
+    ranked AS (
+        SELECT fingerprint_id, duration_ms,
+               ROW_NUMBER() OVER (PARTITION BY fingerprint_id ORDER BY duration_ms) AS position,
+               COUNT(*) OVER (PARTITION BY fingerprint_id) AS executions
+        FROM filtered WHERE cache_hit = 0
+    ),
+    timings AS (
+        SELECT fingerprint_id,
+               SUM(duration_ms) AS total_time_ms,
+               MAX(CASE WHEN position = MIN(executions, CAST(0.5 * executions AS INTEGER) + 1) THEN duration_ms END) AS p50_ms,
+               MAX(CASE WHEN position = MIN(executions, CAST(0.95 * executions AS INTEGER) + 1) THEN duration_ms END) AS p95_ms,
+               MAX(duration_ms) AS max_ms
+        FROM ranked GROUP BY fingerprint_id
+    ),
+    groups AS (
+        SELECT fingerprint_id,
+               COUNT(*) AS count,
+               AVG(row_count) AS avg_rows,
+               SUM(COALESCE(result_bytes, 0)) AS total_result_bytes,
+               SUM(cache_hit) AS cache_hits,
+               SUM(error_type IS NOT NULL) AS errors,
+               MAX(id) AS last_id
+        FROM filtered GROUP BY fingerprint_id
+    )
+    SELECT groups.fingerprint_id, last.fingerprint, last.query AS sample_query, groups.count,
+           COALESCE(timings.total_time_ms, 0) AS total_time_ms, timings.p50_ms, timings.p95_ms, timings.max_ms,
+           groups.avg_rows, groups.total_result_bytes, groups.cache_hits, groups.errors,
+           last.plan_json, last.recorded_at AS last_seen
+    FROM groups
+    JOIN slow_queries AS last ON last.id = groups.last_id
+    LEFT JOIN timings ON timings.fingerprint_id = groups.fingerprint_id
+    ORDER BY {order_by} DESC
+    LIMIT :limit
+"""
+
+
+def query_log_path() -> Path:
+    """Файл журнала в AGENT_STATE_DIR (каталог создается при первом обращении)."""
+    state_dir = Path(settings.AGENT_STATE_DIR)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir / "query_log.sqlite"
+
+
+def fingerprint_sql(sql_code: str) -> str:
+    """
+    Нормализует запрос так, чтобы запросы одной формы совпадали: убирает
+    комментарии, заменяет строковые и числовые литералы на '?', сворачивает
+    списки IN (...) и пробелы, приводит к нижнему регистру.
+    """
+    normalized = sql_code
+    for pattern in _COMMENT_PATTERNS:
+        normalized = pattern.sub(" ", normalized)
+    normalized = _STRING_LITERAL.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _IN_LIST.sub("(?)", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip().rstrip(";").strip()
+    return normalized.lower()
+
+
+class SlowQueryLog:
+    """
+    Локальный журнал медленных SQL-запросов в SQLite. Запросы дольше
+    SQL_SLOW_QUERY_THRESHOLD_MS записываются вместе с отпечатком (запрос без
+    литералов), длительностью, числом строк, размером результата и оценкой
+    плана. Ответы из кеша агента (запросы к кешу, мемоизированные шаги)
+    записываются всегда, с `cache_hit`, чтобы было видно, какая доля
+    обращений одной формы не доходит до базы. Файл общий для всех воркеров
+    агента и переживает перезапуск; он создается при первой записи или чтении.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path
+        self._initialized = False
+        self._inserts = 0
+
+    def _initialize(self, conn: sqlite3.Connection) -> None:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS slow_queries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recorded_at REAL NOT NULL,
+                fingerprint_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                query TEXT NOT NULL,
+                duration_ms REAL NOT NULL,
+                row_count INTEGER,
+                result_bytes INTEGER,
+                cache_hit INTEGER NOT NULL DEFAULT 0,
+                error_type TEXT,
+                plan_json TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_slow_queries_fingerprint ON slow_queries (fingerprint_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_slow_queries_recorded_at ON slow_queries (recorded_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение с журналом: транзакция фиксируется при выходе, соединение закрывается."""
+        conn = sqlite3.connect(self._path or query_log_path(), timeout=5)
+        try:
+            if not self._initialized:
+                with conn:
+                    self._initialize(conn)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, sql_code: str, duration_ms: float, result: Dict[str, Any], cache_hit: bool = False) -> None:
+        """
+        Записывает запрос, если он выполнялся дольше порога или был обслужен
+        из кеша (`cache_hit`). Ошибки журнала только логируются: они не должны
+        влиять на ответ клиенту.
+        """
+        if duration_ms < settings.SQL_SLOW_QUERY_THRESHOLD_MS and not cache_hit:
+            return
+        try:
+            fingerprint = fingerprint_sql(sql_code)
+            metadata = result.get("metadata") or {}
+            error = result.get("error") or {}
+            plan = metadata.get("plan") or error.get("plan")
+            result_bytes = None
+            if result.get("cache_key"):
+                try:
+                    result_bytes = agent_cache.existing_path(result["cache_key"]).stat().st_size
+                except FileNotFoundError:
+                    pass
+
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO slow_queries (recorded_at, fingerprint_id, fingerprint, query, duration_ms,
+                                              row_count, result_bytes, cache_hit, error_type, plan_json)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        time.time(),
+                        hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16],
+                        fingerprint,
+                        sql_code[:MAX_QUERY_TEXT_LENGTH],
+                        duration_ms,
+                        metadata.get("row_count"),
+                        result_bytes,
+                        int(cache_hit),
+                        error.get("type"),
+                        json.dumps(plan) if plan else None,
+                    ),
+                )
+                self._inserts += 1
+                if self._inserts % PRUNE_EVERY_INSERTS == 0:
+                    conn.execute(
+                        "DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?",
+                        (settings.SQL_QUERY_LOG_MAX_ENTRIES,),
+                    )
+            if not cache_hit:
+                logger.info(f"Медленный SQL-запрос ({duration_ms:.0f} ms) записан в журнал: {fingerprint[:120]}")
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось записать запрос в журнал медленных запросов: {e}")
+
+    def aggregates(
+        self,
+        limit: int = 20,
+        order_by: Literal["total_time_ms", "count", "p95_ms"] = "total_time_ms",
+        since: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Сводка по отпечаткам: число обращений и попаданий в кеш, p50/p95 и
+        суммарное время (только по выполнениям, не обслуженным из кеша) и
+        последняя оценка плана. Группировка выполняется в SQLite.
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                AGGREGATES_SQL.format(order_by=order_by),  # order_by ограничен Literal
+                {"since": since or 0, "limit": limit},
+            ).fetchall()
+
+        summaries = []
+        for row in rows:
+            summary = dict(row)
+            plan_json = summary.pop("plan_json")
+            for name in ("total_time_ms", "p50_ms", "p95_ms", "max_ms"):
+                if summary[name] is not None:
+                    summary[name] = round(summary[name], 2)
+            if summary["avg_rows"] is not None:
+                summary["avg_rows"] = round(summary["avg_rows"], 1)
+            summary["last_plan"] = json.loads(plan_json) if plan_json else None
+            summaries.append(summary)
+        return summaries
+
+# Создаем синглтон
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,187 @@
+# agent/services/query_planner.py
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from agent.config import settings
+from agent.schemas import PlanNode, PlanSummary, QueryPlan
+
+# Завершающая ';' (и комментарий после нее) мешает вложить запрос в подзапрос
+TRAILING_SEMICOLON_PATTERN = re.compile(r";\s*(--[^\n]*)?\s*$")
+
+
+def strip_trailing_semicolon(sql_code: str) -> str:
+    """Убирает завершающую ';', чтобы запрос можно было использовать как подзапрос."""
+    return TRAILING_SEMICOLON_PATTERN.sub("", sql_code.strip())
+
+
+def wrap_with_limit(sql_code: str, limit: int) -> str:
+    """
+    Оборачивает запрос в SELECT с LIMIT. Перевод строки перед ')' нужен,
+    чтобы однострочный комментарий в конце запроса не закомментировал скобку.
+    """
+    return f"SELECT * FROM (\n{strip_trailing_semicolon(sql_code)}\n) AS _limited LIMIT {int(limit)}"
+
+
+def _to_plan_node(raw: Dict[str, Any]) -> PlanNode:
+    """Переводит узел EXPLAIN (FORMAT JSON) в компактный PlanNode."""
+    return PlanNode(
+        node_type=raw["Node Type"],
+        relation_name=raw.get("Relation Name"),
+        index_name=raw.get("Index Name"),
+        filter=raw.get("Filter"),
+        total_cost=raw["Total Cost"],
+        estimated_rows=raw["Plan Rows"],
+        actual_rows=raw.get("Actual Rows"),
+        actual_time_ms=raw.get("Actual Total Time"),
+        loops=raw.get("Actual Loops"),
+        rows_removed_by_filter=raw.get("Rows Removed by Filter"),
+        shared_hit_blocks=raw.get("Shared Hit Blocks"),
+        shared_read_blocks=raw.get("Shared Read Blocks"),
+        children=[_to_plan_node(child) for child in raw.get("Plans", [])],
+    )
+
+
+class QueryPlanner:
+    """
+    Оценивает SQL-запрос по плану PostgreSQL (EXPLAIN без ANALYZE, запрос не
+    выполняется) и применяет политику SQL_COST_POLICY к запросам, оценка
+    которых превышает SQL_MAX_PLAN_COST или SQL_MAX_PLAN_ROWS. Так запрос с
+    декартовым произведением отклоняется или ограничивается до того, как
+    он займет ресурсы базы на часы.
+
+    По запросу (`explain`) возвращает и полное дерево плана, чтобы медленный
+    запрос можно было переписать.
+    """
+
+    @staticmethod
+    def _raw_plan(
+        connection: Connection, sql_code: str, params: Optional[Dict[str, Any]] = None, options: str = "FORMAT JSON"
+    ) -> Dict[str, Any]:
+        raw_plan = connection.execute(text(f"EXPLAIN ({options}) {strip_trailing_semicolon(sql_code)}"), params or {}).scalar()
+        if isinstance(raw_plan, str):
+            raw_plan = json.loads(raw_plan)
+        return raw_plan[0]
+
+    def explain(self, connection: Connection, sql_code: str, params: Optional[Dict[str, Any]] = None) -> PlanSummary:
+        """Получает оценку плана запроса через EXPLAIN (FORMAT JSON)."""
+        root = self._raw_plan(connection, sql_code, params)["Plan"]
+        return PlanSummary(
+            total_cost=root["Total Cost"],
+            plan_rows=root["Plan Rows"],
+            node_type=root["Node Type"],
+        )
+
+    def explain_tree(
+        self, connection: Connection, sql_code: str, params: Optional[Dict[str, Any]] = None, analyze: bool = False
+    ) -> QueryPlan:
+        """
+        Возвращает компактное дерево плана. С `analyze` запрос действительно
+        выполняется (EXPLAIN ANALYZE, BUFFERS), и в узлах появляются фактические
+        строки, время и прочитанные блоки.
+        """
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        raw_plan = self._raw_plan(connection, sql_code, params, options)
+        root = _to_plan_node(raw_plan["Plan"])
+        return QueryPlan(
+            mode="analyze" if analyze else "plan",
+            planning_time_ms=raw_plan.get("Planning Time"),
+            execution_time_ms=raw_plan.get("Execution Time"),
+            root=root,
+            warnings=self._seq_scan_warnings(connection, root),
+        )
+
+    def _seq_scan_warnings(self, connection: Connection, root: PlanNode) -> List[str]:
+        """Находит последовательные сканирования таблиц больше SQL_SEQ_SCAN_WARN_ROWS строк."""
+        warnings = []
+        reltuples_by_relation: Dict[str, Optional[int]] = {}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children)
+            if node.node_type != "Seq Scan" or not node.relation_name:
+                continue
+            if node.relation_name not in reltuples_by_relation:
+                reltuples_by_relation[node.relation_name] = connection.execute(
+                    text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:relation)"),
+                    {"relation": node.relation_name},
+                ).scalar()
+            reltuples = reltuples_by_relation[node.relation_name]
+            if reltuples is None or reltuples < settings.SQL_SEQ_SCAN_WARN_ROWS:
+                continue
+            condition = f" с фильтром {node.filter}" if node.filter else ""
+            warnings.append(
+                f"Последовательное сканирование таблицы '{node.relation_name}' (~{reltuples} строк){condition}. "
+                f"Добавьте условие по индексированному столбцу или сократите выборку."
+            )
+        return warnings
+
+    @staticmethod
+    def policy_permissions(
+        materialize_only: bool = False,
+        summary_only: bool = False,
+        watermark_column: Optional[str] = None,
+        keep_frame: bool = False,
+        background: bool = False,
+    ) -> Tuple[bool, bool]:
+        """
+        Что политика может сделать с запросом, выполняемым с этими опциями.
+
+        LIMIT незаметно изменил бы материализованный результат, сводку,
+        обновляемую запись кеша или DataFrame, который передается следующему
+        шагу конвейера. В задание нельзя перенести запрос, результат которого
+        нужен в процессе сейчас, и запрос, который уже выполняется в задании.
+
+        :return: (allow_limit, allow_job) для `apply_policy`.
+        """
+        allow_limit = not (materialize_only or summary_only or watermark_column or keep_frame)
+        allow_job = not (background or keep_frame)
+        return allow_limit, allow_job
+
+    def apply_policy(
+        self, sql_code: str, plan: PlanSummary, allow_limit: bool = True, allow_job: bool = True
+    ) -> Tuple[Optional[str], PlanSummary]:
+        """
+        Решает, что делать с запросом по его оценке.
+
+        :param allow_limit: Можно ли дописать LIMIT (нельзя, когда нужен весь результат).
+        :param allow_job: Можно ли перенести запрос в фоновое задание (нельзя, если он уже выполняется в задании).
+        :return: Запрос для выполнения (None, если он отклонен) и оценка плана с решением.
+                 При решении "deferred" запрос нужно выполнить как фоновое задание.
+        """
+        plan.exceeded = plan.total_cost > settings.SQL_MAX_PLAN_COST or plan.plan_rows > settings.SQL_MAX_PLAN_ROWS
+        if not plan.exceeded:
+            return sql_code, plan
+
+        estimate = (
+            f"Оценка плана: стоимость {plan.total_cost:.0f} (порог {settings.SQL_MAX_PLAN_COST:.0f}), "
+            f"строк {plan.plan_rows} (порог {settings.SQL_MAX_PLAN_ROWS}), корневой узел '{plan.node_type}'."
+        )
+        policy = settings.SQL_COST_POLICY
+        if policy == "reject":
+            plan.action = "rejected"
+            plan.message = f"{estimate} Запрос отклонен: добавьте фильтры, условия соединения таблиц или агрегацию."
+            logger.warning(f"SQL-запрос отклонен по оценке плана: {estimate}")
+            return None, plan
+        if policy == "limit" and allow_limit:
+            plan.action = "limited"
+            plan.message = f"{estimate} Запрос выполнен с LIMIT {settings.SQL_AUTO_LIMIT_ROWS}."
+            logger.warning(f"SQL-запрос ограничен LIMIT {settings.SQL_AUTO_LIMIT_ROWS} по оценке плана: {estimate}")
+            return wrap_with_limit(sql_code, settings.SQL_AUTO_LIMIT_ROWS), plan
+        if policy == "job" and allow_job:
+            plan.action = "deferred"
+            plan.message = f"{estimate} Запрос выполняется как фоновое задание: статус и результат - GET /jobs/{{job_id}}."
+            logger.warning(f"Дорогой SQL-запрос перенесен в фоновое задание: {estimate}")
+            return sql_code, plan
+
+        plan.action = "warned"
+        plan.message = f"{estimate} Запрос может выполняться долго и нагружать базу данных."
+        logger.warning(f"Дорогой SQL-запрос выполняется по политике '{policy}': {estimate}")
+        return sql_code, plan
+
+# Создаем синглтон
+query_planner = QueryPlanner()
@@ -0,0 +1,364 @@
+# agent/services/query_sampler.py
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from agent.config import settings
+from agent.schemas import ApproximateOptions, SamplingInfo
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<skip>--[^\n]*|/\*.*?\*/|\s+)
+    |(?P<string>[eE]?'(?:[^']|'')*'|\$(?P<tag>\w*)\$.*?\$(?P=tag)\$)
+    |(?P<ident>"(?:[^"]|"")*"|[A-Za-z_][\w$]*)
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    |(?P<punct>::|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Слова, которые после имени таблицы означают продолжение запроса, а не псевдоним
+_NON_ALIAS_KEYWORDS = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on", "using",
+    "group", "order", "limit", "offset", "having", "union", "intersect", "except", "window",
+    "fetch", "for", "tablesample", "lateral", "as", "and", "or", "select", "from", "with", "returning",
+}
+_SCALED_AGGREGATES = {"count", "sum"}
+_CLAUSE_KEYWORDS = {"select", "from", "where", "group", "having", "window", "order", "limit", "returning"}
+# После элемента списка SELECT идет запятая, FROM, конец (под)запроса или операция над запросами
+_SELECT_ITEM_END = {"from", "into", "union", "intersect", "except"}
+
+
+@dataclass
+class _Token:
+    kind: str
+    value: str
+    start: int
+    end: int
+    group: int
+
+    @property
+    def word(self) -> str:
+        return self.value.lower() if self.kind == "ident" and not self.value.startswith('"') else ""
+
+
+def _tokenize(sql_code: str) -> Tuple[List[_Token], Dict[int, int]]:
+    """
+    Разбивает запрос на значимые токены (без комментариев и пробелов). Каждый
+    токен помечен группой - скобками, в которых он находится; скобки и их
+    содержимое относятся к новой группе. Возвращает токены и родителя каждой группы.
+    """
+    tokens, parents, stack, next_group = [], {0: -1}, [0], 1
+    for match in _TOKEN_PATTERN.finditer(sql_code):
+        kind = match.lastgroup if match.lastgroup != "tag" else "string"
+        if kind == "skip":
+            continue
+        value = match.group()
+        if value == "(":
+            parents[next_group] = stack[-1]
+            stack.append(next_group)
+            next_group += 1
+        tokens.append(_Token(kind, value, match.start(), match.end(), stack[-1]))
+        if value == ")" and len(stack) > 1:
+            stack.pop()
+    return tokens, parents
+
+
+def _closing(tokens: List[_Token], index: int) -> int:
+    """Индекс ')' для '(' с индексом `index`."""
+    group = tokens[index].group
+    for position in range(index + 1, len(tokens)):
+        if tokens[position].value == ")" and tokens[position].group == group:
+            return position
+    return len(tokens) - 1
+
+
+@dataclass
+class _Relation:
+    name: str
+    group: int
+    insert_at: int
+    # Таблица на дополняемой NULL стороне внешнего соединения
+    nullable: bool = False
+
+
+def _join_type(tokens: List[_Token], index: int) -> str:
+    """Тип соединения для JOIN с индексом `index`: left, right, full или inner (включая CROSS и NATURAL)."""
+    position = index - 1
+    if position >= 0 and tokens[position].word == "outer":
+        position -= 1
+    if position >= 0 and tokens[position].word in ("left", "right", "full"):
+        return tokens[position].word
+    return "inner"
+
+
+def _find_relations(tokens: List[_Token]) -> List[_Relation]:
+    """
+    Находит таблицы в FROM/JOIN (вместе с перечислением через запятую) и место
+    после псевдонима, куда можно вставить TABLESAMPLE. Подзапросы, функции,
+    LATERAL и уже семплированные таблицы пропускаются. Таблицы на дополняемой
+    стороне LEFT/RIGHT/FULL JOIN помечаются `nullable`.
+    """
+    relations = []
+    # Таблицы текущей цепочки соединений в каждой группе: RIGHT/FULL JOIN делает их все дополняемыми
+    chains: Dict[int, List[_Relation]] = {}
+    selects_in_group = {token.group for token in tokens if token.word == "select"}
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        # FROM внутри extract(... FROM ...) или substring(... FROM ...) - не перечисление таблиц
+        if not (token.word == "join" or (token.word == "from" and token.group in selects_in_group)):
+            index += 1
+            continue
+        join_type = _join_type(tokens, index) if token.word == "join" else "inner"
+        if token.word == "from":
+            chains[token.group] = []
+        elif join_type in ("right", "full"):
+            for relation in chains.setdefault(token.group, []):
+                relation.nullable = True
+        index += 1
+        while index < len(tokens):
+            if tokens[index].word == "only":
+                index += 1
+            if index >= len(tokens) or tokens[index].kind != "ident" or tokens[index].word in _NON_ALIAS_KEYWORDS:
+                break
+            start = index
+            while index + 2 < len(tokens) and tokens[index + 1].value == "." and tokens[index + 2].kind == "ident":
+                index += 2
+            name_end = index
+            index += 1
+            if index < len(tokens) and tokens[index].value == "(":
+                break  # табличная функция
+            if index < len(tokens) and tokens[index].word == "as":
+                index += 1
+            if index < len(tokens) and tokens[index].kind == "ident" and tokens[index].word not in _NON_ALIAS_KEYWORDS:
+                index += 1
+                if index < len(tokens) and tokens[index].value == "(":
+                    index = _closing(tokens, index) + 1
+            if index < len(tokens) and tokens[index].word == "tablesample":
+                break
+            name = "".join(t.value for t in tokens[start:name_end + 1])
+            relation = _Relation(name, tokens[start].group, tokens[index - 1].end, nullable=join_type in ("left", "full"))
+            relations.append(relation)
+            chains.setdefault(token.group, []).append(relation)
+            if token.word != "from" or index >= len(tokens) or tokens[index].value != ",":
+                break
+            chains[token.group] = []
+            index += 1
+    return relations
+
+
+def _cte_names(tokens: List[_Token]) -> set:
+    """Имена CTE (`name AS [NOT] [MATERIALIZED] (...)`): это не таблицы, даже если совпадают с ними по имени."""
+    names = set()
+    for index, token in enumerate(tokens[:-2]):
+        if token.kind != "ident" or tokens[index + 1].word != "as":
+            continue
+        position = index + 2
+        while position < len(tokens) and tokens[position].word in ("not", "materialized"):
+            position += 1
+        if position < len(tokens) and tokens[position].value == "(":
+            names.add(token.value.lower())
+    return names
+
+
+def _aggregate_calls(tokens: List[_Token]) -> List[Tuple[int, int, bool]]:
+    """
+    Вызовы COUNT/SUM (кроме оконных): индекс имени функции, индекс последнего
+    токена вызова (с FILTER (...)) и признак DISTINCT.
+    """
+    calls = []
+    for index, token in enumerate(tokens[:-1]):
+        if token.word in _SCALED_AGGREGATES and tokens[index + 1].value == "(":
+            end = _closing(tokens, index + 1)
+            if end + 2 < len(tokens) and tokens[end + 1].word == "filter" and tokens[end + 2].value == "(":
+                end = _closing(tokens, end + 2)
+            if end + 1 < len(tokens) and tokens[end + 1].word == "over":
+                continue
+            calls.append((index, end, tokens[index + 2].word == "distinct"))
+    return calls
+
+
+def _query_group(group: int, selects_in_group: set, parents: Dict[int, int]) -> int:
+    """Группа (под)запроса, к которому относится выражение: агрегат может быть вложен в coalesce(...)."""
+    while group not in selects_in_group and parents.get(group, -1) != -1:
+        group = parents[group]
+    return group
+
+
+def _aggregation_level(
+    tokens: List[_Token], parents: Dict[int, int], calls: List[Tuple[int, int, bool]], group: int
+) -> int:
+    """
+    Уровень, на котором агрегируется таблица из группы `group`: ближайший
+    содержащий ее (под)запрос с COUNT/SUM, а если агрегатов над ней нет -
+    самый внешний содержащий ее запрос.
+    """
+    selects_in_group = {token.group for token in tokens if token.word == "select"}
+    groups_with_calls = {_query_group(tokens[index].group, selects_in_group, parents) for index, _, _ in calls}
+    level, outermost = group, group
+    while level != -1:
+        if level in groups_with_calls:
+            return level
+        if level in selects_in_group:
+            outermost = level
+        level = parents[level]
+    return outermost
+
+
+def _clause_of(tokens: List[_Token], index: int) -> str:
+    """Ключевое слово предложения (select, where, group, ...), в котором находится токен."""
+    group = tokens[index].group
+    for position in range(index - 1, -1, -1):
+        token = tokens[position]
+        if token.group == group and token.word in _CLAUSE_KEYWORDS:
+            return token.word
+    return ""
+
+
+class QuerySampler:
+    """
+    Переписывает SQL-запрос для приближенного ответа: самая большая таблица
+    запроса (по оценке pg_class.reltuples) читается через TABLESAMPLE, а
+    COUNT/SUM на первом уровне агрегации над ней умножаются на обратную долю
+    выборки. Для разведочных вопросов по огромным таблицам это дает ответ за
+    доли секунды вместо полного сканирования.
+
+    Семплируется одна таблица: соединение выборок нескольких таблиц уменьшает
+    результат произведением долей и плохо масштабируется обратно, а выборка
+    из одной (обычно таблицы фактов) с полными справочниками дает несмещенные
+    COUNT/SUM. Таблица должна стоять в FROM или во внутреннем соединении того
+    уровня, который агрегируется: выборка в подзапросе условия (IN, EXISTS,
+    скалярный подзапрос) или на дополняемой стороне внешнего соединения
+    меняет состав строк, а не их количество, и масштабирование там неверно.
+    """
+
+    @staticmethod
+    def _table_rows(connection: Connection, relation: str) -> Optional[int]:
+        """Оценка числа строк таблицы или материализованного представления (None для CTE и представлений)."""
+        return connection.execute(
+            text(
+                "SELECT reltuples::bigint FROM pg_class "
+                "WHERE oid = to_regclass(:relation) AND relkind IN ('r', 'm', 'p')"
+            ),
+            {"relation": relation},
+        ).scalar()
+
+    def rewrite(self, connection: Connection, sql_code: str, options: ApproximateOptions) -> Tuple[str, SamplingInfo]:
+        """
+        :return: Запрос для выполнения и параметры выборки. Если подходящей
+                 таблицы нет, запрос возвращается без изменений.
+        """
+        method = settings.SQL_APPROX_SAMPLE_METHOD
+        tokens, parents = _tokenize(sql_code)
+        cte_names = _cte_names(tokens)
+
+        calls = _aggregate_calls(tokens)
+
+        largest, largest_rows, largest_level, misplaced = None, 0, -1, None
+        checked: Dict[str, Optional[int]] = {}
+        for relation in _find_relations(tokens):
+            if relation.name.lower() in cte_names:
+                continue
+            if relation.name not in checked:
+                checked[relation.name] = self._table_rows(connection, relation.name)
+            rows = checked[relation.name]
+            if rows is None or rows < settings.SQL_APPROX_MIN_TABLE_ROWS or rows <= largest_rows:
+                continue
+            level = _aggregation_level(tokens, parents, calls, relation.group)
+            if relation.group != level or relation.nullable:
+                misplaced = misplaced or relation.name
+                continue
+            largest, largest_rows, largest_level = relation, rows, level
+
+        if largest is None:
+            if misplaced is not None:
+                message = (
+                    f"Таблица {misplaced} используется в подзапросе условия или на дополняемой стороне "
+                    "внешнего соединения, выборка из нее исказила бы результат: запрос выполнен точно."
+                )
+            else:
+                message = f"Нет таблиц больше {settings.SQL_APPROX_MIN_TABLE_ROWS} строк: запрос выполнен точно."
+            return sql_code, SamplingInfo(method=method, percent=100.0, scale_factor=1.0, message=message)
+        if options.fraction is not None:
+            percent = options.fraction * 100
+        else:
+            percent = min(100.0, options.rows / largest_rows * 100)
+        # Масштаб считается от доли, которая действительно записана в TABLESAMPLE
+        percent = float(f"{percent:.6g}")
+        if percent >= 100:
+            return sql_code, SamplingInfo(
+                relation=largest.name, method=method, percent=100.0, estimated_table_rows=largest_rows, scale_factor=1.0,
+                message="Запрошенная выборка не меньше таблицы: запрос выполнен точно.",
+            )
+
+        scale = 100 / percent
+        edits = [(largest.insert_at, largest.insert_at, f" TABLESAMPLE {method} ({percent:.6g})")]
+        aggregate_edits, skipped_distinct = self._scale_aggregates(sql_code, tokens, parents, calls, largest_level, scale)
+        edits.extend(aggregate_edits)
+
+        rewritten = sql_code
+        for start, end, replacement in sorted(edits, reverse=True):
+            rewritten = rewritten[:start] + replacement + rewritten[end:]
+
+        message = f"Приближенный результат по выборке {percent:.6g}% таблицы {largest.name}."
+        if skipped_distinct:
+            message += " COUNT(DISTINCT ...) не масштабируется и посчитан по выборке."
+        logger.info(f"SQL-запрос переписан с TABLESAMPLE {method} ({percent:.6g}) для {largest.name}")
+        return rewritten, SamplingInfo(
+            relation=largest.name, method=method, percent=percent, estimated_table_rows=largest_rows,
+            scale_factor=scale, scaled_aggregates=len(aggregate_edits), message=message,
+        )
+
+    @staticmethod
+    def _scale_aggregates(
+        sql_code: str,
+        tokens: List[_Token], parents: Dict[int, int], calls: List[Tuple[int, int, bool]], level: int, scale: float
+    ) -> Tuple[List[Tuple[int, int, str]], bool]:
+        """
+        Умножает COUNT/SUM на `scale` на уровне агрегации семплированной таблицы
+        (`_aggregation_level`). Внешние уровни не трогаются, иначе сумма уже
+        масштабированных счетчиков масштабировалась бы повторно. Оконные
+        функции и COUNT(DISTINCT) не масштабируются.
+        """
+        selects_in_group = {token.group for token in tokens if token.word == "select"}
+        edits, skipped_distinct = [], False
+        for index, end, distinct in calls:
+            if _query_group(tokens[index].group, selects_in_group, parents) != level:
+                continue
+            if distinct:
+                skipped_distinct = True
+                continue
+            start_char, end_char = tokens[index].start, tokens[end].end
+            expression = sql_code[start_char:end_char]
+            name = tokens[index].word
+            if name == "count":
+                scaled = f"round({expression} * {scale!r})::bigint"
+            else:
+                scaled = f"({expression} * {scale!r})"
+            # Голый агрегат в списке SELECT сохраняет имя столбца, которое дал бы PostgreSQL
+            group = tokens[index].group
+            previous = tokens[index - 1]
+            following = tokens[end + 1] if end + 1 < len(tokens) else None
+            is_select_item = (
+                _clause_of(tokens, index) == "select"
+                and previous.group == group
+                and (previous.word in ("select", "distinct", "all") or previous.value == ",")
+                and (
+                    following is None
+                    or following.value in (",", ";")
+                    or following.word in _SELECT_ITEM_END
+                    or (following.value == ")" and following.group == group)
+                )
+            )
+            if is_select_item:
+                scaled += f" AS {name}"
+            edits.append((start_char, end_char, scaled))
+        return edits, skipped_distinct
+
+# Создаем синглтон
+query_sampler = QuerySampler()
@@ -0,0 +1,308 @@
+# agent/services/result_builder.py
+import math
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from agent.schemas import ExecutionMetadata, ColumnMetadata, ColumnStats
+
+
+def _sanitize_float(value: Any) -> Optional[float]:
+    """
+    Преобразует float-значения, несовместимые с JSON (NaN, inf, -inf), и
+    pd.NA (статистика nullable-столбцов Int64/Float64) в None.
+    Возвращает обычные числа без изменений.
+    """
+    if value is pd.NA:
+        return None
+    if value is None or not isinstance(value, (float, np.floating)):
+        return value
+    if not math.isfinite(value):
+        return None  # Заменяем NaN, inf, -inf на None
+    return float(value)
+
+
+def frame_rows(df: pd.DataFrame) -> List[List[Any]]:
+    """
+    Строки DataFrame для ответа. Пропуски в нечисловых столбцах становятся
+    None (NaN в числовых сериализатор сам пишет как null), даты - объектами
+    datetime, которые orjson сериализует без обратного вызова на каждое
+    значение (в отличие от pd.Timestamp).
+    """
+    values = df.where(pd.notna(df), None).to_numpy(dtype=object)
+    for index, dtype in enumerate(df.dtypes):
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            column = pd.DatetimeIndex(df.iloc[:, index])
+            values[:, index] = np.where(column.isna(), None, column.to_pydatetime())
+    return values.tolist()
+
+
+def _result(metadata: ExecutionMetadata, columns: List[str], rows: List[List[Any]]) -> Dict[str, Any]:
+    """
+    Ответ в форме EnrichedExecutionResult. Моделью проверяются только
+    метаданные: строки уже собраны из DataFrame или Arrow, и их проверка и
+    копирование через pydantic для большого результата дороже самого запроса.
+    """
+    return {
+        "status": "success",
+        "metadata": metadata.model_dump(),
+        "data": {"columns": columns, "rows": rows},
+        "cache_key": None,
+    }
+
+
+# Сколько уникальных значений столбца отслеживать при потоковом подсчете статистики.
+# Если уникальных значений больше, unique_count не возвращается (None).
+DISTINCT_TRACKING_LIMIT = 100_000
+
+
+def describe_schema(schema: pa.Schema) -> List[Tuple[str, str, str]]:
+    """
+    Для каждого столбца возвращает (имя, тип, вид): тип - так, как его увидит
+    pandas после to_pandas(), вид - 'numeric', 'datetime' или 'other'
+    (определяет, какая статистика для столбца считается). decimal128 в pandas
+    становится object, но статистика для него считается как для чисел.
+    """
+    dtypes = schema.empty_table().to_pandas().dtypes
+    described = []
+    for field in schema:
+        dtype = dtypes[field.name]
+        if pa.types.is_decimal(field.type):
+            kind = "numeric"
+        elif pd.api.types.is_bool_dtype(dtype):
+            kind = "other"
+        elif pd.api.types.is_numeric_dtype(dtype):
+            kind = "numeric"
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            kind = "datetime"
+        else:
+            kind = "other"
+        described.append((field.name, str(dtype), kind))
+    return described
+
+
+class _ColumnAccumulator:
+    """Состояние статистики одного столбца: n, mean, M2 (формула Чана), min/max, хеши уникальных."""
+
+    def __init__(self, name: str, dtype: str, kind: str):
+        self.name = name
+        self.dtype = dtype
+        self.kind = kind  # 'numeric', 'datetime' или 'other'
+        self.count = 0
+        self.null_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Any = None
+        self.max: Any = None
+        self.distinct: Optional[set] = set()
+
+    def update(self, column: Union[pa.Array, pa.ChunkedArray], distinct_limit: int) -> None:
+        self.null_count += column.null_count
+        if self.kind in ("numeric", "datetime"):
+            min_max = pc.min_max(column)
+            batch_min, batch_max = min_max["min"].as_py(), min_max["max"].as_py()
+            if batch_min is not None:
+                self.min = batch_min if self.min is None else min(self.min, batch_min)
+                self.max = batch_max if self.max is None else max(self.max, batch_max)
+
+        if self.kind == "numeric":
+            batch_count = pc.count(column).as_py()
+            if batch_count:
+                values = pc.cast(column, pa.float64())
+                batch_mean = pc.mean(values).as_py()
+                batch_m2 = pc.variance(values, ddof=0).as_py() * batch_count
+                total = self.count + batch_count
+                delta = batch_mean - self.mean
+                self.mean += delta * batch_count / total
+                self.m2 += batch_m2 + delta * delta * self.count * batch_count / total
+                self.count = total
+
+        if self.distinct is not None:
+            unique = pc.unique(column).drop_null()
+            self.distinct.update(pd.util.hash_array(unique.to_numpy(zero_copy_only=False)).tolist())
+            if len(self.distinct) > distinct_limit:
+                self.distinct = None
+
+    def state(self) -> Dict[str, Any]:
+        """JSON-совместимое состояние, из которого подсчет можно продолжить."""
+        if self.kind == "datetime":
+            minimum, maximum = (pd.Timestamp(v).isoformat() if v is not None else None for v in (self.min, self.max))
+        elif isinstance(self.min, Decimal):
+            minimum, maximum = str(self.min), str(self.max)  # без потери точности, как в decimal128
+        else:
+            minimum, maximum = self.min, self.max
+        return {
+            "count": self.count, "null_count": self.null_count, "mean": self.mean, "m2": self.m2,
+            "min": minimum, "max": maximum,
+            "distinct": sorted(self.distinct) if self.distinct is not None else None,
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        self.count, self.null_count = state["count"], state["null_count"]
+        self.mean, self.m2 = state["mean"], state["m2"]
+        self.min, self.max = state["min"], state["max"]
+        if self.kind == "datetime":
+            self.min, self.max = (pd.Timestamp(v).to_pydatetime() if v is not None else None for v in (self.min, self.max))
+        elif isinstance(self.min, str):
+            self.min, self.max = Decimal(self.min), Decimal(self.max)
+        self.distinct = set(state["distinct"]) if state["distinct"] is not None else None
+
+    def to_metadata(self) -> ColumnMetadata:
+        unique_count = len(self.distinct) if self.distinct is not None else None
+        if self.kind == "numeric":
+            stats = ColumnStats(
+                min=_sanitize_float(float(self.min)) if self.min is not None else None,
+                max=_sanitize_float(float(self.max)) if self.max is not None else None,
+                mean=_sanitize_float(self.mean) if self.count else None,
+                std_dev=_sanitize_float(math.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else None,
+                unique_count=unique_count,
+                null_count=self.null_count,
+            )
+        elif self.kind == "datetime":
+            stats = ColumnStats(
+                min=str(self.min) if self.min is not None else None,
+                max=str(self.max) if self.max is not None else None,
+                unique_count=unique_count,
+                null_count=self.null_count,
+            )
+        else:
+            stats = ColumnStats(unique_count=unique_count, null_count=self.null_count)
+        return ColumnMetadata(name=self.name, type=self.dtype, stats=stats)
+
+
+class ResultStatsAccumulator:
+    """
+    Потоково считает число строк и ColumnStats по Arrow-батчам, не держа
+    весь результат в памяти. Значения совпадают с тем, что считает
+    `build_enriched_response_from_df` (std_dev - выборочное, ddof=1);
+    unique_count точен, пока уникальных значений не больше `distinct_limit`.
+    """
+
+    def __init__(self, schema: pa.Schema, distinct_limit: int = DISTINCT_TRACKING_LIMIT):
+        self.row_count = 0
+        self.distinct_limit = distinct_limit
+        self._columns = [_ColumnAccumulator(name, dtype, kind) for name, dtype, kind in describe_schema(schema)]
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self._columns]
+
+    def update(self, batch: Union[pa.RecordBatch, pa.Table]) -> None:
+        self.row_count += batch.num_rows
+        for index, accumulator in enumerate(self._columns):
+            accumulator.update(batch.column(index), self.distinct_limit)
+
+    def result_schema(self) -> List[ColumnMetadata]:
+        return [c.to_metadata() for c in self._columns]
+
+    def column_max(self, name: str) -> Any:
+        """Максимум числового столбца или столбца с датой (None для пустого результата)."""
+        for accumulator in self._columns:
+            if accumulator.name == name:
+                if accumulator.kind not in ("numeric", "datetime"):
+                    raise ValueError(f"Столбец '{name}' не числовой и не дата.")
+                return accumulator.max
+        raise KeyError(name)
+
+    def state(self) -> Dict[str, Any]:
+        """Состояние подсчета для сохранения рядом с записью кеша (см. incremental_cache)."""
+        return {"row_count": self.row_count, "columns": [c.state() for c in self._columns]}
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """Продолжает подсчет с сохраненного состояния: дальше `update` получает только новые строки."""
+        self.row_count = state["row_count"]
+        for accumulator, column_state in zip(self._columns, state["columns"]):
+            accumulator.load_state(column_state)
+
+
+def build_enriched_response_from_stats(
+    stats: ResultStatsAccumulator,
+    exec_time_ms: float,
+    rows: Optional[List[List[Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Собирает обогащенный ответ из потоково посчитанной статистики, когда
+    результат целиком не загружался в память. `rows` - строки, которые
+    нужно вернуть в ответе (по умолчанию - ни одной). Если их меньше, чем
+    строк в результате, ответ помечается как `truncated`.
+    """
+    rows = rows or []
+    metadata = ExecutionMetadata(
+        execution_time_ms=exec_time_ms,
+        row_count=stats.row_count,
+        result_schema=stats.result_schema(),
+        truncated=len(rows) < stats.row_count,
+    )
+    return _result(metadata, stats.column_names, rows)
+
+
+def build_enriched_response_from_summary(
+    sample: pd.DataFrame,
+    row_count: int,
+    result_schema: List[ColumnMetadata],
+    exec_time_ms: float,
+) -> Dict[str, Any]:
+    """
+    Собирает ответ режима summary_only: статистика посчитана в базе, в
+    `data.rows` - только строки-примеры.
+    """
+    rows = frame_rows(sample)
+    metadata = ExecutionMetadata(
+        execution_time_ms=exec_time_ms,
+        row_count=row_count,
+        result_schema=result_schema,
+        truncated=len(rows) < row_count,
+        summary_only=True,
+    )
+    return _result(metadata, list(sample.columns), rows)
+
+
+def build_enriched_response_from_df(df: pd.DataFrame, exec_time_ms: float) -> dict:
+    """
+    Вспомогательная функция для создания обогащенного ответа из DataFrame.
+    """
+    column_metadata_list: list[ColumnMetadata] = []
+
+    # Эта переменная должна быть инициализирована в любом случае.
+    metadata: Optional[ExecutionMetadata] = None
+
+    for col_name in df.columns:
+        col_series = df[col_name]
+        col_type = str(col_series.dtype)
+        stats = None
+
+        if pd.api.types.is_numeric_dtype(col_series.dtype):
+            desc = col_series.describe()
+            # --- ИЗМЕНЕНИЕ: Применяем нашу "очищающую" функцию ко всем значениям ---
+            stats = ColumnStats(
+                min=_sanitize_float(desc.get('min')),
+                max=_sanitize_float(desc.get('max')),
+                mean=_sanitize_float(desc.get('mean')),
+                std_dev=_sanitize_float(desc.get('std')),
+                unique_count=col_series.nunique(),
+                null_count=int(col_series.isna().sum())
+            )
+            # ---------------------------------------------------------------------
+        elif pd.api.types.is_datetime64_any_dtype(col_series.dtype):
+             stats = ColumnStats(
+                min=str(col_series.min()) if not col_series.empty and pd.notna(col_series.min()) else None,
+                max=str(col_series.max()) if not col_series.empty and pd.notna(col_series.max()) else None,
+                unique_count=col_series.nunique(),
+                null_count=int(col_series.isna().sum())
+            )
+        else:
+             stats = ColumnStats(unique_count=col_series.nunique(), null_count=int(col_series.isna().sum()))
+
+        column_metadata_list.append(ColumnMetadata(name=col_name, type=col_type, stats=stats))
+
+    metadata = ExecutionMetadata(
+        execution_time_ms=exec_time_ms,
+        row_count=len(df),
+        result_schema=column_metadata_list
+    )
+
+    return _result(metadata, df.columns.tolist(), frame_rows(df))
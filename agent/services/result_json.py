@@ -0,0 +1,60 @@
+# agent/services/result_json.py
+from typing import Any, Dict, Tuple, Type
+
+import orjson
+import pandas as pd
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+
+from agent.schemas import EnrichedExecutionResult, PipelineResult
+
+# NaN и inf orjson сам пишет как null; OPT_UTC_Z дает "Z" для UTC, как pydantic.
+# Все опции и поведение проверены на orjson 3.8 - минимальной версии в requirements.txt.
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+
+def _default(value: Any) -> Any:
+    """
+    Типы, которые orjson не знает (pd.Timestamp, Decimal, timedelta, bytes...),
+    приводятся так же, как их пишет pydantic в режиме JSON, чтобы ответ не
+    отличался от ответа через модель.
+    """
+    if value is pd.NaT or value is pd.NA:
+        return None
+    return to_jsonable_python(value)
+
+
+def dumps(value: Any) -> bytes:
+    """Сериализует ответ агента в JSON."""
+    return orjson.dumps(value, default=_default, option=JSON_OPTIONS)
+
+
+def _without_rows(result: Dict[str, Any]) -> Tuple[Dict[str, Any], list]:
+    data = result.get("data")
+    if not isinstance(data, dict):
+        return result, []
+    return {**result, "data": {**data, "rows": []}}, data.get("rows") or []
+
+
+def encode_result(result: Dict[str, Any], model: Type[BaseModel] = EnrichedExecutionResult) -> bytes:
+    """
+    Сериализует результат выполнения в JSON. Моделью проверяется и
+    приводится все, кроме `data.rows` (лишние поля отбрасываются, значения по
+    умолчанию подставляются), а строки, которых в большом результате сотни
+    тысяч, пишутся orjson как есть, без второго обхода через pydantic.
+    """
+    shell, rows = _without_rows(result)
+    encoded = model.model_validate(shell).model_dump(mode="json")
+    encoded["data"]["rows"] = rows
+    return dumps(encoded)
+
+
+def encode_pipeline_result(result: Dict[str, Any]) -> bytes:
+    """То же, что `encode_result`, для ответа конвейера с несколькими результатами в `outputs`."""
+    outputs, rows = {}, {}
+    for name, output in result.get("outputs", {}).items():
+        outputs[name], rows[name] = _without_rows(output)
+    encoded = PipelineResult.model_validate({**result, "outputs": outputs}).model_dump(mode="json")
+    for name, output_rows in rows.items():
+        encoded["outputs"][name]["data"]["rows"] = output_rows
+    return dumps(encoded)
@@ -0,0 +1,284 @@
+# agent/services/sandbox_scheduler.py
+import asyncio
+import fcntl
+import heapq
+import itertools
+import math
+import os
+import statistics
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from loguru import logger
+
+from agent.config import settings, SandboxResourceClass
+
+# Ресурсы одного слота, из которых выводится лимит параллельных контейнеров
+SANDBOX_CPU_PER_CONTAINER = 0.5
+SANDBOX_MEMORY_PER_CONTAINER_MB = 256
+# Доля памяти хоста, которую разрешено отдать песочницам
+HOST_MEMORY_FRACTION = 0.75
+
+# Приоритеты очереди: чем меньше число, тем раньше запрос получит слот
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+POLL_INTERVAL_SECONDS = 0.05
+METRICS_WINDOW = 200
+
+
+class SandboxQueueFullError(Exception):
+    """Очередь песочниц переполнена, запрос отклонен без ожидания."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Sandbox queue is full, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class SandboxQueueTimeoutError(Exception):
+    """Запрос не дождался свободного слота до своего дедлайна."""
+
+    def __init__(self, waited_seconds: float, retry_after: int):
+        super().__init__(f"No sandbox slot became free within {waited_seconds:.1f}s.")
+        self.waited_seconds = waited_seconds
+        self.retry_after = retry_after
+
+
+def default_concurrency() -> int:
+    """Выводит число одновременных песочниц из количества CPU и памяти хоста."""
+    by_cpu = int((os.cpu_count() or 1) / SANDBOX_CPU_PER_CONTAINER)
+    try:
+        total_memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**2
+        by_memory = int(total_memory_mb * HOST_MEMORY_FRACTION / SANDBOX_MEMORY_PER_CONTAINER_MB)
+    except (ValueError, OSError):
+        by_memory = by_cpu
+    return max(1, min(by_cpu, by_memory))
+
+
+def resource_weight(resources: SandboxResourceClass) -> int:
+    """Сколько слотов планировщика занимает песочница с такими ресурсами."""
+    return max(
+        1,
+        math.ceil(resources.cpus / SANDBOX_CPU_PER_CONTAINER),
+        math.ceil(resources.memory_mb / SANDBOX_MEMORY_PER_CONTAINER_MB),
+    )
+
+
+def _classes_by_memory(max_weight: Optional[int] = None) -> List[Tuple[str, SandboxResourceClass]]:
+    """Классы ресурсов по возрастанию памяти; с `max_weight` - только те, что помещаются в столько слотов."""
+    return [
+        (name, resources)
+        for name, resources in sorted(settings.SANDBOX_RESOURCE_CLASSES.items(), key=lambda item: item[1].memory_mb)
+        if max_weight is None or resource_weight(resources) <= max_weight
+    ]
+
+
+def select_resource_class(
+    input_bytes: int, hint: Optional[str] = None, max_weight: Optional[int] = None
+) -> Tuple[str, SandboxResourceClass]:
+    """
+    Выбирает класс ресурсов песочницы: явно запрошенный или наименьший, чья
+    память покрывает входные данные с запасом SANDBOX_INPUT_MEMORY_FACTOR.
+    Если не подходит ни один, выбирается самый большой. С `max_weight` (число
+    слотов планировщика) классы тяжелее хоста не выбираются автоматически:
+    контейнер не должен получить больше ресурсов, чем за него учтено слотов.
+
+    :raises ValueError: Запрошен неизвестный класс или класс тяжелее `max_weight`,
+                        либо ни один класс не помещается в `max_weight`.
+    """
+    classes = settings.SANDBOX_RESOURCE_CLASSES
+    if hint is not None:
+        if hint not in classes:
+            raise ValueError(f"Неизвестный класс ресурсов '{hint}'. Доступны: {sorted(classes)}.")
+        weight = resource_weight(classes[hint])
+        if max_weight is not None and weight > max_weight:
+            raise ValueError(
+                f"Класс ресурсов '{hint}' занимает {weight} слотов, а на хосте их {max_weight}. "
+                f"Доступны: {[name for name, _ in _classes_by_memory(max_weight)]}."
+            )
+        return hint, classes[hint]
+    by_memory = _classes_by_memory(max_weight)
+    if not by_memory:
+        raise ValueError(f"Ни один класс ресурсов не помещается в {max_weight} слотов планировщика песочниц.")
+    needed_mb = input_bytes * settings.SANDBOX_INPUT_MEMORY_FACTOR / 1024**2
+    for name, resources in by_memory:
+        if resources.memory_mb >= needed_mb:
+            return name, resources
+    return by_memory[-1]
+
+
+def next_resource_class(name: str, max_weight: Optional[int] = None) -> Optional[str]:
+    """
+    Следующий по памяти класс (для повтора после OOM) или None, если класс
+    самый большой из помещающихся в `max_weight` слотов.
+    """
+    current = settings.SANDBOX_RESOURCE_CLASSES.get(name)
+    if current is None:
+        return None
+    for candidate, resources in _classes_by_memory(max_weight):
+        if resources.memory_mb > current.memory_mb:
+            return candidate
+    return None
+
+
+class SandboxScheduler:
+    """
+    Ограничивает число одновременно запущенных контейнеров-песочниц на хосте.
+
+    Слоты общие для всех uvicorn-воркеров: каждый слот - это файл в `lock_dir`,
+    захваченный через flock. Если воркер падает, ядро само освобождает его слоты.
+    Песочница крупного класса ресурсов занимает несколько слотов сразу
+    (`weight`), поэтому общий бюджет CPU и памяти хоста не превышается.
+    Перед слотами у каждого воркера своя очередь с приоритетами (FIFO внутри
+    приоритета) и ограниченной длиной: при переполнении запрос сразу отклоняется
+    с подсказкой Retry-After, а не копит контейнеры, которые добьют хост.
+    """
+
+    def __init__(self, slots: int, queue_limit: int, queue_timeout: float, lock_dir: Path):
+        self.slots = slots
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.lock_dir = lock_dir
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+        self._waiters: List[list] = []
+        self._counter = itertools.count()
+        self._running = 0
+        self._wait_times = deque(maxlen=METRICS_WINDOW)
+        self._run_times = deque(maxlen=METRICS_WINDOW)
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        logger.info(f"Планировщик песочниц: {slots} слотов, очередь до {queue_limit} запросов.")
+
+    def _try_lock_slots(self, count: int) -> Optional[List[int]]:
+        """Пытается захватить `count` свободных слотов сразу. Возвращает их fd или None (ничего не захвачено)."""
+        fds = []
+        for index in range(self.slots):
+            fd = os.open(self.lock_dir / f"slot-{index}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            fds.append(fd)
+            if len(fds) == count:
+                return fds
+        self._release(fds)
+        return None
+
+    @staticmethod
+    def _release(fds: List[int]) -> None:
+        for fd in fds:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _retry_after(self) -> int:
+        """Оценка в секундах, когда очередь успеет продвинуться."""
+        average_run = statistics.fmean(self._run_times) if self._run_times else 1.0
+        return max(1, round(average_run * (len(self._waiters) + 1) / self.slots))
+
+    def _remove_waiter(self, entry: list) -> None:
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    async def _acquire(self, priority: int, timeout: Optional[float], weight: int = 1) -> List[int]:
+        if len(self._waiters) >= self.queue_limit:
+            self._rejected += 1
+            raise SandboxQueueFullError(self._retry_after())
+
+        entry = [priority, next(self._counter)]
+        heapq.heappush(self._waiters, entry)
+        start = time.monotonic()
+        deadline = start + (self.queue_timeout if timeout is None else timeout)
+        try:
+            while True:
+                # Слот пробует занять только голова очереди, чтобы сохранить порядок
+                if self._waiters[0] is entry:
+                    fds = self._try_lock_slots(weight)
+                    if fds is not None:
+                        self._remove_waiter(entry)
+                        self._wait_times.append(time.monotonic() - start)
+                        self._admitted += 1
+                        return fds
+                if time.monotonic() >= deadline:
+                    self._remove_waiter(entry)
+                    self._timed_out += 1
+                    raise SandboxQueueTimeoutError(time.monotonic() - start, self._retry_after())
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        except asyncio.CancelledError:
+            if entry in self._waiters:
+                self._remove_waiter(entry)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None, weight: int = 1):
+        """
+        Ждет свободный слот и удерживает его на время блока `async with`.
+
+        :param priority: Приоритет в очереди (меньше - раньше).
+        :param timeout: Сколько секунд можно ждать слот. По умолчанию - `queue_timeout`.
+        :param weight: Сколько слотов занимает песочница (см. `resource_weight`), не больше `slots`.
+        :raises ValueError: `weight` больше числа слотов: такую песочницу хост не выдержит.
+        :raises SandboxQueueFullError: Очередь переполнена.
+        :raises SandboxQueueTimeoutError: Слот не освободился до дедлайна.
+        """
+        if weight > self.slots:
+            raise ValueError(f"Песочница занимает {weight} слотов, а на хосте их {self.slots}.")
+        fds = await self._acquire(priority, timeout, weight)
+        self._running += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._run_times.append(time.monotonic() - started)
+            self._running -= 1
+            self._release(fds)
+
+    def busy_slots(self) -> int:
+        """Сколько слотов занято сейчас всеми воркерами хоста."""
+        busy = 0
+        for index in range(self.slots):
+            fd = os.open(self.lock_dir / f"slot-{index}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except BlockingIOError:
+                busy += 1
+            finally:
+                os.close(fd)
+        return busy
+
+    def metrics(self) -> Dict[str, Any]:
+        """Метрики очереди: глубина, время ожидания, отказы (по текущему воркеру)."""
+        wait_times = sorted(self._wait_times)
+
+        def percentile(q: float) -> Optional[float]:
+            if not wait_times:
+                return None
+            return round(wait_times[min(len(wait_times) - 1, int(q * len(wait_times)))] * 1000, 2)
+
+        return {
+            "slots_total": self.slots,
+            "slots_busy": self.busy_slots(),
+            "worker_pid": os.getpid(),
+            "worker_running": self._running,
+            "queue_depth": len(self._waiters),
+            "queue_limit": self.queue_limit,
+            "wait_time_p50_ms": percentile(0.5),
+            "wait_time_p95_ms": percentile(0.95),
+            "admitted_total": self._admitted,
+            "rejected_total": self._rejected,
+            "timed_out_total": self._timed_out,
+        }
+
+# Создаем синглтон
+sandbox_scheduler = SandboxScheduler(
+    slots=settings.SANDBOX_MAX_CONCURRENCY or default_concurrency(),
+    queue_limit=settings.SANDBOX_QUEUE_LIMIT,
+    queue_timeout=settings.SANDBOX_QUEUE_TIMEOUT_SECONDS,
+    lock_dir=Path(settings.SANDBOX_LOCK_DIR),
+)
@@ -0,0 +1,344 @@
+# agent/services/session_manager.py
+import asyncio
+import fcntl
+import json
+import os
+import tarfile
+import tempfile
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from loguru import logger
+
+from agent.config import settings, SandboxResourceClass
+from agent.services.data_cache import agent_cache, CACHE_KEY_PATTERN
+from agent.services.docker_async import async_docker, DockerAPIError, DockerNotFoundError, parse_memory_limit
+from agent.services.query_executor import query_executor, SANDBOX_IMAGE_NAME, EXECUTION_TIMEOUT_SECONDS
+from agent.services.sandbox_scheduler import (
+    sandbox_scheduler, SandboxQueueFullError, SandboxQueueTimeoutError, resource_weight,
+)
+
+REAPER_INTERVAL_SECONDS = 30
+LOCK_POLL_INTERVAL_SECONDS = 0.05
+
+KERNEL_COMMAND = ["python", "run_sandbox.py", "kernel"]
+CLIENT_COMMAND = ["python", "run_sandbox.py", "client"]
+
+
+def sessions_dir() -> Path:
+    """Каталог записей сессий (создается при первом обращении)."""
+    path = Path(settings.AGENT_STATE_DIR) / "sessions"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def session_resources() -> SandboxResourceClass:
+    """Ресурсы контейнера сессии в единицах планировщика песочниц."""
+    # Тот же разбор, что и при создании контейнера: лимит, принятый здесь, примет и Docker
+    memory_mb = parse_memory_limit(settings.SESSION_MEM_LIMIT) / 1024**2
+    return SandboxResourceClass(
+        memory_mb=max(1, round(memory_mb)),
+        cpus=settings.SESSION_CPU_QUOTA / 100000,
+        timeout_seconds=EXECUTION_TIMEOUT_SECONDS,
+    )
+
+
+class SandboxSessionManager:
+    """
+    Управляет сессиями: долгоживущими контейнерами-песочницами, в которых ядро
+    (`run_sandbox.py kernel`) хранит переменные Python между шагами.
+
+    Шаг выполняется через docker exec клиента ядра, поэтому между шагами данные
+    не сериализуются и не проходят через кеш. Записи о сессиях хранятся на диске,
+    так что шаг может обслужить любой воркер агента; шаги одной сессии
+    выполняются строго по очереди (flock на файл сессии).
+    """
+
+    def __init__(self):
+        # Слоты планировщика, которые этот воркер держит за созданными им сессиями
+        self._leases: Dict[str, AsyncExitStack] = {}
+
+    def _record_path(self, session_id: str) -> Optional[Path]:
+        if not CACHE_KEY_PATTERN.match(session_id):
+            return None
+        return sessions_dir() / f"{session_id}.json"
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        path = self._record_path(session_id)
+        if path is None or not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, record: Dict[str, Any]) -> None:
+        path = sessions_dir() / f"{record['session_id']}.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(record))
+        os.replace(tmp_path, path)
+
+    def _records(self) -> List[Dict[str, Any]]:
+        records = []
+        for path in sessions_dir().glob("*.json"):
+            record = self._load(path.stem)
+            if record:
+                records.append(record)
+        return records
+
+    @asynccontextmanager
+    async def _locked(self, session_id: str):
+        """
+        Не дает двум шагам одной сессии выполняться одновременно (в том числе из
+        разных воркеров). Lock-файл не удаляется и после закрытия сессии: иначе
+        ожидающий на старом файле и новый открывший файл захватили бы разные inode.
+        """
+        fd = os.open(sessions_dir() / f"{session_id}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL_INTERVAL_SECONDS)
+            yield
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _pin_holder(record: Dict[str, Any]) -> str:
+        return f"session:{record['session_id']}"
+
+    def _pin(self, record: Dict[str, Any], cache_keys: List[str]) -> None:
+        """
+        Закрепляет записи кеша, с которыми работает сессия, чтобы очистка кеша
+        не удалила их между шагами. Закрепление продлевается каждым шагом на
+        idle timeout сессии и снимается при ее завершении.
+        """
+        pinned = set(record.get("pinned", []))
+        for cache_key in cache_keys:
+            try:
+                agent_cache.pin(cache_key, self._pin_holder(record), ttl_seconds=record["idle_timeout_seconds"])
+            except FileNotFoundError:
+                pinned.discard(cache_key)
+                continue
+            pinned.add(cache_key)
+        record["pinned"] = sorted(pinned)
+
+    async def _terminate(self, record: Dict[str, Any]) -> None:
+        """Удаляет контейнер сессии и ее запись."""
+        try:
+            await async_docker.remove_container(record["container_id"])
+        except DockerNotFoundError:
+            pass
+        except DockerAPIError as e:
+            logger.warning(f"Не удалось удалить контейнер сессии {record['session_id']}: {e}")
+        for cache_key in record.get("pinned", []):
+            agent_cache.unpin(cache_key, self._pin_holder(record))
+        (sessions_dir() / f"{record['session_id']}.json").unlink(missing_ok=True)
+        await self._release_slot(record["session_id"])
+        logger.info(f"Сессия {record['session_id']} завершена.")
+
+    async def _release_slot(self, session_id: str) -> None:
+        lease = self._leases.pop(session_id, None)
+        if lease is not None:
+            await lease.aclose()
+
+    async def _call_kernel(self, record: Dict[str, Any], request: Dict[str, Any]) -> Dict[str, Any]:
+        """Передает запрос ядру сессии и возвращает его ответ или ошибку в формате агента."""
+        try:
+            exit_code, stdout, stderr = await asyncio.wait_for(
+                async_docker.exec_run(record["container_id"], CLIENT_COMMAND, {"KERNEL_REQUEST_JSON": json.dumps(request)}),
+                timeout=EXECUTION_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            # Ядро занято зависшим кодом, его состояние неизвестно - сессию закрываем
+            await self._terminate(record)
+            return {"status": "error", "error": {"type": "TIMEOUT_ERROR", "message": f"Шаг выполнялся дольше {EXECUTION_TIMEOUT_SECONDS}s. Сессия закрыта."}}
+        except DockerNotFoundError:
+            await self._terminate(record)
+            return {"status": "error", "error": {"type": "SESSION_NOT_FOUND", "message": "Контейнер сессии больше не существует."}}
+
+        if exit_code != 0:
+            try:
+                state = (await async_docker.inspect_container(record["container_id"])).get("State", {})
+            except DockerNotFoundError:
+                await self._terminate(record)
+                return {"status": "error", "error": {"type": "SESSION_NOT_FOUND", "message": "Контейнер сессии больше не существует."}}
+            if not state.get("Running"):
+                await self._terminate(record)
+                return {"status": "error", "error": {"type": "EXECUTION_ERROR", "message": f"Ядро сессии остановилось (превышен лимит памяти {settings.SESSION_MEM_LIMIT}?). Сессия закрыта."}}
+            return {"status": "error", "error": {"type": "EXECUTION_ERROR", "message": stderr.decode("utf-8").strip()}}
+        try:
+            return json.loads(stdout)
+        except json.JSONDecodeError:
+            return {"status": "error", "error": {"type": "SERIALIZATION_ERROR", "message": "Failed to deserialize result from session kernel."}}
+
+    async def _upload_inputs(self, record: Dict[str, Any], cache_keys: Dict[str, str], workdir: Path) -> Dict[str, str]:
+        """Копирует parquet-файлы из кеша в контейнер сессии одним tar-архивом."""
+        inputs: Dict[str, str] = {}
+        tar_path = workdir / "inputs.tar"
+        with tarfile.open(tar_path, "w") as tar:
+            for var_name, cache_key in cache_keys.items():
+                arcname = f"inputs/{uuid.uuid4()}.parquet"
+                tar.add(agent_cache.path_for(cache_key), arcname=arcname)
+                inputs[var_name] = f"/tmp/{arcname}"
+        await async_docker.put_archive(record["container_id"], "/tmp", tar_path)
+        return inputs
+
+    async def _persist(self, record: Dict[str, Any], var_name: str, workdir: Path) -> Dict[str, Any]:
+        """Сохраняет DataFrame из сессии в AgentDataCache и возвращает ключ."""
+        container_path = f"/tmp/outputs/{uuid.uuid4()}.parquet"
+        response = await self._call_kernel(record, {"action": "persist", "variable": var_name, "path": container_path})
+        if response.get("status") == "error":
+            return response
+
+        tar_path = workdir / "output.tar"
+        await async_docker.get_archive(record["container_id"], container_path, tar_path)
+        await async_docker.exec_run(record["container_id"], ["rm", "-f", container_path], {})
+        with tarfile.open(tar_path) as tar:
+            member = tar.getmembers()[0]
+            tar.extract(member, workdir, filter="data")
+        return {"status": "success", "cache_key": agent_cache.import_parquet(workdir / member.name)}
+
+    async def create(self, idle_timeout_seconds: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Запускает контейнер с ядром сессии. На все время жизни сессии за ней
+        держатся слоты планировщика песочниц (по SESSION_MEM_LIMIT и
+        SESSION_CPU_QUOTA), поэтому сессии входят в общий бюджет хоста.
+        """
+        if len(self._records()) >= settings.SESSION_MAX_COUNT:
+            return {"status": "error", "error": {"type": "SESSION_LIMIT_ERROR", "message": f"Достигнут лимит одновременных сессий ({settings.SESSION_MAX_COUNT})."}}
+
+        session_id = str(uuid.uuid4())
+        lease = AsyncExitStack()
+        try:
+            await lease.enter_async_context(sandbox_scheduler.slot(weight=resource_weight(session_resources())))
+        except ValueError as e:
+            # SESSION_MEM_LIMIT/SESSION_CPU_QUOTA больше бюджета песочниц хоста
+            return {"status": "error", "error": {"type": "RESOURCE_CLASS_ERROR", "message": f"Ресурсы сессии не помещаются в планировщик песочниц: {e}"}}
+        except SandboxQueueFullError as e:
+            return {"status": "error", "error": {"type": "QUEUE_FULL_ERROR", "message": "Слишком много песочниц в очереди.", "retry_after": e.retry_after}}
+        except SandboxQueueTimeoutError as e:
+            return {"status": "error", "error": {"type": "QUEUE_TIMEOUT_ERROR", "message": f"Слот песочницы не освободился за {e.waited_seconds:.1f}s.", "retry_after": e.retry_after}}
+
+        db_url = str(settings.DATABASE_URL).replace('+psycopg', '')
+        container_id = None
+        try:
+            container_id = await async_docker.create_container(
+                SANDBOX_IMAGE_NAME, environment={"DATABASE_URL": db_url}, network=await query_executor.docker_network(),
+                mem_limit=settings.SESSION_MEM_LIMIT, cpu_period=100000, cpu_quota=settings.SESSION_CPU_QUOTA,
+                command=KERNEL_COMMAND, labels={"causabi.session": session_id},
+            )
+            await async_docker.start_container(container_id)
+        except Exception as e:
+            # Любой сбой: убираем уже созданный контейнер и возвращаем слоты
+            if container_id is not None:
+                try:
+                    await async_docker.remove_container(container_id)
+                except Exception as remove_error:
+                    logger.warning(f"Не удалось удалить контейнер {container_id}: {remove_error}")
+            await lease.aclose()
+            if isinstance(e, DockerNotFoundError):
+                return {"status": "error", "error": {"type": "CONFIGURATION_ERROR", "message": f"Docker image '{SANDBOX_IMAGE_NAME}' not found."}}
+            if isinstance(e, DockerAPIError):
+                return {"status": "error", "error": {"type": "EXECUTION_ERROR", "message": str(e)}}
+            raise
+        self._leases[session_id] = lease
+
+        record = {
+            "session_id": session_id,
+            "container_id": container_id,
+            "created_at": time.time(),
+            "last_used_at": time.time(),
+            "idle_timeout_seconds": idle_timeout_seconds or settings.SESSION_IDLE_TIMEOUT_SECONDS,
+        }
+        self._store(record)
+        logger.info(f"Создана сессия {session_id} (контейнер {container_id[:12]}).")
+        return {"status": "success", "session_id": session_id, "idle_timeout_seconds": record["idle_timeout_seconds"]}
+
+    async def execute(
+        self,
+        session_id: str,
+        code: str,
+        cache_keys: Optional[Dict[str, str]] = None,
+        persist: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Выполняет шаг в сессии. Данные из `cache_keys` появляются в словаре
+        `input_data`, переменные прошлых шагов доступны по именам. Переменные
+        из `persist` после шага сохраняются в кеш.
+        """
+        record = self._load(session_id)
+        if record is None:
+            return {"status": "error", "error": {"type": "SESSION_NOT_FOUND", "message": f"Сессия '{session_id}' не найдена или истекла."}}
+
+        start_time = time.monotonic()
+        async with self._locked(session_id):
+            # Пока шаг ждал блокировку, сессию могли закрыть
+            record = self._load(session_id)
+            if record is None:
+                return {"status": "error", "error": {"type": "SESSION_NOT_FOUND", "message": f"Сессия '{session_id}' не найдена или истекла."}}
+            with tempfile.TemporaryDirectory() as workdir:
+                inputs = {}
+                if cache_keys:
+                    try:
+                        inputs = await self._upload_inputs(record, cache_keys, Path(workdir))
+                    except FileNotFoundError as e:
+                        return {"status": "error", "error": {"type": "CACHE_MISS_ERROR", "message": str(e)}}
+
+                result = await self._call_kernel(record, {"action": "execute", "code": code, "inputs": inputs})
+                if result.get("status") == "error":
+                    return result
+
+                persisted: Dict[str, str] = {}
+                for var_name in persist or []:
+                    persist_result = await self._persist(record, var_name, Path(workdir))
+                    if persist_result.get("status") == "error":
+                        return persist_result
+                    persisted[var_name] = persist_result["cache_key"]
+
+            self._pin(record, [*record.get("pinned", []), *(cache_keys or {}).values(), *persisted.values()])
+            record["last_used_at"] = time.time()
+            self._store(record)
+
+        result["metadata"]["execution_time_ms"] = (time.monotonic() - start_time) * 1000
+        result["session_id"] = session_id
+        result["persisted"] = persisted
+        return result
+
+    async def delete(self, session_id: str) -> Dict[str, Any]:
+        record = self._load(session_id)
+        if record is None:
+            return {"status": "error", "error": {"type": "SESSION_NOT_FOUND", "message": f"Сессия '{session_id}' не найдена или истекла."}}
+        await self._terminate(record)
+        return {"status": "success", "session_id": session_id}
+
+    async def reap_idle(self) -> None:
+        """
+        Закрывает сессии, простаивающие дольше своего idle timeout, и отпускает
+        слоты сессий этого воркера, которые закрыл другой воркер.
+        """
+        now = time.time()
+        for record in self._records():
+            if now - record["last_used_at"] > record["idle_timeout_seconds"]:
+                logger.info(f"Сессия {record['session_id']} простаивала дольше {record['idle_timeout_seconds']}s.")
+                await self._terminate(record)
+        for session_id in list(self._leases):
+            if self._load(session_id) is None:
+                await self._release_slot(session_id)
+
+    async def run_reaper(self) -> None:
+        """Фоновая задача: периодически закрывает простаивающие сессии."""
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                logger.error(f"Ошибка при очистке простаивающих сессий: {e}")
+
+# Создаем синглтон
+session_manager = SandboxSessionManager()
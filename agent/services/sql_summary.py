@@ -0,0 +1,107 @@
+# agent/services/sql_summary.py
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from agent.schemas import ColumnMetadata, ColumnStats
+from agent.services.bulk_export import PG_NUMERIC_OID, arrow_schema_from_description
+from agent.services.query_planner import strip_trailing_semicolon
+from agent.services.result_builder import _sanitize_float, describe_schema
+
+
+def quote_identifier(name: str) -> str:
+    """Заключает имя столбца в двойные кавычки (кавычки внутри имени удваиваются)."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_summary_query(sql_code: str, columns: List[Tuple[str, str, str]]) -> str:
+    """
+    Строит один агрегатный запрос по результату `sql_code`: число строк и для
+    каждого столбца - число NULL и уникальных значений, для числовых еще
+    min/max/среднее/стандартное отклонение, для дат - min/max.
+
+    :param columns: Столбцы в виде (имя, тип, вид), как их возвращает describe_schema.
+    """
+    expressions = ["count(*) AS row_count"]
+    for index, (name, _, kind) in enumerate(columns):
+        column = f"_q.{quote_identifier(name)}"
+        expressions.append(f"count({column}) AS c{index}_count")
+        # Не у всех типов есть оператор равенства (json), поэтому уникальные
+        # значения нечисловых столбцов считаются по текстовому представлению.
+        distinct_target = column if kind in ("numeric", "datetime") else f"{column}::text"
+        expressions.append(f"count(DISTINCT {distinct_target}) AS c{index}_distinct")
+        if kind in ("numeric", "datetime"):
+            expressions.append(f"min({column}) AS c{index}_min")
+            expressions.append(f"max({column}) AS c{index}_max")
+        if kind == "numeric":
+            expressions.append(f"avg({column})::float8 AS c{index}_mean")
+            expressions.append(f"stddev_samp({column})::float8 AS c{index}_std")
+    select_list = ",\n       ".join(expressions)
+    return f"WITH _q AS (\n{strip_trailing_semicolon(sql_code)}\n)\nSELECT {select_list}\nFROM _q"
+
+
+def _as_float(value: Any):
+    return _sanitize_float(float(value)) if value is not None else None
+
+
+class SQLSummarizer:
+    """
+    Считает статистику результата SQL-запроса внутри PostgreSQL, не передавая
+    строки агенту: запрос оборачивается в CTE, и все ColumnStats получаются
+    одним агрегатным запросом. Для отчета по таблице в миллионы строк агенту
+    нужна одна строка агрегатов и несколько строк-примеров, а не весь результат.
+    """
+
+    def summarize(
+        self, connection: Connection, sql_code: str, params: Dict[str, Any], sample_rows: int
+    ) -> Tuple[pd.DataFrame, int, List[ColumnMetadata]]:
+        """
+        Выполняет запрос с LIMIT `sample_rows` (строки-примеры и типы столбцов),
+        затем агрегатный запрос по полному результату.
+
+        :return: Строки-примеры, число строк результата и схема со статистикой.
+        """
+        sample_sql = f"SELECT * FROM (\n{strip_trailing_semicolon(sql_code)}\n) AS _sample LIMIT {int(sample_rows)}"
+        sample_proxy = connection.execute(text(sample_sql), params)
+        names = list(sample_proxy.keys())
+        sample = pd.DataFrame(sample_proxy.fetchall(), columns=names)
+        description = sample_proxy.cursor.description
+        # numeric без ограничений в Arrow - строка, но агрегаты для него считает база
+        columns = [
+            (name, dtype, "numeric" if column[1] == PG_NUMERIC_OID else kind)
+            for (name, dtype, kind), column in zip(describe_schema(arrow_schema_from_description(description)), description)
+        ]
+
+        aggregates = connection.execute(text(build_summary_query(sql_code, columns)), params).mappings().one()
+        row_count = aggregates["row_count"]
+
+        result_schema = []
+        for index, (name, dtype, kind) in enumerate(columns):
+            null_count = row_count - aggregates[f"c{index}_count"]
+            unique_count = aggregates[f"c{index}_distinct"]
+            if kind == "numeric":
+                stats = ColumnStats(
+                    min=_as_float(aggregates[f"c{index}_min"]),
+                    max=_as_float(aggregates[f"c{index}_max"]),
+                    mean=_as_float(aggregates[f"c{index}_mean"]),
+                    std_dev=_as_float(aggregates[f"c{index}_std"]),
+                    unique_count=unique_count,
+                    null_count=null_count,
+                )
+            elif kind == "datetime":
+                minimum, maximum = aggregates[f"c{index}_min"], aggregates[f"c{index}_max"]
+                stats = ColumnStats(
+                    min=str(pd.Timestamp(minimum)) if minimum is not None else None,
+                    max=str(pd.Timestamp(maximum)) if maximum is not None else None,
+                    unique_count=unique_count,
+                    null_count=null_count,
+                )
+            else:
+                stats = ColumnStats(unique_count=unique_count, null_count=null_count)
+            result_schema.append(ColumnMetadata(name=name, type=dtype, stats=stats))
+        return sample, row_count, result_schema
+
+# Создаем синглтон
+sql_summarizer = SQLSummarizer()
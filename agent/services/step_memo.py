@@ -0,0 +1,110 @@
+# agent/services/step_memo.py
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from agent.config import settings
+from agent.services.data_cache import CACHE_DIR, agent_cache
+from agent.services.result_builder import frame_rows
+
+MEMO_DIR = CACHE_DIR / "memo"
+
+# Код, который сам читает базу, дает разный результат при одинаковых входах
+DB_ACCESS_MARKERS = ("get_db_connection", "DATABASE_URL")
+
+
+def normalize_code(code: str) -> str:
+    """Убирает пробелы в концах строк и пустые строки по краям: они не меняют смысл кода."""
+    return "\n".join(line.rstrip() for line in code.strip().splitlines())
+
+
+def reads_database(code: str) -> bool:
+    return any(marker in code for marker in DB_ACCESS_MARKERS)
+
+
+def memo_key(code: str, inputs: Dict[str, str], image_id: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Ключ мемоизации шага: sha256 от нормализованного кода, входов (имя
+    переменной -> ссылка на ключ кеша или хеш содержимого), id образа
+    песочницы и опций, меняющих результат (например, `partition_by`).
+    """
+    payload = json.dumps(
+        {"code": normalize_code(code), "inputs": inputs, "image": image_id, "options": options or {}},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StepMemo:
+    """
+    Мемоизация Python-шагов: повтор того же кода над теми же входами
+    возвращает сохраненный ответ и `cache_key` без запуска контейнера.
+    В записи хранятся только метаданные ответа и `cache_key`: строки при
+    попадании читаются из кеша данных, а не дублируются в JSON. Записи лежат
+    рядом с кешем данных и живут не дольше него: запись без закешированного
+    результата считается промахом и удаляется.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def input_ref(cache_key: str) -> str:
+        """
+        Ссылка на вход из кеша. Записи кеша неизменны, кроме инкрементально
+        обновляемых, поэтому к ключу добавляется их версия.
+
+        :raises FileNotFoundError: Записи нет: шаг не мемоизируется, а его
+                                   выполнение вернет CACHE_MISS_ERROR.
+        """
+        agent_cache.existing_path(cache_key)
+        meta = agent_cache.read_meta(cache_key) or {}
+        return f"cache:{cache_key}:{meta.get('version', 0)}"
+
+    @staticmethod
+    def content_ref(data: Any) -> str:
+        """Ссылка на вход, переданный в теле запроса: хеш его содержимого."""
+        return "sha256:" + hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.directory / f"{key}.json"
+        try:
+            result = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        try:
+            df = agent_cache.load(result["cache_key"])
+        except FileNotFoundError:
+            # Результат уже вытеснен из кеша: шаг нужно выполнить заново
+            path.unlink(missing_ok=True)
+            return None
+        result["data"] = {"columns": [str(column) for column in df.columns], "rows": frame_rows(df)}
+        logger.info(f"Результат Python-шага взят из мемоизации: {result['cache_key']}")
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """
+        Сохраняет ответ с `cache_key` без строк (они уже в кеше данных); заодно
+        удаляет записи старше TTL кеша данных.
+        """
+        expired_before = time.time() - settings.CACHE_TTL_HOURS * 3600
+        for entry in self.directory.glob("*.json"):
+            try:
+                if entry.stat().st_mtime < expired_before:
+                    entry.unlink()
+            except FileNotFoundError:
+                continue
+        path = self.directory / f"{key}.json"
+        tmp_path = path.with_suffix(".tmp")
+        entry = {name: value for name, value in result.items() if name not in ("data", "frame")}
+        tmp_path.write_text(json.dumps(entry, default=str), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+# Создаем синглтон
+step_memo = StepMemo(MEMO_DIR)
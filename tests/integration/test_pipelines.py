@@ -0,0 +1,55 @@
+# tests/integration/test_pipelines.py
+import pytest
+
+from agent.schemas import PipelineRequest
+from agent.services.data_cache import agent_cache
+from agent.services.pipeline_runner import pipeline_runner
+
+
+@pytest.mark.asyncio
+async def test_pipeline_joins_two_sql_branches_in_python(test_db):
+    """
+    Два независимых SQL-шага передают результаты Python-шагу в памяти;
+    кешируется и возвращается только выходной шаг.
+    """
+    request = PipelineRequest(
+        steps=[
+            {"id": "users", "language": "sql", "code": "SELECT id, username FROM users"},
+            {"id": "products", "language": "sql", "code": "SELECT user_id, price FROM products"},
+            {
+                "id": "totals",
+                "language": "python",
+                "code": (
+                    "merged = input_data['p'].merge(input_data['u'], left_on='user_id', right_on='id')\n"
+                    "result_df = merged.groupby('username', as_index=False)['price'].sum().sort_values('username')"
+                ),
+                "inputs": {"u": "users", "p": "products"},
+            },
+        ],
+        outputs=["totals"],
+    )
+
+    result = await pipeline_runner.run(request)
+
+    assert result["status"] == "success"
+    assert list(result["outputs"]) == ["totals"]
+    assert result["steps"]["users"]["row_count"] == 2
+    totals = agent_cache.load(result["outputs"]["totals"]["cache_key"])
+    assert totals["username"].tolist() == ["testuser1", "testuser2"]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_reports_failed_step(test_db):
+    request = PipelineRequest(
+        steps=[
+            {"id": "bad", "language": "sql", "code": "SELECT FROM users"},
+            {"id": "after", "language": "python", "code": "result_df = input_data['x']", "inputs": {"x": "bad"}},
+        ],
+        outputs=["after"],
+    )
+
+    result = await pipeline_runner.run(request)
+
+    assert result["status"] == "error"
+    assert result["error"]["type"] == "DATABASE_ERROR"
+    assert result["error"]["step"] == "bad"
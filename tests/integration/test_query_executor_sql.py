@@ -44,3 +44,82 @@ async def test_run_sql_syntax_error_returns_db_error(test_db):
     
     assert result["status"] == "error"
     assert result["error"]["type"] == "DATABASE_ERROR"
+
+
+@pytest.mark.asyncio
+async def test_run_sql_materialize_only_writes_cache(test_db):
+    """
+    Проверяет, что в режиме materialize_only результат выгружается в кеш
+    через COPY, а в ответе нет строк, но есть метаданные и cache_key.
+    """
+    from agent.services.data_cache import agent_cache
+
+    query_executor = QueryExecutor()
+    result = await query_executor.run_sql("SELECT id, username FROM users ORDER BY id;", materialize_only=True)
+
+    assert result["data"]["rows"] == []
+    assert result["data"]["columns"] == ["id", "username"]
+    cached = agent_cache.load(result["cache_key"])
+    assert result["metadata"]["row_count"] == len(cached)
+    assert cached["username"].iloc[0] == "testuser1"
+
+
+@pytest.mark.asyncio
+async def test_run_sql_spills_result_over_memory_budget(test_db, monkeypatch):
+    """
+    Проверяет, что результат сверх бюджета памяти пишется в кеш целиком,
+    а в ответе возвращается только его начало с флагом truncated.
+    """
+    from agent.config import settings
+    from agent.services.data_cache import agent_cache
+
+    monkeypatch.setattr(settings, "SQL_RESULT_MEMORY_BUDGET_MB", 0)
+    monkeypatch.setattr(settings, "SQL_FETCH_CHUNK_ROWS", 1)
+
+    query_executor = QueryExecutor()
+    result = await query_executor.run_sql("SELECT g AS n FROM generate_series(1, 5) AS g;")
+
+    assert result["metadata"]["truncated"] is True
+    assert result["metadata"]["row_count"] == 5
+    assert result["data"]["rows"] == [[1]]
+    assert agent_cache.load(result["cache_key"])["n"].tolist() == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_run_sql_binds_params(test_db):
+    """
+    Проверяет, что значения из params подставляются в плейсхолдеры :name
+    как параметры, а не как текст запроса.
+    """
+    query_executor = QueryExecutor()
+    sql_code = "SELECT username FROM users WHERE id = :user_id OR username = :name;"
+
+    result = await query_executor.run_sql(sql_code, params={"user_id": 1, "name": "' OR 1=1 --"})
+
+    assert result["data"]["rows"] == [["testuser1"]]
+
+
+@pytest.mark.asyncio
+async def test_run_sql_params_use_regular_cursor_without_plan(test_db, monkeypatch):
+    """
+    С SQL_COST_POLICY=off плана нет: запрос с params выполняется на обычном
+    курсоре (подготовленный оператор переиспользуется), без params - потоково.
+    """
+    from agent.config import settings
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "off")
+    query_executor = QueryExecutor()
+    fetch_sql = query_executor._fetch_sql
+    streamed = []
+
+    async def spy(sql_code, params, timeout, is_disconnected, stream, **kwargs):
+        streamed.append(stream)
+        return await fetch_sql(sql_code, params, timeout, is_disconnected, stream, **kwargs)
+
+    monkeypatch.setattr(query_executor, "_fetch_sql", spy)
+
+    result = await query_executor.run_sql("SELECT username FROM users WHERE id = :user_id;", params={"user_id": 1})
+    await query_executor.run_sql("SELECT username FROM users WHERE id = 1;")
+
+    assert result["data"]["rows"] == [["testuser1"]]
+    assert "plan" not in result["metadata"]
+    assert streamed == [False, True]
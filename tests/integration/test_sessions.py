@@ -0,0 +1,71 @@
+# tests/integration/test_sessions.py
+import pandas as pd
+import pytest
+import docker
+
+from agent.services.query_executor import SANDBOX_IMAGE_NAME
+from agent.services.data_cache import agent_cache
+from agent.services.sandbox_scheduler import sandbox_scheduler, resource_weight
+from agent.services.session_manager import session_manager, session_resources
+
+# --- Проверка наличия Docker-образа ---
+try:
+    docker_client = docker.from_env()
+    docker_client.images.get(SANDBOX_IMAGE_NAME)
+    DOCKER_IMAGE_PRESENT = True
+except (docker.errors.ImageNotFound, docker.errors.DockerException):
+    DOCKER_IMAGE_PRESENT = False
+
+pytestmark = pytest.mark.skipif(not DOCKER_IMAGE_PRESENT, reason=f"Docker image {SANDBOX_IMAGE_NAME} not found. Run 'docker build ...' first.")
+
+
+@pytest.mark.asyncio
+async def test_session_keeps_variables_between_steps():
+    """
+    Проверяет, что переменные живут между шагами, данные из кеша доступны
+    через input_data, а persist сохраняет DataFrame обратно в кеш.
+    """
+    input_key = agent_cache.save(pd.DataFrame({"a": [1, 2, 3]}))
+    created = await session_manager.create()
+    session_id = created["session_id"]
+    try:
+        first = await session_manager.execute(session_id, "df = input_data['src'] * 10", cache_keys={"src": input_key})
+        assert first["status"] == "success"
+        assert first["variables"]["df"] == "DataFrame(3x1)"
+
+        second = await session_manager.execute(session_id, "result_df = df[df['a'] > 10]", persist=["result_df"])
+        assert second["data"]["rows"] == [[20], [30]]
+        assert agent_cache.load(second["persisted"]["result_df"])["a"].tolist() == [20, 30]
+    finally:
+        await session_manager.delete(session_id)
+
+    missing = await session_manager.execute(session_id, "x = 1")
+    assert missing["error"]["type"] == "SESSION_NOT_FOUND"
+
+
+@pytest.mark.asyncio
+async def test_session_step_error_keeps_session_alive():
+    created = await session_manager.create()
+    session_id = created["session_id"]
+    try:
+        await session_manager.execute(session_id, "x = 41")
+        failed = await session_manager.execute(session_id, "1 / 0")
+        assert failed["error"]["type"] == "EXECUTION_ERROR"
+        assert "ZeroDivisionError" in failed["error"]["message"]
+
+        recovered = await session_manager.execute(session_id, "result_df = pd.DataFrame({'x': [x + 1]})")
+        assert recovered["data"]["rows"] == [[42]]
+    finally:
+        await session_manager.delete(session_id)
+
+
+@pytest.mark.asyncio
+async def test_session_holds_scheduler_slots_for_its_lifetime():
+    busy_before = sandbox_scheduler.busy_slots()
+    created = await session_manager.create()
+    session_id = created["session_id"]
+    try:
+        assert sandbox_scheduler.busy_slots() == busy_before + resource_weight(session_resources())
+    finally:
+        await session_manager.delete(session_id)
+    assert sandbox_scheduler.busy_slots() == busy_before
@@ -0,0 +1,18 @@
+# tests/unit/conftest.py
+import pytest
+
+from agent.services import data_cache
+from agent.services.data_cache import AgentDataCache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Подменяет каталог кеша агента временным (для синглтона agent_cache и новых экземпляров)."""
+    monkeypatch.setattr(data_cache, "CACHE_DIR", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def cache(cache_dir):
+    """Отдельный AgentDataCache над временным каталогом: счетчики обращений начинаются с нуля."""
+    return AgentDataCache()
@@ -0,0 +1,43 @@
+# tests/unit/test_batch_executor.py
+import asyncio
+
+import pytest
+
+from agent.services.batch_executor import batch_executor
+
+
+def _statement(delay: float, running: list, peak: list, fail: bool = False):
+    async def call():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(delay)
+        running.pop()
+        if fail:
+            raise RuntimeError("connection lost")
+        return {"status": "success", "delay": delay}
+    return call
+
+
+@pytest.mark.asyncio
+async def test_batch_respects_concurrency_and_isolates_errors():
+    running, peak = [], []
+    calls = [_statement(0.05, running, peak), _statement(0.01, running, peak, fail=True)] + [
+        _statement(0.01, running, peak) for _ in range(4)
+    ]
+
+    results = await batch_executor.run(calls, concurrency=2)
+
+    assert max(peak) == 2
+    assert [result["index"] for result in results] == list(range(6))
+    assert results[0]["status"] == "success"
+    assert results[1]["error"] == {"type": "UNEXPECTED_ERROR", "message": "connection lost"}
+
+
+@pytest.mark.asyncio
+async def test_results_stream_in_completion_order():
+    running, peak = [], []
+    calls = [_statement(0.1, running, peak), _statement(0.01, running, peak)]
+
+    order = [result["index"] async for result in batch_executor.iter_results(calls, concurrency=2)]
+
+    assert order == [1, 0]
@@ -0,0 +1,69 @@
+# tests/unit/test_bulk_export.py
+import io
+from collections import namedtuple
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from agent.services.bulk_export import (
+    COPY_NULL_MARKER, arrow_schema_from_description, copy_convert_options, frame_to_arrow,
+)
+from agent.services.result_builder import ResultStatsAccumulator
+
+# Столбец cursor.description в форме DB-API
+Column = namedtuple("Column", "name type_code display_size internal_size precision scale null_ok")
+
+DESCRIPTION = [
+    Column("name", 25, None, None, None, None, None),
+    Column("price", 1700, None, None, 20, 4, None),
+    Column("amount", 1700, None, None, None, None, None),
+    Column("ratio", 701, None, None, None, None, None),
+]
+
+
+def _parse(csv_text: str, schema: pa.Schema) -> pa.Table:
+    read_options = pa_csv.ReadOptions(column_names=schema.names)
+    return pa_csv.read_csv(io.BytesIO(csv_text.encode()), read_options=read_options, convert_options=copy_convert_options(schema))
+
+
+def test_copy_keeps_numeric_precision_and_quoted_markers():
+    schema = arrow_schema_from_description(DESCRIPTION)
+    assert schema.field("price").type == pa.decimal128(20, 4)
+    assert schema.field("amount").type == pa.string()
+
+    # Так COPY ... WITH (FORMAT csv, NULL '\N') пишет строку '\N', пустую строку и NULL
+    table = _parse(
+        f'"{COPY_NULL_MARKER}",1234567890123456.7891,12345678901234567890.123456789,0.5\n'
+        f'"",{COPY_NULL_MARKER},{COPY_NULL_MARKER},{COPY_NULL_MARKER}\n'
+        f'{COPY_NULL_MARKER},{COPY_NULL_MARKER},{COPY_NULL_MARKER},{COPY_NULL_MARKER}\n',
+        schema,
+    )
+    assert table.column("name").to_pylist() == [COPY_NULL_MARKER, "", None]
+    assert table.column("price").to_pylist() == [Decimal("1234567890123456.7891"), None, None]
+    assert table.column("amount").to_pylist() == ["12345678901234567890.123456789", None, None]
+
+
+def test_frame_to_arrow_matches_copy_types():
+    schema = arrow_schema_from_description(DESCRIPTION)
+    # Так строки приходят из курсора psycopg
+    df = pd.DataFrame({
+        "name": ["a", None],
+        "price": [Decimal("1234567890123456.7891"), None],
+        "amount": [Decimal("12345678901234567890.123456789"), None],
+        "ratio": [0.5, None],
+    })
+
+    table = frame_to_arrow(df, schema)
+    assert table.schema == schema
+    assert table.column("price").to_pylist() == [Decimal("1234567890123456.7891"), None]
+    assert table.column("amount").to_pylist() == ["12345678901234567890.123456789", None]
+
+    stats = ResultStatsAccumulator(schema)
+    stats.update(table)
+    assert stats.column_max("price") == Decimal("1234567890123456.7891")
+    # Состояние статистики переживает JSON без потери знаков
+    restored = ResultStatsAccumulator(schema)
+    restored.load_state(stats.state())
+    assert restored.column_max("price") == Decimal("1234567890123456.7891")
@@ -0,0 +1,80 @@
+# tests/unit/test_cache_query.py
+import pandas as pd
+import pytest
+
+from agent.schemas import CacheQueryRequest
+from agent.services import data_cache
+from agent.services.cache_query import CacheQueryEngine
+
+
+@pytest.fixture
+def cached_key(cache_dir):
+    """Кладет небольшой DataFrame во временный кеш и возвращает его ключ."""
+    df = pd.DataFrame({
+        "region": ["north", "south", "north", "east", "south"],
+        "amount": [10.0, 20.0, 30.0, 5.0, None],
+        "created_at": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]),
+    })
+    return data_cache.agent_cache.save(df)
+
+
+@pytest.mark.asyncio
+async def test_filter_and_projection(cached_key):
+    """Проверяет фильтрацию, выбор столбцов, сортировку и limit."""
+    request = CacheQueryRequest(
+        columns=["region", "amount"],
+        filters=[{"column": "amount", "op": ">=", "value": 10}],
+        order_by=[{"column": "amount", "descending": True}],
+        limit=2,
+    )
+    result = await CacheQueryEngine().query(cached_key, request)
+
+    assert result["data"]["columns"] == ["region", "amount"]
+    assert result["data"]["rows"] == [["north", 30.0], ["south", 20.0]]
+    assert result["cache_key"] is None
+
+
+@pytest.mark.asyncio
+async def test_filter_casts_value_to_column_type(cached_key):
+    """Строковое значение приводится к типу столбца-даты."""
+    request = CacheQueryRequest(filters=[{"column": "created_at", "op": "<", "value": "2024-01-03"}])
+    result = await CacheQueryEngine().query(cached_key, request)
+
+    assert result["metadata"]["row_count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_group_by_aggregation_and_save(cached_key):
+    """Проверяет group-by с агрегатами и сохранение результата в кеш."""
+    request = CacheQueryRequest(
+        filters=[{"column": "amount", "op": "not_null"}],
+        group_by=["region"],
+        aggregations=[
+            {"column": "amount", "func": "sum", "alias": "total"},
+            {"column": "amount", "func": "count"},
+        ],
+        order_by=[{"column": "region"}],
+        save_result=True,
+    )
+    result = await CacheQueryEngine().query(cached_key, request)
+
+    assert result["data"]["columns"] == ["region", "total", "amount_count"]
+    assert result["data"]["rows"] == [["east", 5.0, 1], ["north", 40.0, 2], ["south", 20.0, 1]]
+    saved = data_cache.agent_cache.load(result["cache_key"])
+    assert len(saved) == 3
+
+
+@pytest.mark.asyncio
+async def test_unknown_column_returns_query_error(cached_key):
+    request = CacheQueryRequest(columns=["missing"])
+    result = await CacheQueryEngine().query(cached_key, request)
+
+    assert result["status"] == "error"
+    assert result["error"]["type"] == "QUERY_ERROR"
+
+
+@pytest.mark.asyncio
+async def test_missing_or_malformed_key_returns_cache_miss(cached_key):
+    for key in ["00000000-0000-0000-0000-000000000000", "../../etc/passwd"]:
+        result = await CacheQueryEngine().query(key, CacheQueryRequest())
+        assert result["error"]["type"] == "CACHE_MISS_ERROR"
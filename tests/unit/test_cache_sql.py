@@ -0,0 +1,51 @@
+# tests/unit/test_cache_sql.py
+import pandas as pd
+import pytest
+
+from agent.services import data_cache
+from agent.services.cache_sql import CacheSQLEngine
+
+
+@pytest.fixture
+def cached_keys(cache_dir):
+    """Кладет во временный кеш два результата, которые можно соединить по id."""
+    users = data_cache.agent_cache.save(pd.DataFrame({"id": [1, 2, 3], "name": ["a", "b", "c"]}))
+    orders = data_cache.agent_cache.save(pd.DataFrame({"id": [1, 1, 3], "amount": [10.0, 5.0, 7.5]}))
+    return users, orders
+
+
+@pytest.mark.asyncio
+async def test_join_across_cached_results(cached_keys):
+    users, orders = cached_keys
+    sql = f"""
+        SELECT name, SUM(amount) AS total
+        FROM cache('{users}') JOIN cache('{orders}') USING (id)
+        GROUP BY name ORDER BY name
+    """
+    result = await CacheSQLEngine().run(sql)
+
+    assert result["data"]["rows"] == [["a", 15.0], ["c", 7.5]]
+    assert data_cache.agent_cache.load(result["cache_key"]).shape == (2, 2)
+
+
+@pytest.mark.asyncio
+async def test_unsafe_sql_is_rejected(cached_keys):
+    users, _ = cached_keys
+    result = await CacheSQLEngine().run(f"DROP TABLE cache('{users}')")
+
+    assert result["error"]["type"] == "PERMISSION_ERROR"
+
+
+@pytest.mark.asyncio
+async def test_file_system_access_is_disabled(cached_keys):
+    users, _ = cached_keys
+    result = await CacheSQLEngine().run(f"SELECT * FROM cache('{users}'), read_csv('/etc/passwd')")
+
+    assert result["error"]["type"] == "QUERY_ERROR"
+
+
+@pytest.mark.asyncio
+async def test_unknown_cache_key(cached_keys):
+    result = await CacheSQLEngine().run("SELECT * FROM cache('00000000-0000-0000-0000-000000000000')")
+
+    assert result["error"]["type"] == "CACHE_MISS_ERROR"
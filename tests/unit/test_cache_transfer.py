@@ -0,0 +1,75 @@
+# tests/unit/test_cache_transfer.py
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from agent.config import settings
+from agent.services import cache_transfer as cache_transfer_module
+from agent.services.cache_transfer import cache_transfer, ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE
+from agent.services.data_cache import agent_cache
+
+pytestmark = pytest.mark.usefixtures("cache_dir")
+
+
+def _table() -> pa.Table:
+    return pa.table({"id": list(range(1000)), "name": [f"n{i}" for i in range(1000)]})
+
+
+async def _chunks(data: bytes, size: int = 100):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+def _arrow_bytes(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=300)
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.mark.asyncio
+async def test_arrow_upload_round_trips_through_arrow_download(monkeypatch, cache_dir):
+    monkeypatch.setattr(cache_transfer_module, "DOWNLOAD_BATCH_ROWS", 256)
+    result = await cache_transfer.upload(_chunks(_arrow_bytes(_table())), ARROW_STREAM_MEDIA_TYPE)
+
+    assert result["status"] == "success"
+    assert result["row_count"] == 1000
+    assert [column["name"] for column in result["columns"]] == ["id", "name"]
+    assert not list(cache_dir.glob("*.tmp"))
+
+    _, chunks = cache_transfer.arrow_stream(result["cache_key"])
+    downloaded = pa.ipc.open_stream(b"".join(chunks)).read_all()
+    assert downloaded.equals(_table())
+
+
+@pytest.mark.asyncio
+async def test_parquet_upload():
+    buffer = io.BytesIO()
+    pq.write_table(_table(), buffer)
+    result = await cache_transfer.upload(_chunks(buffer.getvalue(), 4096), PARQUET_MEDIA_TYPE)
+
+    assert result["status"] == "success"
+    assert agent_cache.load(result["cache_key"]).equals(_table().to_pandas())
+
+
+@pytest.mark.asyncio
+async def test_rejected_uploads_leave_nothing_behind(monkeypatch, cache_dir):
+    result = await cache_transfer.upload(_chunks(b"not parquet"), PARQUET_MEDIA_TYPE)
+    assert result["error"]["type"] == "DESERIALIZATION_ERROR"
+
+    result = await cache_transfer.upload(_chunks(b"{}"), "application/json")
+    assert result["error"]["type"] == "UNSUPPORTED_MEDIA_TYPE"
+
+    monkeypatch.setattr(settings, "CACHE_UPLOAD_MAX_MB", 0)
+    result = await cache_transfer.upload(_chunks(_arrow_bytes(_table())), ARROW_STREAM_MEDIA_TYPE)
+    assert result["error"]["type"] == "PAYLOAD_TOO_LARGE"
+
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_download_of_missing_key():
+    with pytest.raises(FileNotFoundError):
+        cache_transfer.arrow_stream("00000000-0000-0000-0000-000000000000")
@@ -0,0 +1,114 @@
+# tests/unit/test_data_cache.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from agent.config import settings
+from agent.services import data_cache
+
+
+def _age(cache_key: str, seconds: float) -> None:
+    """Сдвигает время последнего обращения к записи в прошлое."""
+    path = data_cache.CACHE_DIR / f"{cache_key}.parquet"
+    timestamp = time.time() - seconds
+    os.utime(path, (timestamp, timestamp))
+
+
+def test_ttl_respects_entry_policy_and_pins(cache, monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_TTL_HOURS", 1)
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    expired = cache.save(df)
+    long_lived = cache.save(df, ttl_seconds=3 * 3600)
+    pinned = cache.save(df)
+    cache.pin(pinned, holder="session:1")
+    for key in (expired, long_lived, pinned):
+        _age(key, 2 * 3600)
+
+    cache._cleanup()
+
+    remaining = {entry["cache_key"] for entry in cache.entries()}
+    assert remaining == {long_lived, pinned}
+    assert cache.stats()["evictions"]["ttl"] == 1
+
+    assert cache.unpin(pinned, holder="session:1")
+    assert not cache.unpin(pinned, holder="session:1")
+    cache._cleanup()
+    assert {entry["cache_key"] for entry in cache.entries()} == {long_lived}
+
+
+def test_expired_pin_no_longer_protects(cache, monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_TTL_HOURS", 1)
+    key = cache.save(pd.DataFrame({"a": [1]}))
+    cache.pin(key, ttl_seconds=60)
+    policy = cache._read_policy(key)
+    policy["pins"]["api"] = time.time() - 1
+    cache._write_policy(key, policy)
+    _age(key, 2 * 3600)
+
+    cache._cleanup()
+
+    assert cache.entries() == []
+
+
+def test_size_eviction_prefers_low_priority_then_lru(cache, monkeypatch):
+    df = pd.DataFrame({"a": range(100)})
+    important = cache.save(df, priority=10)
+    older = cache.save(df)
+    newer = cache.save(df)
+    pinned = cache.save(df)
+    cache.pin(pinned)
+    _age(important, 300)
+    _age(older, 200)
+    _age(newer, 100)
+    _age(pinned, 400)
+    entry_size = (data_cache.CACHE_DIR / f"{older}.parquet").stat().st_size
+    # Лимит превышен; освободить нужно место под две записи из четырех
+    monkeypatch.setattr(settings, "CACHE_MAX_SIZE_MB", 0)
+    monkeypatch.setattr(settings, "CACHE_CLEANUP_TARGET_MB", 2.5 * entry_size / 1024**2)
+
+    cache._cleanup()
+
+    assert {entry["cache_key"] for entry in cache.entries()} == {important, pinned}
+    stats = cache.stats()
+    assert stats["evictions"]["size"] == 2
+    assert stats["evicted_bytes"] == 2 * entry_size
+    assert stats["pinned_entries"] == 1
+
+
+def test_stats_count_hits_misses_and_delete(cache):
+    key = cache.save(pd.DataFrame({"a": [1, 2]}))
+    cache.set_policy(key, ttl_seconds=60, priority=3)
+    cache.load(key)
+    cache.path_for(key)
+    with pytest.raises(FileNotFoundError):
+        cache.load("00000000-0000-0000-0000-000000000000")
+    # Служебные обращения не считаются
+    cache.existing_path(key)
+    with pytest.raises(FileNotFoundError):
+        cache.existing_path("00000000-0000-0000-0000-000000000000")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3, abs=1e-4)
+    [entry] = cache.entries()
+    assert (entry["ttl_seconds"], entry["priority"], entry["pinned"]) == (60, 3, False)
+
+    assert cache.delete(key)
+    # Остается только общий файл блокировки политик
+    assert [path.name for path in data_cache.CACHE_DIR.iterdir()] == [data_cache.POLICY_LOCK_NAME]
+
+
+def test_concurrent_pins_are_not_lost(cache):
+    key = cache.save(pd.DataFrame({"a": [1]}))
+    holders = [f"session:{index}" for index in range(64)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda holder: cache.pin(key, holder=holder), holders))
+    assert set(cache._read_policy(key)["pins"]) == set(holders)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert all(pool.map(lambda holder: cache.unpin(key, holder=holder), holders[::2]))
+    assert set(cache._read_policy(key)["pins"]) == set(holders[1::2])
@@ -0,0 +1,78 @@
+# tests/unit/test_docker_async.py
+import json
+
+import httpx
+import pytest
+
+from agent.services.docker_async import (
+    AsyncDockerClient, DockerNotFoundError, LOG_FRAME_HEADER, demultiplex_logs, parse_memory_limit
+)
+
+
+def _frame(stream_type: int, payload: bytes) -> bytes:
+    return LOG_FRAME_HEADER.pack(stream_type, len(payload)) + payload
+
+
+def test_parse_memory_limit():
+    assert parse_memory_limit("256m") == 256 * 1024**2
+    assert parse_memory_limit("1G") == 1024**3
+    assert parse_memory_limit("1.5g") == 1536 * 1024**2
+    with pytest.raises(ValueError):
+        parse_memory_limit("lots")
+
+
+def test_demultiplex_logs_splits_streams_across_chunks():
+    raw = _frame(1, b'{"status": ') + _frame(2, b"warning\n") + _frame(1, b'"success"}')
+    # Кадры могут быть разрезаны по границам HTTP-чанков
+    stdout, stderr = demultiplex_logs([raw[:5], raw[5:20], raw[20:]])
+    assert stdout == b'{"status": "success"}'
+    assert stderr == b"warning\n"
+
+
+@pytest.mark.asyncio
+async def test_container_lifecycle_against_fake_daemon():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path))
+        if request.url.path.endswith("/containers/create"):
+            body = json.loads(request.content)
+            assert body["HostConfig"]["Memory"] == 256 * 1024**2
+            assert "A=1" in body["Env"]
+            return httpx.Response(201, json={"Id": "abc"})
+        if request.url.path.endswith("/wait"):
+            return httpx.Response(200, json={"StatusCode": 0})
+        if request.url.path.endswith("/logs"):
+            return httpx.Response(200, content=_frame(1, b"out") + _frame(2, b"err"))
+        return httpx.Response(204)
+
+    client = AsyncDockerClient("unix:///var/run/docker.sock")
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://docker/v1.41")
+
+    container_id = await client.create_container(
+        "image", environment={"A": "1"}, network="bridge", mem_limit="256m", cpu_period=100000, cpu_quota=50000
+    )
+    await client.start_container(container_id)
+    assert await client.wait_container(container_id) == 0
+    assert await client.logs(container_id) == (b"out", b"err")
+    await client.remove_container(container_id)
+    await client.close()
+
+    assert [path for _, path in calls] == [
+        "/v1.41/containers/create",
+        "/v1.41/containers/abc/start",
+        "/v1.41/containers/abc/wait",
+        "/v1.41/containers/abc/logs",
+        "/v1.41/containers/abc",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_missing_image_raises_not_found():
+    client = AsyncDockerClient()
+    client._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(404, json={"message": "No such image"})),
+        base_url="http://docker/v1.41",
+    )
+    with pytest.raises(DockerNotFoundError):
+        await client.create_container("missing", {}, "bridge", "256m", 100000, 50000)
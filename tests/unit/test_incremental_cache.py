@@ -0,0 +1,84 @@
+# tests/unit/test_incremental_cache.py
+import datetime
+
+import pandas as pd
+import pytest
+
+from agent.services.data_cache import agent_cache
+from agent.services.incremental_cache import incremental_cache
+from agent.services.result_builder import build_enriched_response_from_df
+
+INT8_OID, TIMESTAMP_OID = 20, 1114
+
+pytestmark = pytest.mark.usefixtures("cache_dir")
+
+
+class FakeResult:
+    def __init__(self, rows, description):
+        self.rows = rows
+        self.cursor = type("Cursor", (), {"description": description})()
+
+    def keys(self):
+        return [column[0] for column in self.cursor.description]
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+
+class FakeConnection:
+    """Возвращает заранее заданные новые строки и запоминает запрос к базе."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def execution_options(self, **options):
+        return self
+
+    def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+        return FakeResult(self.rows, [("id", INT8_OID), ("created_at", TIMESTAMP_OID)])
+
+
+def _events(ids):
+    return pd.DataFrame({
+        "id": ids,
+        "created_at": [datetime.datetime(2024, 1, 1) + datetime.timedelta(days=i) for i in ids],
+    })
+
+
+def test_refresh_appends_only_new_rows_and_bumps_version():
+    cache_key = agent_cache.save(_events([1, 2, 3]))
+    registered = incremental_cache.register(cache_key, "SELECT id, created_at FROM events;", {"kind": "click"}, "id")
+    assert (registered.version, registered.watermark) == (1, 3)
+
+    new_rows = [tuple(row) for row in _events([4, 5]).itertuples(index=False)]
+    connection = FakeConnection(new_rows)
+    stats, refreshed = incremental_cache.refresh(connection, cache_key)
+
+    sql, params = connection.statements[0]
+    assert sql.endswith('AS _delta WHERE "id" > :_watermark')
+    assert params == {"kind": "click", "_watermark": 3}
+    assert (refreshed.version, refreshed.rows_appended, refreshed.watermark) == (2, 2, 5)
+    # Запись содержит все строки, а дополненная статистика совпадает с полным пересчетом
+    full = agent_cache.load(cache_key)
+    assert full["id"].tolist() == [1, 2, 3, 4, 5]
+    expected = build_enriched_response_from_df(full, 0)["metadata"]["result_schema"]
+    assert [column.model_dump() for column in stats.result_schema()] == expected
+
+
+def test_refresh_without_new_rows_keeps_version():
+    cache_key = agent_cache.save(_events([1, 2]))
+    incremental_cache.register(cache_key, "SELECT id, created_at FROM events", {}, "created_at")
+
+    _, refreshed = incremental_cache.refresh(FakeConnection([]), cache_key)
+
+    assert (refreshed.version, refreshed.rows_appended) == (1, 0)
+    assert refreshed.watermark == "2024-01-03T00:00:00"
+
+
+def test_unregistered_entry_cannot_be_refreshed():
+    cache_key = agent_cache.save(_events([1]))
+    with pytest.raises(LookupError):
+        incremental_cache.refresh(FakeConnection([]), cache_key)
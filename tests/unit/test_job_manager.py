@@ -0,0 +1,104 @@
+# tests/unit/test_job_manager.py
+import asyncio
+
+import pytest
+
+from agent.config import settings
+from agent.services import job_manager as job_manager_module
+from agent.services.job_manager import JobManager, JobQueueFullError
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_manager_module, "JOB_CANCEL_POLL_SECONDS", 0.01)
+    return JobManager(tmp_path / "jobs.sqlite")
+
+
+async def _wait_for(jobs: JobManager, job_id: str, status: str) -> dict:
+    for _ in range(200):
+        job = jobs.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {jobs.get(job_id)['status']}, expected {status}")
+
+
+@pytest.mark.asyncio
+async def test_result_rows_stay_in_cache(jobs):
+    async def runner():
+        return {
+            "status": "success",
+            "cache_key": "abc",
+            "data": {"columns": ["x"], "rows": [[1], [2]]},
+            "metadata": {"row_count": 2, "truncated": False},
+        }
+
+    job = await jobs.submit("execute", runner)
+    assert job["status"] == "queued"
+
+    job = await _wait_for(jobs, job["job_id"], "succeeded")
+    assert job["result"]["cache_key"] == "abc"
+    assert job["result"]["data"]["rows"] == []
+    assert job["result"]["metadata"]["truncated"] is True
+
+
+@pytest.mark.asyncio
+async def test_error_result_marks_job_failed(jobs):
+    async def runner():
+        return {"status": "error", "error": {"type": "QUERY_ERROR", "message": "syntax error"}}
+
+    job = await _wait_for(jobs, (await jobs.submit("execute", runner))["job_id"], "failed")
+    assert job["error"] == {"type": "QUERY_ERROR", "message": "syntax error"}
+
+
+@pytest.mark.asyncio
+async def test_cancel_from_another_worker_stops_the_task(jobs, tmp_path):
+    stopped = asyncio.Event()
+
+    async def runner():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            stopped.set()
+        return {"status": "success"}
+
+    job_id = (await jobs.submit("execute", runner))["job_id"]
+    await _wait_for(jobs, job_id, "running")
+
+    # Другой воркер видит ту же базу, но не владеет задачей
+    other_worker = JobManager(tmp_path / "jobs.sqlite")
+    assert (await other_worker.cancel(job_id))["cancel_requested"] is True
+
+    await _wait_for(jobs, job_id, "cancelled")
+    assert stopped.is_set()
+
+
+@pytest.mark.asyncio
+async def test_queue_limit(jobs, monkeypatch):
+    monkeypatch.setattr(settings, "JOBS_QUEUE_LIMIT", 1)
+    release = asyncio.Event()
+
+    async def runner():
+        await release.wait()
+        return {"status": "success"}
+
+    job_id = (await jobs.submit("execute", runner))["job_id"]
+    with pytest.raises(JobQueueFullError):
+        await jobs.submit("execute", runner)
+    release.set()
+    await _wait_for(jobs, job_id, "succeeded")
+
+
+@pytest.mark.asyncio
+async def test_unknown_job(jobs):
+    assert jobs.get("missing") is None
+    assert await jobs.cancel("missing") is None
+
+
+def test_database_is_created_lazily_in_state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "AGENT_STATE_DIR", str(tmp_path / "state"))
+    jobs = JobManager()
+    assert not (tmp_path / "state").exists()
+
+    assert jobs.get("missing") is None
+    assert (tmp_path / "state" / "jobs.sqlite").exists()
@@ -0,0 +1,33 @@
+# tests/unit/test_partitioning.py
+import pandas as pd
+import pytest
+
+from agent.services.partitioning import split_frame
+
+
+def test_row_ranges_keep_order():
+    frame = pd.DataFrame({"x": range(10)})
+    parts = split_frame(frame, 3)
+    assert [len(part) for part in parts] == [3, 3, 4]
+    assert pd.concat(parts)["x"].tolist() == list(range(10))
+
+
+def test_key_partitions_keep_keys_together():
+    frame = pd.DataFrame({"user_id": [1, 2, 3, 1, 2, 3, 4, 4], "amount": range(8)})
+    parts = split_frame(frame, 3, ["user_id"])
+    assert sum(len(part) for part in parts) == len(frame)
+    seen = [set(part["user_id"]) for part in parts]
+    for index, keys in enumerate(seen):
+        for other in seen[index + 1:]:
+            assert not keys & other
+
+
+def test_more_partitions_than_rows():
+    frame = pd.DataFrame({"x": [1, 2]})
+    assert len(split_frame(frame, 8)) == 2
+    assert len(split_frame(frame.iloc[0:0], 8)) == 1
+
+
+def test_missing_key_column():
+    with pytest.raises(ValueError):
+        split_frame(pd.DataFrame({"x": [1]}), 2, ["user_id"])
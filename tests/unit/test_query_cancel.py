@@ -0,0 +1,70 @@
+# tests/unit/test_query_cancel.py
+import threading
+import time
+
+import pytest
+
+from agent.services.query_cancel import QueryCancelScope, QueryCancelledError, run_cancellable
+
+
+class FakeConnection:
+    """Имитирует DBAPI-соединение: cancel() прерывает выполняемый запрос."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def _blocking_query(scope: QueryCancelScope, connection: FakeConnection):
+    def run():
+        scope.bind(connection)
+        if connection.cancelled.wait(timeout=5):
+            raise RuntimeError("canceling statement due to user request")
+        return "finished"
+    return run
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancels_backend_query():
+    scope, connection = QueryCancelScope(), FakeConnection()
+    start = time.monotonic()
+    with pytest.raises(QueryCancelledError) as exc_info:
+        await run_cancellable(_blocking_query(scope, connection), scope, timeout_seconds=0.3)
+
+    assert exc_info.value.reason == "timeout"
+    assert connection.cancelled.is_set()
+    assert time.monotonic() - start < 1.5
+
+
+@pytest.mark.asyncio
+async def test_client_disconnect_cancels_backend_query():
+    scope, connection = QueryCancelScope(), FakeConnection()
+
+    async def is_disconnected():
+        return True
+
+    with pytest.raises(QueryCancelledError) as exc_info:
+        await run_cancellable(_blocking_query(scope, connection), scope, timeout_seconds=30, is_disconnected=is_disconnected)
+
+    assert exc_info.value.reason == "disconnected"
+
+
+@pytest.mark.asyncio
+async def test_server_side_statement_timeout_is_reported_as_timeout():
+    class QueryCanceled(Exception):
+        sqlstate = "57014"
+
+    def run():
+        raise QueryCanceled("canceling statement due to statement timeout")
+
+    with pytest.raises(QueryCancelledError) as exc_info:
+        await run_cancellable(run, QueryCancelScope(), timeout_seconds=30)
+    assert exc_info.value.reason == "timeout"
+
+
+@pytest.mark.asyncio
+async def test_completed_query_returns_result():
+    scope = QueryCancelScope()
+    assert await run_cancellable(lambda: 42, scope, timeout_seconds=5) == 42
@@ -0,0 +1,67 @@
+# tests/unit/test_query_log.py
+import pytest
+
+from agent.config import settings
+from agent.services.query_log import SlowQueryLog, fingerprint_sql
+
+
+def test_fingerprint_strips_literals_and_comments():
+    first = fingerprint_sql("SELECT * FROM orders WHERE id IN (1, 2, 3) AND status = 'new'; -- from LLM")
+    second = fingerprint_sql("select *  from orders\nwhere id in (42) and status = 'it''s done'")
+    assert first == second == "select * from orders where id in (?) and status = ?"
+    # Цифры в идентификаторах не считаются литералами
+    assert fingerprint_sql("SELECT col1 FROM t2 LIMIT 10") == "select col1 from t2 limit ?"
+
+
+@pytest.fixture
+def query_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_SLOW_QUERY_THRESHOLD_MS", 100.0)
+    return SlowQueryLog(tmp_path / "queries.sqlite")
+
+
+def test_only_slow_queries_are_recorded(query_log):
+    query_log.record("SELECT 1", 5.0, {"metadata": {"row_count": 1}})
+    assert query_log.aggregates() == []
+
+
+def test_aggregates_group_by_fingerprint(query_log):
+    for user_id, duration in enumerate([200.0, 400.0, 1000.0]):
+        query_log.record(f"SELECT * FROM users WHERE id = {user_id}", duration, {"metadata": {"row_count": 1}})
+    query_log.record(
+        "SELECT * FROM a, b", 150.0,
+        {"status": "error", "error": {"type": "COST_LIMIT_ERROR", "plan": {"total_cost": 1e9}}},
+    )
+
+    summaries = query_log.aggregates()
+
+    assert [s["count"] for s in summaries] == [3, 1]
+    users = summaries[0]
+    assert users["fingerprint"] == "select * from users where id = ?"
+    assert users["total_time_ms"] == 1600.0
+    assert (users["p50_ms"], users["p95_ms"]) == (400.0, 1000.0)
+    assert summaries[1]["errors"] == 1
+    assert summaries[1]["last_plan"] == {"total_cost": 1e9}
+
+
+def test_cache_hits_are_recorded_but_not_timed(query_log):
+    query_log.record("SELECT * FROM events WHERE day = 1", 300.0, {"metadata": {"row_count": 10}})
+    query_log.record("SELECT * FROM events WHERE day = 2", 2.0, {"metadata": {"row_count": 20}}, cache_hit=True)
+
+    [events] = query_log.aggregates()
+
+    assert (events["count"], events["cache_hits"]) == (2, 1)
+    assert events["total_time_ms"] == events["p95_ms"] == 300.0
+    assert events["avg_rows"] == 15.0
+    assert events["sample_query"] == "SELECT * FROM events WHERE day = 2"
+
+
+def test_aggregates_order_and_limit(query_log):
+    for duration in (150.0, 160.0, 170.0):
+        query_log.record("SELECT * FROM frequent", duration, {})
+    query_log.record("SELECT * FROM rare", 5000.0, {})
+    query_log.record("SELECT * FROM cached", 1.0, {}, cache_hit=True)
+
+    assert [s["fingerprint"] for s in query_log.aggregates(order_by="count", limit=1)] == ["select * from frequent"]
+    assert [s["fingerprint"] for s in query_log.aggregates(order_by="p95_ms")] == [
+        "select * from rare", "select * from frequent", "select * from cached",
+    ]
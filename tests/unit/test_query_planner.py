@@ -0,0 +1,122 @@
+# tests/unit/test_query_planner.py
+import pytest
+
+from agent.config import settings
+from agent.schemas import PlanSummary
+from agent.services.query_planner import query_planner, strip_trailing_semicolon, wrap_with_limit
+
+
+@pytest.fixture
+def thresholds(monkeypatch):
+    monkeypatch.setattr(settings, "SQL_MAX_PLAN_COST", 1000.0)
+    monkeypatch.setattr(settings, "SQL_MAX_PLAN_ROWS", 100)
+    monkeypatch.setattr(settings, "SQL_AUTO_LIMIT_ROWS", 10)
+
+
+def _plan(cost: float, rows: int) -> PlanSummary:
+    return PlanSummary(total_cost=cost, plan_rows=rows, node_type="Nested Loop")
+
+
+def test_wrap_with_limit_survives_trailing_comment():
+    """Комментарий в конце запроса не должен закомментировать закрывающую скобку."""
+    wrapped = wrap_with_limit("SELECT 1; -- все строки", 5)
+    assert wrapped == "SELECT * FROM (\nSELECT 1\n) AS _limited LIMIT 5"
+    assert strip_trailing_semicolon("SELECT 1 -- c") == "SELECT 1 -- c"
+
+
+def test_cheap_query_passes_unchanged(thresholds, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "reject")
+    sql, plan = query_planner.apply_policy("SELECT 1", _plan(10, 1))
+    assert sql == "SELECT 1"
+    assert plan.exceeded is False and plan.action == "none"
+
+
+def test_reject_policy_returns_plan_summary(thresholds, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "reject")
+    sql, plan = query_planner.apply_policy("SELECT * FROM a, b", _plan(5000, 10))
+    assert sql is None
+    assert plan.action == "rejected"
+    assert "5000" in plan.message
+
+
+def test_limit_policy_wraps_query(thresholds, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "limit")
+    sql, plan = query_planner.apply_policy("SELECT * FROM a, b", _plan(10, 10_000))
+    assert sql.endswith("LIMIT 10")
+    assert plan.action == "limited"
+
+
+def test_limit_policy_falls_back_to_warning_when_limit_not_allowed(thresholds, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "limit")
+    sql, plan = query_planner.apply_policy("SELECT * FROM a, b", _plan(10, 10_000), allow_limit=False)
+    assert sql == "SELECT * FROM a, b"
+    assert plan.action == "warned"
+
+
+def test_job_policy_defers_query_unless_already_in_job(thresholds, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "job")
+    sql, plan = query_planner.apply_policy("SELECT * FROM a, b", _plan(10, 10_000))
+    assert sql == "SELECT * FROM a, b"
+    assert plan.action == "deferred"
+
+    _, plan = query_planner.apply_policy("SELECT * FROM a, b", _plan(10, 10_000), allow_job=False)
+    assert plan.action == "warned"
+
+
+class FakeConnection:
+    """Отвечает на EXPLAIN заранее заданным планом, а на запрос к pg_class - числом строк."""
+
+    def __init__(self, raw_plan, reltuples):
+        self.raw_plan = raw_plan
+        self.reltuples = reltuples
+
+    def execute(self, statement, params=None):
+        value = self.raw_plan if str(statement).startswith("EXPLAIN") else self.reltuples
+        return type("Result", (), {"scalar": lambda self: value})()
+
+
+def test_explain_tree_flags_seq_scan_on_large_table(monkeypatch):
+    monkeypatch.setattr(settings, "SQL_SEQ_SCAN_WARN_ROWS", 1000)
+    raw_plan = [{
+        "Plan": {
+            "Node Type": "Hash Join", "Total Cost": 50.0, "Plan Rows": 10,
+            "Actual Rows": 12, "Actual Total Time": 3.5, "Actual Loops": 1, "Shared Hit Blocks": 7,
+            "Plans": [{
+                "Node Type": "Seq Scan", "Relation Name": "orders", "Filter": "(amount > 0)",
+                "Total Cost": 40.0, "Plan Rows": 500, "Actual Rows": 480, "Actual Loops": 1,
+                "Shared Read Blocks": 20,
+            }],
+        },
+        "Planning Time": 0.2,
+        "Execution Time": 3.9,
+    }]
+
+    plan = query_planner.explain_tree(FakeConnection(raw_plan, reltuples=50_000), "SELECT 1", analyze=True)
+
+    assert plan.mode == "analyze"
+    assert plan.execution_time_ms == 3.9
+    scan = plan.root.children[0]
+    assert (scan.estimated_rows, scan.actual_rows, scan.shared_read_blocks) == (500, 480, 20)
+    assert len(plan.warnings) == 1 and "orders" in plan.warnings[0]
+
+
+@pytest.mark.parametrize("options, expected", [
+    ({}, (True, True)),
+    ({"materialize_only": True}, (False, True)),
+    ({"watermark_column": "updated_at"}, (False, True)),
+    ({"background": True}, (True, False)),
+    # Кадр для следующего шага конвейера: ни LIMIT, ни фонового задания
+    ({"keep_frame": True}, (False, False)),
+])
+def test_policy_permissions(options, expected):
+    assert query_planner.policy_permissions(**options) == expected
+
+
+def test_limit_policy_keeps_pipeline_frame_complete(thresholds, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_COST_POLICY", "limit")
+    allow_limit, allow_job = query_planner.policy_permissions(keep_frame=True)
+
+    sql, plan = query_planner.apply_policy("SELECT * FROM a, b", _plan(5000, 10), allow_limit, allow_job)
+
+    assert sql == "SELECT * FROM a, b"
+    assert plan.action == "warned"
@@ -0,0 +1,96 @@
+# tests/unit/test_query_sampler.py
+import pytest
+
+from agent.config import settings
+from agent.schemas import ApproximateOptions
+from agent.services.query_sampler import query_sampler
+
+
+class FakeConnection:
+    """Отвечает на запрос к pg_class оценкой числа строк из словаря (None - не таблица)."""
+
+    def __init__(self, table_rows):
+        self.table_rows = table_rows
+
+    def execute(self, statement, params=None):
+        value = self.table_rows.get(params["relation"])
+        return type("Result", (), {"scalar": lambda self: value})()
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    monkeypatch.setattr(settings, "SQL_APPROX_MIN_TABLE_ROWS", 1_000_000)
+    monkeypatch.setattr(settings, "SQL_APPROX_SAMPLE_METHOD", "SYSTEM")
+    return FakeConnection({"orders": 50_000_000, "customers": 2_000_000, "regions": 20})
+
+
+def test_samples_largest_table_and_scales_aggregates(connection):
+    sql, sampling = query_sampler.rewrite(
+        connection,
+        "SELECT c.region, count(*), coalesce(sum(o.amount), 0) AS total, avg(o.amount) "
+        "FROM orders o JOIN customers c ON c.id = o.customer_id GROUP BY c.region",
+        ApproximateOptions(fraction=0.01),
+    )
+
+    assert "FROM orders o TABLESAMPLE SYSTEM (1) JOIN customers c ON" in sql
+    # Имя столбца count(*) сохраняется, avg не масштабируется
+    assert "round(count(*) * 100.0)::bigint AS count," in sql
+    assert "coalesce((sum(o.amount) * 100.0), 0) AS total, avg(o.amount)" in sql
+    assert (sampling.relation, sampling.scale_factor, sampling.scaled_aggregates) == ("orders", 100.0, 2)
+
+
+def test_only_first_aggregation_level_is_scaled(connection):
+    sql, sampling = query_sampler.rewrite(
+        connection,
+        "SELECT sum(n), count(DISTINCT status) FROM (SELECT status, count(*) n FROM orders GROUP BY status) s",
+        ApproximateOptions(rows=500_000),
+    )
+
+    assert sql == (
+        "SELECT sum(n), count(DISTINCT status) FROM "
+        "(SELECT status, round(count(*) * 100.0)::bigint n FROM orders TABLESAMPLE SYSTEM (1) GROUP BY status) s"
+    )
+    assert sampling.percent == 1.0
+
+
+def test_small_tables_and_ctes_are_not_sampled(connection):
+    query = "WITH orders AS (SELECT * FROM regions) SELECT count(*), extract(year FROM now()) FROM orders"
+    sql, sampling = query_sampler.rewrite(connection, query, ApproximateOptions(fraction=0.1))
+
+    assert sql == query
+    assert sampling.relation is None and sampling.scale_factor == 1.0
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT count(*) FROM regions r WHERE r.id IN (SELECT region_id FROM orders)",
+    "SELECT count(*), (SELECT max(amount) FROM orders) FROM regions",
+    "SELECT r.name, count(o.id) FROM regions r LEFT JOIN orders o ON o.region_id = r.id GROUP BY r.name",
+    "SELECT r.name, count(o.id) FROM orders o RIGHT OUTER JOIN regions r ON o.region_id = r.id GROUP BY r.name",
+])
+def test_tables_outside_aggregated_from_are_not_sampled(connection, query):
+    sql, sampling = query_sampler.rewrite(connection, query, ApproximateOptions(fraction=0.01))
+
+    assert sql == query
+    assert sampling.relation is None and sampling.scale_factor == 1.0
+    assert "orders" in sampling.message
+
+
+def test_subquery_table_is_skipped_for_outer_table(connection):
+    sql, sampling = query_sampler.rewrite(
+        connection,
+        "SELECT count(*) FROM customers c WHERE EXISTS (SELECT 1 FROM orders o WHERE o.customer_id = c.id)",
+        ApproximateOptions(fraction=0.01),
+    )
+
+    assert sql.startswith("SELECT round(count(*) * 100.0)::bigint AS count FROM customers c TABLESAMPLE SYSTEM (1) WHERE")
+    assert "FROM orders o WHERE" in sql
+    assert sampling.relation == "customers"
+
+
+def test_scale_factor_matches_written_percent(connection):
+    sql, sampling = query_sampler.rewrite(connection, "SELECT sum(amount) FROM orders", ApproximateOptions(fraction=1 / 3))
+
+    assert "TABLESAMPLE SYSTEM (33.3333)" in sql
+    assert sampling.percent == 33.3333
+    assert sampling.scale_factor == 100 / 33.3333
+    assert f"(sum(amount) * {100 / 33.3333!r}) AS sum" in sql
@@ -0,0 +1,40 @@
+# tests/unit/test_read_table_fast.py
+import io
+import sys
+from collections import namedtuple
+from decimal import Decimal
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# run_sandbox.py работает в контейнере рядом с sql_safety_check.py (см. Dockerfile песочницы)
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / "agent" / "sandbox"), str(ROOT / "agent" / "services")]
+
+from run_sandbox import COPY_NULL_MARKER, convert_numpy, copy_column_type, copy_convert_options  # noqa: E402
+
+Column = namedtuple("Column", "name type_code precision scale")
+
+
+def _parse(csv_text: str, column_types: dict) -> pa.Table:
+    read_options = pa_csv.ReadOptions(column_names=list(column_types))
+    return pa_csv.read_csv(io.BytesIO(csv_text.encode()), read_options=read_options, convert_options=copy_convert_options(column_types))
+
+
+def test_only_unquoted_marker_is_null():
+    # Так COPY ... WITH (FORMAT csv, NULL '\N') пишет NULL, пустую строку и строку '\N'
+    table = _parse(f'{COPY_NULL_MARKER}\n""\n"{COPY_NULL_MARKER}"\nabc\n', {"name": pa.string()})
+
+    assert table.column("name").to_pylist() == [None, "", COPY_NULL_MARKER, "abc"]
+
+
+def test_numeric_keeps_precision():
+    columns = [Column("price", 1700, 20, 4), Column("amount", 1700, None, None), Column("ratio", 701, None, None)]
+    column_types = {c.name: copy_column_type(c) for c in columns}
+
+    assert column_types == {"price": pa.decimal128(20, 4), "amount": pa.string(), "ratio": pa.float64()}
+    table = _parse(f"1234567890123456.7891,12345678901234567890.123456789,0.5\n{COPY_NULL_MARKER},{COPY_NULL_MARKER},{COPY_NULL_MARKER}\n", column_types)
+    assert table.column("price").to_pylist() == [Decimal("1234567890123456.7891"), None]
+    assert table.column("amount").to_pylist() == ["12345678901234567890.123456789", None]
+    assert convert_numpy(Decimal("1234567890123456.7891")) == "1234567890123456.7891"
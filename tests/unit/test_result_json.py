@@ -0,0 +1,68 @@
+# tests/unit/test_result_json.py
+import datetime
+import decimal
+import json
+
+import numpy as np
+import pandas as pd
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from agent.schemas import EnrichedExecutionResult, PipelineResult
+from agent.services.result_builder import build_enriched_response_from_df
+from agent.services.result_json import encode_pipeline_result, encode_result
+
+
+def _through_model(result, model=EnrichedExecutionResult):
+    """Ответ, который FastAPI собрал бы по аннотации эндпоинта."""
+    app = FastAPI()
+
+    @app.get("/", response_model=model)
+    def endpoint():
+        return result
+
+    return TestClient(app).get("/").json()
+
+
+def _result():
+    df = pd.DataFrame({
+        "id": [1, 2],
+        "amount": [1.5, np.nan],
+        "created_at": pd.to_datetime(["2024-01-01 10:00:00.123", "2024-01-02 00:00:00.000"]),
+        "at_utc": pd.to_datetime(["2024-01-01", "2024-01-02"]).tz_localize("UTC"),
+    })
+    result = build_enriched_response_from_df(df, exec_time_ms=1.0)
+    for row, value in zip(result["data"]["rows"], [decimal.Decimal("1.50"), None]):
+        row.append(value)
+    result["data"]["columns"].append("price")
+    result["data"]["rows"][0].append(datetime.timedelta(seconds=90))
+    result["data"]["rows"][1].append(None)
+    result["data"]["columns"].append("duration")
+    result["cache_key"] = "k"
+    result["internal"] = "dropped by the model"
+    return result
+
+
+def test_encoded_result_matches_model_response():
+    result = _result()
+    encoded = json.loads(encode_result(result))
+
+    assert encoded == _through_model(result)
+    assert "internal" not in encoded
+    assert encoded["data"]["rows"][1][1] is None  # NaN -> null
+    assert encoded["data"]["rows"][0][4] == "1.50"
+
+
+def test_encoded_pipeline_result_matches_model_response():
+    result = {"execution_time_ms": 2.0, "outputs": {"a": _result()}, "steps": {"a": {"row_count": 2, "execution_time_ms": 1.0}}}
+
+    assert json.loads(encode_pipeline_result(result)) == _through_model(result, PipelineResult)
+
+
+def test_nullable_integer_column():
+    # Такие столбцы приходят из частей partition_by через parquet
+    df = pd.DataFrame({"clicks": pd.array([3, None], dtype="Int64")})
+    encoded = json.loads(encode_result(build_enriched_response_from_df(df, exec_time_ms=1.0)))
+
+    assert encoded["data"]["rows"] == [[3], [None]]
+    assert encoded["metadata"]["result_schema"][0]["stats"]["std_dev"] is None
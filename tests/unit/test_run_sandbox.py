@@ -0,0 +1,35 @@
+# tests/unit/test_run_sandbox.py
+import json
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(ROOT / "agent" / "sandbox"), str(ROOT / "agent" / "services")]
+
+import run_sandbox  # noqa: E402
+
+
+def test_parquet_io_keeps_column_types(tmp_path, monkeypatch, capsys):
+    inputs = tmp_path / "inputs"
+    inputs.mkdir()
+    pd.DataFrame({
+        "day": pd.to_datetime(["2024-01-01", "2024-01-02"]),
+        "clicks": pd.array([3, None], dtype="Int64"),
+    }).to_parquet(inputs / "events.parquet", index=False)
+    result_path = tmp_path / "result.parquet"
+    monkeypatch.setenv("PYTHON_CODE_TO_EXECUTE", "result_df = input_data['events'].assign(double=lambda df: df.clicks * 2)")
+    monkeypatch.setenv("INPUT_PARQUET_DIR", str(inputs))
+    monkeypatch.setenv("RESULT_PARQUET_PATH", str(result_path))
+    monkeypatch.delenv("INPUT_DATA_JSON", raising=False)
+
+    run_sandbox.main()
+
+    response = json.loads(capsys.readouterr().out)
+    assert response["metadata"]["row_count"] == 2
+    assert response["data"] == {"columns": ["day", "clicks", "double"], "rows": []}
+    result = pd.read_parquet(result_path)
+    assert str(result["day"].dtype) == "datetime64[ns]"
+    assert str(result["double"].dtype) == "Int64"
+    assert result["double"].isna().tolist() == [False, True]
@@ -0,0 +1,109 @@
+# tests/unit/test_sandbox_scheduler.py
+import asyncio
+
+import pytest
+
+from agent.config import SandboxResourceClass
+from agent.services.sandbox_scheduler import (
+    SandboxScheduler, SandboxQueueFullError, SandboxQueueTimeoutError, PRIORITY_BACKGROUND,
+    resource_weight, select_resource_class, next_resource_class,
+)
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return SandboxScheduler(slots=1, queue_limit=2, queue_timeout=1.0, lock_dir=tmp_path)
+
+
+@pytest.mark.asyncio
+async def test_slots_are_shared_between_scheduler_instances(scheduler, tmp_path):
+    """Слот, занятый одним экземпляром (воркером), недоступен другому."""
+    other_worker = SandboxScheduler(slots=1, queue_limit=2, queue_timeout=0.2, lock_dir=tmp_path)
+    async with scheduler.slot():
+        assert other_worker.busy_slots() == 1
+        with pytest.raises(SandboxQueueTimeoutError):
+            async with other_worker.slot():
+                pass
+    assert other_worker.busy_slots() == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_full_is_rejected_with_retry_after(scheduler):
+    async with scheduler.slot():
+        waiters = [asyncio.create_task(scheduler._acquire(0, None)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(SandboxQueueFullError) as exc_info:
+            async with scheduler.slot():
+                pass
+        assert exc_info.value.retry_after >= 1
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+    assert scheduler.metrics()["rejected_total"] == 1
+    assert scheduler.metrics()["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_overtake_background(scheduler):
+    order = []
+
+    async def run(name, priority):
+        async with scheduler.slot(priority=priority):
+            order.append(name)
+
+    async with scheduler.slot():
+        background = asyncio.create_task(run("background", PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(run("interactive", 0))
+        await asyncio.sleep(0.01)
+    await asyncio.gather(background, interactive)
+
+    assert order == ["interactive", "background"]
+
+
+@pytest.mark.asyncio
+async def test_heavy_sandbox_takes_several_slots(tmp_path):
+    scheduler = SandboxScheduler(slots=3, queue_limit=2, queue_timeout=0.2, lock_dir=tmp_path)
+    async with scheduler.slot(weight=2):
+        assert scheduler.busy_slots() == 2
+        async with scheduler.slot():
+            assert scheduler.busy_slots() == 3
+        # Двум слотам не хватает места, пока первая песочница работает
+        with pytest.raises(SandboxQueueTimeoutError):
+            async with scheduler.slot(weight=2):
+                pass
+        assert scheduler.busy_slots() == 2
+    # Песочница тяжелее бюджета хоста не запускается: ее ресурсы не были бы учтены
+    with pytest.raises(ValueError):
+        async with scheduler.slot(weight=10):
+            pass
+    assert scheduler.busy_slots() == 0
+
+
+def test_resource_class_selection():
+    assert resource_weight(SandboxResourceClass(memory_mb=256, cpus=0.5, timeout_seconds=1)) == 1
+    assert resource_weight(SandboxResourceClass(memory_mb=4096, cpus=2, timeout_seconds=1)) == 16
+
+    assert select_resource_class(0)[0] == "small"
+    assert select_resource_class(100 * 1024**2)[0] == "medium"
+    assert select_resource_class(100 * 1024**3)[0] == "large"
+    assert select_resource_class(0, "large")[0] == "large"
+    with pytest.raises(ValueError):
+        select_resource_class(0, "huge")
+
+    assert next_resource_class("small") == "medium"
+    assert next_resource_class("large") is None
+
+
+def test_resource_classes_heavier_than_host_are_not_used():
+    # small - 1 слот, medium - 4, large - 16
+    assert select_resource_class(100 * 1024**3, max_weight=4)[0] == "medium"
+    assert select_resource_class(0, max_weight=4)[0] == "small"
+    assert select_resource_class(0, "medium", max_weight=4)[0] == "medium"
+    with pytest.raises(ValueError, match="16"):
+        select_resource_class(0, "large", max_weight=4)
+    with pytest.raises(ValueError):
+        select_resource_class(0, max_weight=0)
+
+    assert next_resource_class("small", max_weight=4) == "medium"
+    assert next_resource_class("medium", max_weight=4) is None
@@ -0,0 +1,47 @@
+# tests/unit/test_session_manager.py
+import pytest
+
+from agent.config import settings
+from agent.services import session_manager as session_module
+from agent.services.docker_async import DockerAPIError
+from agent.services.sandbox_scheduler import SandboxScheduler, resource_weight
+from agent.services.session_manager import SandboxSessionManager, session_resources
+
+
+def test_session_resources_accept_fractional_limits(monkeypatch):
+    monkeypatch.setattr(settings, "SESSION_MEM_LIMIT", "1.5g")
+    assert session_resources().memory_mb == 1536
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [DockerAPIError(500, "boom"), RuntimeError("boom")])
+async def test_failed_start_removes_container_and_releases_slots(monkeypatch, tmp_path, error):
+    scheduler = SandboxScheduler(slots=resource_weight(session_resources()), queue_limit=1, queue_timeout=0.2, lock_dir=tmp_path)
+    removed = []
+
+    async def create_container(*args, **kwargs):
+        return "container-1"
+
+    async def start_container(container_id):
+        raise error
+
+    async def remove_container(container_id):
+        removed.append(container_id)
+
+    monkeypatch.setattr(settings, "AGENT_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "DOCKER_NETWORK", "bridge")
+    monkeypatch.setattr(session_module, "sandbox_scheduler", scheduler)
+    monkeypatch.setattr(session_module.async_docker, "create_container", create_container)
+    monkeypatch.setattr(session_module.async_docker, "start_container", start_container)
+    monkeypatch.setattr(session_module.async_docker, "remove_container", remove_container)
+
+    manager = SandboxSessionManager()
+    if isinstance(error, DockerAPIError):
+        result = await manager.create()
+        assert result["error"]["type"] == "EXECUTION_ERROR"
+    else:
+        with pytest.raises(RuntimeError):
+            await manager.create()
+    assert removed == ["container-1"]
+    assert scheduler.busy_slots() == 0
+    assert manager._leases == {}
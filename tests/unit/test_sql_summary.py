@@ -0,0 +1,72 @@
+# tests/unit/test_sql_summary.py
+import datetime
+from decimal import Decimal
+
+from agent.services.sql_summary import build_summary_query, sql_summarizer
+
+NUMERIC_OID, TEXT_OID, TIMESTAMP_OID = 1700, 25, 1114
+
+
+def test_summary_query_aggregates_by_column_kind():
+    query = build_summary_query(
+        'SELECT amount, "my ""note""", created_at FROM orders;',
+        [("amount", "float64", "numeric"), ('my "note"', "object", "other"), ("created_at", "datetime64[ns]", "datetime")],
+    )
+    assert query.startswith("WITH _q AS (\nSELECT amount, \"my \"\"note\"\"\", created_at FROM orders\n)")
+    assert 'stddev_samp(_q."amount")::float8 AS c0_std' in query
+    # Уникальные значения нечисловых столбцов считаются по тексту, min/max для них нет
+    assert 'count(DISTINCT _q."my ""note"""::text) AS c1_distinct' in query
+    assert "c1_min" not in query
+    assert 'max(_q."created_at") AS c2_max' in query and "c2_mean" not in query
+
+
+class FakeResult:
+    def __init__(self, rows=None, description=None, aggregates=None):
+        self.rows, self.aggregates = rows, aggregates
+        self.cursor = type("Cursor", (), {"description": description})()
+
+    def keys(self):
+        return [column[0] for column in self.cursor.description]
+
+    def fetchall(self):
+        return self.rows
+
+    def mappings(self):
+        return type("Mappings", (), {"one": lambda _: self.aggregates})()
+
+
+class FakeConnection:
+    """Отвечает на запрос строк-примеров и на агрегатный запрос заранее заданными результатами."""
+
+    def __init__(self, sample, aggregates):
+        self.sample, self.aggregates = sample, aggregates
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        return self.aggregates if str(statement).startswith("WITH _q") else self.sample
+
+
+def test_summarize_builds_stats_from_one_aggregate_row():
+    sample = FakeResult(
+        rows=[(Decimal("10.5"), "a", datetime.datetime(2024, 1, 1))],
+        description=[("amount", NUMERIC_OID), ("note", TEXT_OID), ("created_at", TIMESTAMP_OID)],
+    )
+    aggregates = FakeResult(aggregates={
+        "row_count": 1000,
+        "c0_count": 990, "c0_distinct": 500, "c0_min": Decimal("0.5"), "c0_max": Decimal("99"),
+        "c0_mean": 42.0, "c0_std": 3.0,
+        "c1_count": 1000, "c1_distinct": 3,
+        "c2_count": 1000, "c2_distinct": 900,
+        "c2_min": datetime.datetime(2024, 1, 1), "c2_max": datetime.datetime(2024, 6, 30, 12),
+    })
+    connection = FakeConnection(sample, aggregates)
+
+    rows, row_count, schema = sql_summarizer.summarize(connection, "SELECT * FROM orders", {}, sample_rows=1)
+
+    assert connection.statements[0].endswith("AS _sample LIMIT 1")
+    assert row_count == 1000 and len(rows) == 1
+    amount, note, created_at = (column.stats for column in schema)
+    assert (amount.min, amount.max, amount.mean, amount.null_count) == (0.5, 99.0, 42.0, 10)
+    assert (note.unique_count, note.null_count, note.min) == (3, 0, None)
+    assert created_at.max == "2024-06-30 12:00:00"
@@ -0,0 +1,65 @@
+# tests/unit/test_step_memo.py
+import json
+
+import pandas as pd
+import pytest
+
+from agent.services.data_cache import agent_cache
+from agent.services.step_memo import StepMemo, memo_key, reads_database
+
+
+@pytest.fixture
+def memo(cache_dir):
+    return StepMemo(cache_dir / "memo")
+
+
+def test_key_ignores_whitespace_but_not_inputs_or_image():
+    inputs = {"df": "cache:abc:0"}
+    key = memo_key("result_df = input_data['df']\n", inputs, "sha256:1")
+    assert key == memo_key("\nresult_df = input_data['df']   \n\n", inputs, "sha256:1")
+    assert key != memo_key("result_df = input_data['df']", {"df": "cache:abc:1"}, "sha256:1")
+    assert key != memo_key("result_df = input_data['df']", inputs, "sha256:2")
+    assert key != memo_key("result_df = input_data['df']", inputs, "sha256:1", {"partition_by": {"input": "df"}})
+
+
+def test_db_reading_code_is_detected():
+    assert reads_database("conn = get_db_connection()\nresult_df = pd.read_sql('SELECT 1', conn)")
+    assert not reads_database("result_df = input_data['df'].head()")
+
+
+def test_hit_requires_cached_result(memo):
+    cache_key = agent_cache.save(pd.DataFrame({"x": [1]}))
+    memo.put("k", {"status": "success", "cache_key": cache_key, "metadata": {"row_count": 1}})
+    assert memo.get("k")["cache_key"] == cache_key
+
+    agent_cache.delete(cache_key)
+    assert memo.get("k") is None
+    assert memo.get("missing") is None
+
+
+def test_rows_are_stored_only_in_data_cache(memo):
+    cache_key = agent_cache.save(pd.DataFrame({"x": [1, 2], "day": pd.to_datetime(["2024-01-01", None])}))
+    memo.put("k", {
+        "status": "success", "cache_key": cache_key, "metadata": {"row_count": 2},
+        "data": {"columns": ["x", "day"], "rows": [[1, "2024-01-01"], [2, None]]},
+    })
+
+    assert "data" not in json.loads((memo.directory / "k.json").read_text(encoding="utf-8"))
+    result = memo.get("k")
+    assert result["data"]["columns"] == ["x", "day"]
+    assert [row[0] for row in result["data"]["rows"]] == [1, 2]
+    assert result["data"]["rows"][1][1] is None
+    assert result["metadata"] == {"row_count": 2}
+
+
+def test_missing_input_has_no_ref(memo):
+    with pytest.raises(FileNotFoundError):
+        memo.input_ref("00000000-0000-0000-0000-000000000000")
+
+
+def test_incremental_version_changes_input_ref(memo):
+    cache_key = agent_cache.save(pd.DataFrame({"x": [1]}))
+    before = memo.input_ref(cache_key)
+    agent_cache.write_meta(cache_key, {"version": 2})
+    assert memo.input_ref(cache_key) != before
+    assert memo.content_ref({"a": 1, "b": 2}) == memo.content_ref({"b": 2, "a": 1})